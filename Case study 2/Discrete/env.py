@@ -1,20 +1,91 @@
 import os
 import numpy as np
 import time
+import itertools
 from Simulation import *
 import copy
 from gym import Env
 from gym.spaces import Discrete, Box, Dict
 from gym.utils import seeding
 
+# Tag of the stored results, bumped when the stored episodes change so that older stores are not read
+RESULT_VERSION = 2
+
+# Discrete actions: unit type and the grid of its parameters, actions follow this order and
+# the product of the axes (the last one varies fastest)
+ACTION_GRIDS = (
+    ("mixer", ()),
+    ("pump", ()),
+    ("heater", ((150, 275, 400),)),                         # T
+    ("cooler", ((5, 25, 50),)),                             # T
+    ("pfr", ((0.5, 2, 3.5), (6.5, 9.25, 12))),              # D, L
+    ("apfr", ((0.5, 2, 3.5), (6.5, 9.25, 12))),             # D, L
+    ("column", ((15, 20, 25), (80, 85, 95))),               # stages, distillate rate
+    ("column_r", ((15, 20, 25), (20, 40, 60), (0.7, 0.85, 0.95))),                  # ... recycle ratio
+    ("tricolumn", ((15, 20, 25), (80, 85, 95), (20, 40, 60))),                      # ... side draw rate
+    ("tricolumn_r", ((15, 20, 25), (80, 85, 95), (20, 40, 60), (0.7, 0.85, 0.95))))  # ... recycle ratio
+
+
+class ActionTable():
+    """Action space generated from a grid per unit type. unit[a] is the type code of action a,
+    params[a] its parameters (NaN padded), values[a] the same as a tuple and ranges[name] the
+    (start, stop) of the actions of each type."""
+
+    def __init__(self, grids):
+        self.names = [name for name, _ in grids]
+        self.ranges = {}
+        self.values = []
+        units = []
+        for code, (name, axes) in enumerate(grids):
+            start = len(self.values)
+            for values in itertools.product(*axes):
+                self.values.append(values)
+                units.append(code)
+            self.ranges[name] = (start, len(self.values))
+        self.size = len(self.values)
+        width = max(len(axes) for _, axes in grids)
+        self.unit = np.array(units, dtype=np.int32)
+        self.params = np.full((self.size, width), np.nan)
+        for action, values in enumerate(self.values):
+            self.params[action, :len(values)] = values
+
+    def decode(self, action):
+        return self.names[self.unit[action]], self.values[action]
+
+    def mask(self, *names):
+        mask = np.zeros((self.size,), dtype=np.int32)
+        for name in names:
+            mask[slice(*self.ranges[name])] = 1
+        return mask
+
+
 class Flowsheet(Env):
-    def __init__(self, sim, pure, max_iter, inlet_specs):
+    def __init__(self, sim, pure, max_iter, inlet_specs, prefix_cache=None, result_cache=None, grids=ACTION_GRIDS,
+                 validate=0.1, validate_final=True, prescreen=False):
 
         # Establish connection with ASPEN
         self.sim = sim
 
+        # Optional PrefixCache, steps along an already simulated action prefix are replayed.
+        # An optional ResultCache keeps the steps across runs (it needs a trie to replay them)
+        if result_cache is not None and prefix_cache is None:
+            prefix_cache = PrefixCache(snapshots=False)
+        self.prefix_cache = prefix_cache
+        self.result_cache = result_cache
+
+        # Multi-fidelity (sim with a Surrogate): steps go through the surrogates, a fraction validate
+        # of them and, with validate_final, the final flowsheet of each episode go to the engine.
+        # The caches are not used in this mode
+        self.validate = validate
+        self.validate_final = validate_final
+
+        # With prescreen, column actions whose specs fail the shortcut model (shortcut_column)
+        # on the current stream are masked before any rigorous run
+        self.prescreen = prescreen
+
         # Characteristics of the environment
-        self.d_actions = 2 + 6 + 18 + 9 + 27 + 27 + 81
+        self.actions = ActionTable(grids)
+        self.d_actions = self.actions.size
         self.pure = pure
         self.max_iter = max_iter
         self.iter = 0
@@ -35,81 +106,18 @@ class Flowsheet(Env):
         self.avail_actions = np.zeros(self.d_actions, )
 
 
-        # Actions dictionaries
-
-        # Heater
-        self.heaters = {2: 150, 3: 275, 4: 400}
+        # Masks of each value step, for the distillation step keyed by (mixer, column) in the
+        # units placed since the last recycle
+        self.step_masks = {
+            "reac": self.actions.mask("pfr", "apfr"),
+            "cool": self.actions.mask("cooler"),
+            ("distill", False, False): self.actions.mask("column", "tricolumn"),
+            ("distill", False, True): self.actions.mask("column", "tricolumn"),
+            ("distill", True, False): self.actions.mask("column", "tricolumn_r"),
+            ("distill", True, True): self.actions.mask("column_r")}
+        self.open_mixers = 0
+        self.open_columns = 0
 
-        # Cooler
-        self.coolers = {5: 5, 6: 25, 7: 50}
-
-        # PFR
-        self.pfrs = {8: (0.5, 6.5), 9: (0.5, 9.25), 10: (0.5, 12),
-                11: (2, 6.5), 12: (2, 9.25), 13: (2, 12),
-                14: (3.5, 6.5), 15: (3.5, 9.25), 16: (3.5, 12)}
-        
-        # Adiabatic PFR
-        self.apfrs = {17: (0.5, 6.5), 18: (0.5, 9.25), 19: (0.5, 12),
-                20: (2, 6.5), 21: (2, 9.25), 22: (2, 12),
-                23: (3.5, 6.5), 24: (3.5, 9.25), 25: (3.5, 12)}
-        
-        # Column 
-        self.columns = {26: (15, 80), 27: (15, 85), 28: (15, 95),
-                   29: (20, 80), 30: (20, 85), 31: (20, 95),
-                   32: (25, 80), 33: (25, 85), 34: (25, 95)}
-        
-        # Column with recycle
-        self.columns_r = {35: (15, 20, 0.7), 36: (15, 20, 0.85), 37: (15, 20, 0.95),
-                     38: (15, 40, 0.7), 39: (15, 40, 0.85), 40: (15, 40, 0.95),
-                     41: (15, 60, 0.7), 42: (15, 60, 0.85), 43: (15, 60, 0.95),
-                     44: (20, 20, 0.7), 45: (20, 20, 0.85), 46: (20, 20, 0.95),
-                     47: (20, 40, 0.7), 48: (20, 40, 0.85), 49: (20, 40, 0.95),
-                     50: (20, 60, 0.7), 51: (20, 60, 0.85), 52: (20, 60, 0.95),
-                     53: (25, 20, 0.7), 54: (25, 20, 0.85), 55: (25, 20, 0.95),
-                     56: (25, 40, 0.7), 57: (25, 40, 0.85), 58: (25, 40, 0.95),
-                     59: (25, 60, 0.7), 60: (25, 60, 0.85), 61: (25, 60, 0.95)}
-
-        # Tri-column
-        self.tricolumns = {62: (15, 80, 20), 63: (15, 80, 40), 64: (15, 80, 60),
-                      65: (15, 85, 20), 66: (15, 85, 40), 67: (15, 85, 60),
-                      68: (15, 95, 20), 69: (15, 95, 40), 70: (15, 95, 60),
-                      71: (20, 80, 20), 72: (20, 80, 40), 73: (20, 80, 60),
-                      74: (20, 85, 20), 75: (20, 85, 40), 76: (20, 85, 60),
-                      77: (20, 95, 20), 78: (20, 95, 40), 79: (20, 95, 60),
-                      80: (25, 80, 20), 81: (25, 80, 40), 82: (25, 80, 60),
-                      83: (25, 85, 20), 84: (25, 85, 40), 85: (25, 85, 60),
-                      86: (25, 95, 20), 87: (25, 95, 40), 88: (25, 95, 60)}
-        
-        # Tri-column recycle
-        self.tricolumns_r = {89: (15, 80, 20, 0.7), 90: (15, 80, 20, 0.85), 91: (15, 80, 20, 0.95),
-                        92: (15, 80, 40, 0.7), 93: (15, 80, 40, 0.85), 94: (15, 80, 40, 0.95),
-                        95: (15, 80, 60, 0.7), 96: (15, 80, 60, 0.85), 97: (15, 80, 60, 0.95),
-                        98: (15, 85, 20, 0.7), 99: (15, 85, 20, 0.85), 100: (15, 85, 20, 0.95),
-                        101: (15, 85, 40, 0.7), 102: (15, 85, 40, 0.85), 103: (15, 85, 40, 0.95),
-                        104: (15, 85, 60, 0.7), 105: (15, 85, 60, 0.85), 106: (15, 85, 60, 0.95),
-                        107: (15, 95, 20, 0.7), 108: (15, 95, 20, 0.85), 109: (15, 95, 20, 0.95),
-                        110: (15, 95, 40, 0.7), 111: (15, 95, 40, 0.85), 112: (15, 95, 40, 0.95),
-                        113: (15, 95, 60, 0.7), 114: (15, 95, 60, 0.85), 115: (15, 95, 60, 0.95),
-                        116: (20, 80, 20, 0.7), 117: (20, 80, 20, 0.85), 118: (20, 80, 20, 0.95),
-                        119: (20, 80, 40, 0.7), 120: (20, 80, 40, 0.85), 121: (20, 80, 40, 0.95),
-                        122: (20, 80, 60, 0.7), 123: (20, 80, 60, 0.85), 124: (20, 80, 60, 0.95),
-                        125: (20, 85, 20, 0.7), 126: (20, 85, 20, 0.85), 127: (20, 85, 20, 0.95),
-                        128: (20, 85, 40, 0.7), 129: (20, 85, 40, 0.85), 130: (20, 85, 40, 0.95),
-                        131: (20, 85, 60, 0.7), 132: (20, 85, 60, 0.85), 133: (20, 85, 60, 0.95),
-                        134: (20, 95, 20, 0.7), 135: (20, 95, 20, 0.85), 136: (20, 95, 20, 0.95),
-                        137: (20, 95, 40, 0.7), 138: (20, 95, 40, 0.85), 139: (20, 95, 40, 0.95),
-                        140: (20, 95, 60, 0.7), 141: (20, 95, 60, 0.85), 142: (20, 95, 60, 0.95),
-                        143: (25, 80, 20, 0.7), 144: (25, 80, 20, 0.85), 145: (25, 80, 20, 0.95),
-                        146: (25, 80, 40, 0.7), 147: (25, 80, 40, 0.85), 148: (25, 80, 40, 0.95),
-                        149: (25, 80, 60, 0.7), 150: (25, 80, 60, 0.85), 151: (25, 80, 60, 0.95),
-                        152: (25, 85, 20, 0.7), 153: (25, 85, 20, 0.85), 154: (25, 85, 20, 0.95),
-                        155: (25, 85, 40, 0.7), 156: (25, 85, 40, 0.85), 157: (25, 85, 40, 0.95),
-                        158: (25, 85, 60, 0.7), 159: (25, 85, 60, 0.85), 160: (25, 85, 60, 0.95),
-                        161: (25, 95, 20, 0.7), 162: (25, 95, 20, 0.85), 163: (25, 95, 20, 0.95),
-                        164: (25, 95, 40, 0.7), 165: (25, 95, 40, 0.85), 166: (25, 95, 40, 0.95),
-                        167: (25, 95, 60, 0.7), 168: (25, 95, 60, 0.85), 169: (25, 95, 60, 0.95)}
-        
-        
         self.mixer_count = 0
         self.hex_count = 0
         self.cooler_count = 0
@@ -151,13 +159,135 @@ class Flowsheet(Env):
      
         
 
+    # Attributes that describe the episode so far (stored in the prefix cache)
+    episode_attrs = ("iter", "actions_list", "info", "state", "done", "avail_actions", "value_step",
+                     "mixer_count", "hex_count", "cooler_count", "pump_count", "reac_count", "column_count",
+                     "open_mixers", "open_columns",
+                     "water_pure", "dme_pure", "dme_extra_added", "dme_out")
+
+    def save_episode(self):
+        return {attr: copy.deepcopy(getattr(self, attr), {id(self.sim): self.sim}) for attr in self.episode_attrs}
+
+    def load_episode(self, episode):
+        for attr, value in episode.items():
+            setattr(self, attr, copy.deepcopy(value, {id(self.sim): self.sim}))
+
     def step(self, action, sin):
+        if self.sim.surrogate is not None:
+            return self.surrogate_step(action, sin)
+        if self.prefix_cache is None:
+            return self.simulate(action, sin)
+
+        node = self.prefix_cache.lookup(self.cache_node, action)
+        if node is None and self.result_cache is not None:
+            node = self.load_result(action)
+        if node is not None:
+            # Prefix already simulated: replay it, streams are read from the stored results
+            self.cache_node = node
+            self.load_episode(node.episode)
+            self.sim.results = node.results
+            reward, sout = node.outcome
+            return self.state, reward, self.done, self.info, sout
+
+        # Bring the engine to the deepest cached prefix before simulating the new unit
+        self.sync_engine()
+        self.sim.results = None
+        state, reward, done, info, sout = self.simulate(action, sin)
+        if self.sim.failure is not None:
+            # Failed runs (timeouts, engine crashes) are not cached
+            self.engine_node = None
+            return state, reward, done, info, sout
+
+        node = self.prefix_cache.insert(self.cache_node, action, (self.engine_node,), self.sim.Archives())
+        if not done and self.prefix_cache.snapshots:
+            node.snapshot = self.sim.SaveSnapshot(self.prefix_cache.snapshot_path())
+            node.results = node.snapshot["results"]
+        else:
+            node.results = self.sim.StreamResults()
+        node.outcome = (reward, sout)
+        node.episode = self.save_episode()
+        self.cache_node = self.engine_node = node
+        if self.result_cache is not None:
+            record = {
+                "results": node.results,
+                "outcome": node.outcome,
+                "episode": node.episode,
+            }
+            self.result_cache.put(self.result_key(node), record, self.actions_list)
+        return state, reward, done, info, sout
+
+    def surrogate_step(self, action, sin):
+        self.sim.fidelity = "engine" if self.np_random.random() < self.validate else "surrogate"
+        state, reward, done, info, sout = self.simulate(action, sin)
+        # Units the surrogates cannot predict yet go to the engine as well
+        predicted = self.sim.results is not None
+        info["fidelity"] = "surrogate" if predicted else "engine"
+        if done and predicted and self.validate_final:
+            info["validation"] = self.validation(sout)
+        return state, reward, done, info, sout
+
+    def validation(self, sout):
+        # Runs the engine on the flowsheet predicted by the surrogates, its samples are recorded
+        predicted = self.observe(sout)
+        self.sim.fidelity = "engine"
+        self.sim.results = None
+        converged = self.sim.Convergence()
+        validation = {"converged": converged, "surrogate_state": predicted,
+                      "state": self.observe(sout) if converged else None}
+        if not converged:
+            validation["status"] = self.sim.RunStatus()
+        return validation
+
+    def result_key(self, node):
+        flowsheet = ["DME", RESULT_VERSION, self.d_actions] + self.prefix_cache.path(node)
+        return self.result_cache.key(flowsheet, [self.pure, self.max_iter], self.inlet_specs)
+
+    def load_result(self, action):
+        node = self.prefix_cache.insert(self.cache_node, action, (self.engine_node,), self.sim.Archives())
+        record = self.result_cache.get(self.result_key(node), self.sim)
+        if record is None:
+            del self.prefix_cache.lru[id(node)]
+            del self.cache_node.children[node.key]
+            return None
+        node.results = record["results"]
+        node.outcome = record["outcome"]
+        node.episode = record["episode"]
+        return node
+
+    def sync_engine(self):
+        # Walk up to the engine state, a snapshot or the feed, then replay the actions
+        path = []
+        node = self.cache_node
+        while node is not self.engine_node and node.snapshot is None and node.parent:
+            path.append(node)
+            node = node.parent
+        if node is not self.engine_node:
+            if node.snapshot is not None:
+                self.sim.LoadSnapshot(node.snapshot)
+            else:
+                self.sim.Reinitialize()
+                Stream("IN", self.inlet_specs, sim=self.sim)
+        if path:
+            # The replay runs from the episode of the prefix, the current one (masks included) is restored after
+            current = self.save_episode()
+            self.sim.results = None
+            self.load_episode(node.episode)
+            sin = node.outcome[1]
+            for step_node in reversed(path):
+                action = self.prefix_cache.action(step_node.key)
+                sin = self.simulate(action, sin)[4]
+            self.load_episode(current)
+        self.engine_node = self.cache_node
+
+    def simulate(self, action, sin):
         self.iter += 1
+        unit, params = self.actions.decode(action)
       
         # ----------------------------------------- Mixer -----------------------------------------
-        if action == 0:
+        if unit == "mixer":
             self.mixer_count += 1
-            self.avail_actions[0] = 0
+            self.open_mixers += 1
+            self.avail_actions[slice(*self.actions.ranges["mixer"])] = 0
             self.actions_list.append(f"M{self.mixer_count}")
 
             mixer = Mixer(f"M{self.mixer_count}", sin)
@@ -174,9 +304,9 @@ class Flowsheet(Env):
                 cost = f_cost + v_cost # Total cost
         
         # ----------------------------------------- Pump -----------------------------------------
-        elif action == 1:
+        elif unit == "pump":
             self.pump_count += 1
-            self.avail_actions[2] = 0
+            self.avail_actions[slice(*self.actions.ranges["pump"])] = 0
             self.actions_list.append(f"PP{self.pump_count}")
 
             pp = Pump(f"PP{self.pump_count}", 10, sin)
@@ -194,10 +324,10 @@ class Flowsheet(Env):
                 cost = f_cost + v_cost # Total cost
 
         # ----------------------------------------- HEX -----------------------------------------
-        elif action in range(2, 5):
+        elif unit == "heater":
             self.hex_count += 1
             self.actions_list.append(f"HX{self.hex_count}")
-            T_hex = self.heaters[action]
+            T_hex, = params
 
             hex = Heater(f"HX{self.hex_count}", T_hex, sin)
             sout = hex.heat()
@@ -213,10 +343,10 @@ class Flowsheet(Env):
                 
         
         # ----------------------------------------- Cooler -----------------------------------------
-        elif action in range(5, 8):
+        elif unit == "cooler":
             self.cooler_count += 1
             self.actions_list.append(f"C{self.cooler_count}")
-            T_cooler = self.coolers[action]
+            T_cooler, = params
 
             cool = Cooler(f"C{self.cooler_count}", T_cooler, sin)
 
@@ -233,11 +363,11 @@ class Flowsheet(Env):
         
 
         # ----------------------------------------- PFR -----------------------------------------
-        elif action in range(8, 17):
+        elif unit == "pfr":
             self.reac_count += 1
             self.actions_list.append(f"R{self.reac_count}")
 
-            D, L = self.pfrs[action]
+            D, L = params
 
             pfr = PFR(f"R{self.reac_count}", D, L, sin)
     
@@ -253,11 +383,11 @@ class Flowsheet(Env):
                 cost = f_cost + v_cost # Total cost
         
         # ----------------------------------------- Adiabatic PFR -----------------------------------------
-        elif action in range(17, 26):
+        elif unit == "apfr":
             self.reac_count += 1
             self.actions_list.append(f"AR{self.reac_count}")
 
-            D, L = self.apfrs[action]
+            D, L = params
 
             pfr_a = PFR_A(f"AR{self.reac_count}", D, L, sin)
     
@@ -273,22 +403,12 @@ class Flowsheet(Env):
                 cost = f_cost + v_cost # Total cost
         
         # ----------------------------------------- Column -----------------------------------------
-        elif action in range(26, 35):
+        elif unit == "column":
             self.column_count += 1
+            self.open_columns += 1
             self.actions_list.append(f"DC{self.column_count}")
 
-            press = sin.get_press()/2.5
-            nstages, dist_rate = self.columns[action]
-
-            if sin.get_press() > 5 or self.water_pure:
-                distillation_rate = dist_rate
-            else:
-                if dist_rate == 80:
-                    distillation_rate = 20
-                elif dist_rate == 85:
-                    distillation_rate = 40
-                elif dist_rate == 95:
-                    distillation_rate = 60
+            nstages, distillation_rate, _, press, _ = self.column_specs(unit, params, sin)
 
             col = Column(f"DC{self.column_count}", nstages, distillation_rate, 2.5, press, sin)
             
@@ -311,13 +431,13 @@ class Flowsheet(Env):
         
 
         # ----------------------------------------- Column with recycle -----------------------------------------
-        elif action in range(35,62):
+        elif unit == "column_r":
             self.column_count += 1
+            self.open_columns += 1
             self.actions_list.append(f"DCR{self.column_count}")
 
-            nstages, mid_rate, rr = self.columns_r[action]
-
-            press = sin.get_press()/2.5
+            nstages, mid_rate, _, press, _ = self.column_specs(unit, params, sin)
+            rr = params[-1]
 
             col = Column(f"DCR{self.column_count}", nstages, mid_rate, 2.5, press, sin)
             
@@ -325,10 +445,10 @@ class Flowsheet(Env):
             splitter = Splitter(f"S{self.column_count}", rr, d)
             rec, purge = splitter.recycle()
 
-            for i, uo in enumerate(self.actions_list):
-                if "M" in uo:
-                    self.sim.StreamConnect(self.actions_list[i], rec.name, "F(IN)")
-                    break
+            if self.open_mixers:
+                self.sim.StreamConnect(f"M{self.mixer_count}", rec.name, "F(IN)")
+                if self.sim.tear_method is not None:
+                    self.sim.TearStream(rec.name)
 
             self.sim.EngineRun()
 
@@ -338,6 +458,7 @@ class Flowsheet(Env):
                     nstages, mid_rate, rr, self.get_outputs(purge), 
                     self.get_outputs(sout)]
                 self.actions_list.clear()
+                self.open_mixers = self.open_columns = 0
 
                 # Costs --> normalized cost approximation
                 Diam, Height = col.sizing()
@@ -347,13 +468,11 @@ class Flowsheet(Env):
                
 
         # ----------------------------------------- TriColumn -----------------------------------------
-        elif action in range(62,89):
+        elif unit == "tricolumn":
             self.column_count += 1
             self.actions_list.append(f"TC{self.column_count}")
 
-            nstages, dist_rate, mid_rate = self.tricolumns[action]
-
-            press = sin.get_press()/2.5
+            nstages, dist_rate, _, press, mid_rate = self.column_specs(unit, params, sin)
 
             col = TriColumn(f"TC{self.column_count}", nstages, dist_rate, 2.5, press, mid_rate, sin)
             d, mid, sout = col.distill()
@@ -374,13 +493,12 @@ class Flowsheet(Env):
                 cost = f_cost + v_cost # Total cost
         
         # ----------------------------------------- TriColumn with recycle -----------------------------------------
-        elif action in range(89,170):
+        elif unit == "tricolumn_r":
             self.column_count += 1
             self.actions_list.append(f"TCR{self.column_count}")
 
-            nstages, dist_rate, mid_rate, rr = self.tricolumns_r[action]
-
-            press = sin.get_press()/2.5
+            nstages, dist_rate, _, press, mid_rate = self.column_specs(unit, params, sin)
+            rr = params[-1]
 
             col = TriColumn(f"TCR{self.column_count}", nstages, dist_rate, 2.5, press, mid_rate, sin)
             d, mid, sout = col.distill()
@@ -388,15 +506,16 @@ class Flowsheet(Env):
             rec, purge = splitter.recycle()
 
             
-            for i, uo in enumerate(self.actions_list):
-                if "M" in uo:
-                    self.sim.StreamConnect(self.actions_list[i], rec.name, "F(IN)")
-                    break
+            if self.open_mixers:
+                self.sim.StreamConnect(f"M{self.mixer_count}", rec.name, "F(IN)")
+                if self.sim.tear_method is not None:
+                    self.sim.TearStream(rec.name)
 
             self.sim.EngineRun()
             
             if self.sim.Convergence():
                 self.actions_list.clear()
+                self.open_mixers = self.open_columns = 0
 
 
                 self.info[f"TCR{self.column_count}"] = [
@@ -418,7 +537,7 @@ class Flowsheet(Env):
             # Constraints
 
             # Cons 1: (Temperature inside of reactor no greater than 400°C)
-            if action in range(8,26) and sout.get_temp() < 400:
+            if unit in ("pfr", "apfr") and sout.get_temp() < 400:
                 bonus_T = 0.4
             else:
                 bonus_T = 0.
@@ -461,24 +580,62 @@ class Flowsheet(Env):
        
             reward = cost + bonus + bonus_T + penalty + reward_flow + dme_extra
 
-            self.state = np.array([
-                sout.get_temp()/400,
-                sout.get_press()/10,
-                sout.get_molar_flow("METHANOL")/sout.get_total_molar_flow(),
-                sout.get_molar_flow("WATER")/sout.get_total_molar_flow(),
-                sout.get_molar_flow("DME")/sout.get_total_molar_flow(),
-                self.iter/self.max_iter])        
+            self.state = self.observe(sout)
         
         
         else:
             self.done = True
             reward = -8
+            if self.sim.failure is not None:
+                self.info["failure"] = self.sim.failure
+            self.info["status"] = self.sim.RunStatus()
 
         
         # Return step information
         return self.state, reward, self.done, self.info, sout
         
 
+    def observe(self, sout):
+        return np.array([
+            sout.get_temp()/400,
+            sout.get_press()/10,
+            sout.get_molar_flow("METHANOL")/sout.get_total_molar_flow(),
+            sout.get_molar_flow("WATER")/sout.get_total_molar_flow(),
+            sout.get_molar_flow("DME")/sout.get_total_molar_flow(),
+            self.iter/self.max_iter])
+
+    def column_specs(self, unit, params, sin):
+        # (stages, distillate rate, reflux ratio, pressure, side draw rate) of a column action on sin
+        press = sin.get_press()/2.5
+        if unit == "column":
+            nstages, dist_rate = params
+            if not (sin.get_press() > 5 or self.water_pure):
+                dist_rate = {80: 20, 85: 40, 95: 60}.get(dist_rate, dist_rate)
+            return nstages, dist_rate, 2.5, press, 0
+        if unit == "column_r":
+            # The recycle ratio only splits the distillate after the column, it does not change the screen
+            nstages, mid_rate, _ = params
+            return nstages, mid_rate, 2.5, press, 0
+        nstages, dist_rate, mid_rate = params[:3]
+        return nstages, dist_rate, 2.5, press, mid_rate
+
+    def screen_columns(self, sin):
+        # Masks the available column actions whose specs the shortcut model finds infeasible
+        flows = {c: sin.get_molar_flow(c) for c in SHORTCUT_PROPERTIES}
+        vfrac = sin.get_vapor_fraction()
+        screens = {}
+        self.info["prescreen"] = {}
+        for unit in ("column", "column_r", "tricolumn", "tricolumn_r"):
+            for action in range(*self.actions.ranges[unit]):
+                if not self.avail_actions[action]:
+                    continue
+                specs = self.column_specs(unit, self.actions.decode(action)[1], sin)
+                if specs not in screens:
+                    screens[specs] = shortcut_column(flows, vfrac, *specs)
+                if not screens[specs]["feasible"]:
+                    self.avail_actions[action] = 0
+                    self.info["prescreen"][action] = screens[specs]["reason"]
+
     def fixed_cost_reactor(self, D, H):
         M_S = 1638.2  # Marshall & Swift equipment index 2018 (1638.2, fixed)
         f_cost = (M_S)/280 * 101.9 * D**1.066 * H**0.802 * (2.18 + 1.15)
@@ -523,7 +680,7 @@ class Flowsheet(Env):
         T, P, compounds = self.inlet_specs
         Fm, Fw, Fdme = compounds["METHANOL"], compounds["WATER"], compounds["DME"]
         tot_flow = Fw + Fm + Fdme
-        sin  = Stream("IN", self.inlet_specs)
+        sin  = Stream("IN", self.inlet_specs, sim=self.sim)
 
         self.state = np.array([
                 T/400,
@@ -536,10 +693,10 @@ class Flowsheet(Env):
         self.info.clear()
         self.actions_list.clear()
         self.done = False
-        self.avail_actions = np.zeros((self.d_actions), dtype=np.int32)
-        self.avail_actions[0] = 1
-        self.avail_actions[1] = 1
+        self.avail_actions = self.actions.mask("mixer", "pump")
         self.value_step = "pre"
+        self.open_mixers = 0
+        self.open_columns = 0
         
         self.mixer_count = 0
         self.hex_count = 0
@@ -553,6 +710,11 @@ class Flowsheet(Env):
         self.dme_extra_added = False
 
         self.dme_out = 0
+
+        if self.prefix_cache is not None:
+            self.cache_node = self.engine_node = self.prefix_cache.root
+            self.cache_node.episode = self.save_episode()
+            self.cache_node.outcome = (0, sin)
         
         return self.state, sin
     
@@ -583,36 +745,27 @@ class Flowsheet(Env):
         
 
 
+        ranges = self.actions.ranges
+
         # Preparation step
         if self.value_step == "pre":
             # Pump deactivation and heater activation (otherwise error in simulation)
             if P > 1:
-                self.avail_actions[1] = 0
-                self.avail_actions[2:5] = 1
+                self.avail_actions[slice(*ranges["pump"])] = 0
+                self.avail_actions[slice(*ranges["heater"])] = 1
         
-        elif self.value_step == "reac":
-            self.avail_actions = np.zeros((self.d_actions), dtype=np.int32)
-            self.avail_actions[8:26] = 1
-        
-        elif self.value_step == "cool":
-            self.avail_actions = np.zeros((self.d_actions), dtype=np.int32)
-            self.avail_actions[5:8] = 1
+        elif self.value_step in ("reac", "cool"):
+            self.avail_actions = self.step_masks[self.value_step].copy()
         
         elif self.value_step == "distill":
-            self.avail_actions = np.zeros((self.d_actions), dtype=np.int32)
-            self.avail_actions[26:35] = 1
-
-            if any("M" in action for action in self.actions_list):
-                if any("DC" in action for action in self.actions_list):
-                    self.avail_actions[26:35] = 0
-                    self.avail_actions[35:62] = 1
-                else:
-                    self.avail_actions[89:170] = 1
-            else:
-                self.avail_actions[62:89] = 1
+            key = ("distill", self.open_mixers > 0, self.open_columns > 0)
+            self.avail_actions = self.step_masks[key].copy()
         
         elif self.value_step == "pure":
-            self.avail_actions[26:35] = 1
+            self.avail_actions[slice(*ranges["column"])] = 1
+
+        if self.prescreen and not inlet and self.value_step in ("distill", "pure"):
+            self.screen_columns(sin)
 
 
 
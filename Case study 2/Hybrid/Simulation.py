@@ -1,26 +1,264 @@
 from fileinput import filename
 import os
+import re
 from re import A
 from tokenize import String
 from typing import Union, Dict, Literal
-import win32com.client as win32
 import numpy as np
 import time
+import tempfile
+import sqlite3
+import pickle
+import hashlib
+import json
+import io
+from collections import OrderedDict
+
+
+def aspen_backend():
+    # Imported here so that the modules stay importable without pywin32/Aspen
+    import win32com.client as win32
+
+    return win32.gencache.EnsureDispatch("Apwn.Document")
+
+
+def run_status(engine, blocks=()):
+    """Status of the last run from the engine's run summary: counts and lines of the errors,
+    warnings and messages, the blocks named in the errors/warnings and the iterations reported
+    for them (e.g. "NOT CONVERGED IN 50 ITERATIONS")."""
+    status = {"errors": 0, "warnings": 0, "messages": 0, "lines": {}, "blocks": [], "iterations": {}}
+    for key, field in (("PER_ERROR", "errors"), ("PER_WARNING", "warnings"), ("PER_MESSAGE", "messages")):
+        node = engine.Tree.FindNode(f"/Data/Results Summary/Run-Status/Output/{key}")
+        count = node.Value if node else 0
+        status[field] = count or 0
+        status["lines"][field] = [str(child.Value) for child in node.Elements] if count else []
+
+    lines = status["lines"]["errors"] + status["lines"]["warnings"]
+    for block in blocks:
+        pattern = re.compile(rf"\b{re.escape(block)}\b")
+        named = [line for line in lines if pattern.search(line)]
+        if named:
+            status["blocks"].append(block)
+        for line in named:
+            match = re.search(r"(\d+)\s+ITERATIONS", line)
+            if match:
+                status["iterations"][block] = int(match.group(1))
+    return status
+
+
+class EngineJournal():
+    """Proxy of the engine COM objects that records every change made to the flowsheet
+    (element adds/removes, rows, input values, archive loads), so that it can be rebuilt
+    on a fresh engine after a crash."""
+
+    MUTATING = ("Add", "Remove", "RemoveAll", "InsertRow", "RemoveRow", "InitFromArchive2", "restore")
+    VALUES = (int, float, str, bool, tuple, type(None))
+    NAVIGATION = ("Application", "Tree", "Elements", "FindNode")
+
+    def __init__(self, target, journal, steps=()):
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_journal", journal)
+        object.__setattr__(self, "_steps", steps)
+
+    def _wrap(self, value, step):
+        if isinstance(value, self.VALUES):
+            return value
+        return EngineJournal(value, self._journal, self._steps + (step,))
+
+    def __getattr__(self, name):
+        return self._wrap(getattr(self._target, name), ("attr", name))
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
+        if self._steps:     # Document level settings are applied again on every dispatch
+            self._journal.append((self._steps, "set", (name, value)))
+
+    def __call__(self, *args):
+        result = self._target(*args)
+        kind, name = self._steps[-1] if self._steps else (None, None)
+        if kind == "attr" and name in self.MUTATING:
+            if name in ("InitFromArchive2", "restore"):
+                # Loading a whole archive/state makes the earlier changes irrelevant
+                del self._journal[:]
+            self._journal.append((self._steps[:-1], name, args))
+        return self._wrap(result, ("call", args))
+
+    def __iter__(self):
+        for item in self._target:
+            yield self._wrap(item, ("call", (item.Name,)))
+
+    @classmethod
+    def path(cls, steps):
+        # Element names along steps, the same for Elements() chains and FindNode paths
+        names = []
+        for kind, value in steps:
+            if kind == "attr":
+                if value not in cls.NAVIGATION:
+                    names.append(value)
+            elif len(value) == 1 and str(value[0]).startswith("/"):
+                names.extend(value[0].strip("/").split("/"))
+            else:
+                names.extend(value)
+        return tuple(names)
+
+    @classmethod
+    def target(cls, entry):
+        # Element changed by an entry: node set, element added/removed, collection emptied
+        steps, op, args = entry
+        path = cls.path(steps)
+        if op in ("Add", "Remove"):
+            return path + (str(args[0]).split("!")[0],)
+        return path
+
+    @staticmethod
+    def removes(op, target, entry_op, entry_target):
+        # Whether removing target drops an earlier entry: everything done under it and, for streams,
+        # the block ports and specs that refer to them
+        if entry_target[:len(target)] == target:
+            # Earlier removes are kept, the element may come from the archive
+            return op == "RemoveAll" or entry_op not in ("Remove", "RemoveAll")
+        if target[:2] != ("Data", "Streams") or entry_target[:2] != ("Data", "Blocks"):
+            return False
+        if op == "RemoveAll":
+            return "Ports" in entry_target
+        return target[2] in entry_target[4:]
+
+    @classmethod
+    def compact(cls, journal):
+        """Journal reduced to the changes still in effect, so that a rebuild replays the current
+        flowsheet only: the last value set on every node, adds cancelled by later removes, and what
+        was done under (or connected to) removed elements dropped."""
+        kept = {}       # position in the journal -> (target, entry)
+        values = {}     # (target, attribute) -> position of the value in effect
+        for position, entry in enumerate(journal):
+            steps, op, args = entry
+            if op in ("InitFromArchive2", "restore"):
+                kept.clear()
+            target = cls.target(entry)
+            if op == "set":
+                kept.pop(values.get((target, args[0])), None)
+                values[(target, args[0])] = position
+            elif op in ("Remove", "RemoveAll"):
+                dropped = [p for p, (t, (_, o, _)) in kept.items() if cls.removes(op, target, o, t)]
+                added = any(kept[p][0] == target and kept[p][1][1] == "Add" for p in dropped)
+                for p in dropped:
+                    del kept[p]
+                if op == "Remove" and added:
+                    continue
+            kept[position] = (target, entry)
+        return [entry for _, entry in kept.values()]
+
+    @staticmethod
+    def replay(engine, journal):
+        for steps, op, args in journal:
+            node = engine
+            for kind, value in steps:
+                node = getattr(node, value) if kind == "attr" else node(*value)
+            if op == "set":
+                setattr(node, *args)
+            else:
+                getattr(node, op)(*args)
 
 
 class Simulation():
-    AspenSimulation = win32.gencache.EnsureDispatch("Apwn.Document")
-
-    def __init__(self, AspenFileName, WorkingDirectoryPath, VISIBILITY=False):
+    def __init__(self, AspenFileName, WorkingDirectoryPath, VISIBILITY=False, backend=aspen_backend, incremental=False,
+                 run_timeout=None, max_restarts=3, kill=None, tear_method=None, tear_maxit=50, lazy=False,
+                 max_iterations=None, surrogate=None):
         os.chdir(WorkingDirectoryPath)
-        self.AspenSimulation.InitFromArchive2(os.path.abspath(AspenFileName))
-        self.AspenSimulation.Visible = VISIBILITY
-        self.AspenSimulation.SuppressDialogs = True
+        self.AspenFilePath = os.path.abspath(AspenFileName)
+        self.VISIBILITY = VISIBILITY
+        self.backend = backend
+        self.simulation = self
+        self._engine = None
+
+        # Model of the flowsheet in the engine. With incremental=True, Reinitialize keeps it and
+        # only the elements that were not declared again are removed before the next run
+        self.incremental = incremental
+        self.blocks = {}            # block name -> unit operation type
+        self.streams = set()
+        self.connections = set()    # (block, stream, port)
+        self.declared = set()
+
+        # Stream outputs served instead of the engine while replaying a cached prefix
+        self.results = None
+
+        # Supervised runs: with run_timeout (s) the engine runs asynchronously, changes to the
+        # flowsheet are journaled and a dead/stuck engine is restarted and rebuilt.
+        # kill(engine) can be given to terminate the server process of an unresponsive engine
+        self.run_timeout = run_timeout
+        self.max_restarts = max_restarts
+        self.kill = kill
+        self.poll_interval = 0.05
+        self.journal = []
+        self.failure = None         # Reason of the last failed run
+        self.failures = []
+        self.restarts = 0
+
+        # Recycles: tear streams in convergence blocks of their own ("WEGSTEIN"/"BROYDEN"),
+        # seeded with the values they converged to the last time in the same flowsheet
+        self.tear_method = tear_method
+        self.tear_maxit = tear_maxit
+        self.tears = {}             # tear stream -> (convergence block, method)
+        self.tear_estimates = {}    # (flowsheet signature, stream) -> (T, P, flows)
+        self.tear_count = 0
+
+        # Budgets of a run: run_timeout (s) aborts it, max_iterations caps the iterations of the
+        # tear convergence blocks (MAXIT) and of the columns (MAXOL). RunStatus() reports the
+        # outcome, status keeps it until the next run
+        self.max_iterations = max_iterations
+        self.elapsed = None
+        self.status = None
+
+        # Deferred runs: with lazy=True EngineRun only marks the flowsheet as pending and the engine
+        # runs when an output is read. Single-inlet mixers are pass-throughs, their outlet is served
+        # from the inlet so that placing one does not need a run of its own
+        self.lazy = lazy
+        self.pending = False
+        self.pending_blocks = set()
+        self.passthrough = {}       # outlet stream -> (block, inlet stream)
+        self.fresh = set()          # streams whose outputs are still valid for the flowsheet
+        self.converged = None       # Status of the last run, None until it is read
+        self.runs = 0
+        self.run_requests = 0
+
+        # Block inputs: values last written and parent nodes of the specs, per block, so that
+        # unchanged specs are not written again. Counts of the writes made/skipped for the
+        # next run, run_writes keeps them for the last one
+        self.inputs = {}            # block -> {path: value}
+        self.input_nodes = {}       # block -> {parent path: engine node}
+        self.writes = 0
+        self.skipped_writes = 0
+        self.run_writes = (0, 0)
+
+        # Multi-fidelity: with a Surrogate and fidelity="surrogate", EngineRun predicts the flowsheet
+        # and serves it as results, the engine only runs when a unit cannot be predicted. Converged
+        # engine runs are recorded as samples of the surrogates
+        self.surrogate = surrogate
+        self.fidelity = "engine"
+        self.units = {}             # block name -> unit operation object, in placement order
+        self.feeds = {}             # inlet stream -> specs
+
+    @property
+    def engine(self):
+        # The engine is only dispatched the first time it is needed
+        if self._engine is None:
+            self._engine = self.backend()
+            if self.run_timeout is not None:
+                self._engine = EngineJournal(self._engine, self.journal)
+            self._engine.InitFromArchive2(self.AspenFilePath)
+            self._engine.Visible = self.VISIBILITY
+            self._engine.SuppressDialogs = True
+        return self._engine
 
+    @property
+    def AspenSimulation(self):
+        return self.simulation.engine
 
     def CloseAspen(self):
         AspenFileName = self.Give_AspenDocumentName()
         self.AspenSimulation.Close(os.path.abspath(AspenFileName))
+        self._engine = None
+        self.simulation.input_nodes.clear()
 
     def Give_AspenDocumentName(self):
         return self.AspenSimulation.FullName
@@ -34,35 +272,442 @@ class Simulation():
     def STRM(self):
         return self.AspenSimulation.Tree.Elements("Data").Elements("Streams")
 
+    @property
+    def CONV(self):
+        return self.AspenSimulation.Tree.Elements("Data").Elements("Convergence").Elements("Convergence")
+
     def EngineRun(self):
-        self.AspenSimulation.Run2()
+        sim = self.simulation
+        sim.pending = True
+        sim.run_requests += 1
+        if sim.fidelity == "surrogate" and sim.surrogate is not None:
+            sim.results = sim.surrogate.solve(sim)
+            if sim.results is not None:
+                return
+        sim.results = None
+        if not sim.lazy:
+            sim.Flush()
+
+    def Flush(self):
+        # Runs the engine if changes to the flowsheet are pending
+        sim = self.simulation
+        if not sim.pending:
+            return
+        sim.pending = False
+        if sim.incremental:
+            sim.Sweep()
+        signature = sim.SeedTears() if sim.tears else None
+        start = time.time()
+        if sim.run_timeout is None:
+            self.AspenSimulation.Run2()
+        else:
+            sim.SupervisedRun()
+        sim.elapsed = time.time() - start
+        sim.status = None
+        sim.results = None
+        sim.runs += 1
+        sim.run_writes = (sim.writes, sim.skipped_writes)
+        sim.writes = sim.skipped_writes = 0
+        sim.pending_blocks.clear()
+        sim.fresh = set(sim.streams)
+        sim.converged = None
+        if signature is not None and sim.Convergence():
+            sim.SaveTears(signature)
+        if sim.surrogate is not None and sim.Convergence():
+            sim.surrogate.record(sim)
+
+    def Deferrable(self):
+        # True when the pending changes are pass-throughs of a converged flowsheet
+        sim = self.simulation
+        blocks = {block for block, _ in sim.passthrough.values()}
+        return sim.converged is True and sim.pending_blocks <= blocks
+
+    def Resolve(self, Streamname):
+        # Stream whose converged outputs stand for Streamname, None when the engine has to run first
+        sim = self.simulation
+        if not sim.pending:
+            return Streamname
+        if not self.Deferrable():
+            return None
+        while Streamname in sim.passthrough:
+            Streamname = sim.passthrough[Streamname][1]
+        return Streamname if Streamname in sim.fresh else None
+
+    def SupervisedRun(self):
+        # Returns False (and sets self.failure) when the run timed out or the engine died
+        self.failure = None
+        start = time.time()
+        try:
+            engine = self.engine
+            engine.Run2(True)
+            while engine.Engine.IsRunning:
+                if time.time() - start > self.run_timeout:
+                    break
+                time.sleep(self.poll_interval)
+            else:
+                self.restarts = 0
+                return True
+            reason = "timeout"
+            try:
+                # A stuck but responsive engine only needs to be stopped
+                engine.Engine.Stop()
+                engine.Reinit()
+                restart = False
+            except Exception:
+                restart = True
+            detail = f"run exceeded {self.run_timeout} s"
+        except Exception as error:
+            reason, restart, detail = "engine_dead", True, repr(error)
+
+        self.failure = {"reason": reason, "detail": detail, "elapsed": time.time() - start, "restarted": restart}
+        self.failures.append(self.failure)
+        if restart:
+            self.failure["rebuilt"] = self.RestartEngine()
+        return False
+
+    def RestartEngine(self):
+        # Fresh engine with the current flowsheet rebuilt from the journal. Returns False (the error
+        # goes to self.failure) when the rebuild fails, the flowsheet is then dropped and the next
+        # engine starts from the base archive
+        self.restarts += 1
+        if self.restarts > self.max_restarts:
+            raise RuntimeError(f"Engine failed {self.restarts} times in a row: {self.failure}")
+        journal = EngineJournal.compact(self.journal)
+        self.DropEngine()
+        if journal and journal[0][1:] == ("InitFromArchive2", (self.AspenFilePath,)):
+            # The fresh engine has already loaded the base archive
+            journal = journal[1:]
+        # The journal restores the inputs, only the nodes of the old engine are lost
+        self.input_nodes.clear()
+        try:
+            EngineJournal.replay(self.engine, journal)
+        except Exception as error:
+            self.failure["rebuild_error"] = repr(error)
+            self.ResetEngine()
+            return False
+        return True
+
+    def DropEngine(self):
+        engine, self._engine = self._engine, None
+        if self.kill is not None and engine is not None:
+            self.kill(engine._target if isinstance(engine, EngineJournal) else engine)
+
+    def ResetEngine(self):
+        # Engine and flowsheet model dropped, the next engine starts from the base archive
+        self.DropEngine()
+        del self.journal[:]
+        self.blocks.clear()
+        self.streams.clear()
+        self.connections.clear()
+        self.tears.clear()
+        self.inputs.clear()
+        self.input_nodes.clear()
+        self.units.clear()
+        self.feeds.clear()
 
     def EngineStop(self):
         self.AspenSimulation.Stop()
 
     def EngineReinit(self):
+        self.simulation.converged = None
         self.AspenSimulation.Reinit()
 
     def Convergence(self):
-        converged = self.AspenSimulation.Tree.Elements("Data").Elements("Results Summary").Elements(
-                           "Run-Status").Elements("Output").Elements("PER_ERROR").Value
-        return converged == 0
+        sim = self.simulation
+        if sim.fidelity == "surrogate" and sim.results is not None:
+            # Flowsheet predicted by the surrogates
+            return True
+        if sim.pending and not self.Deferrable():
+            self.Flush()
+        if sim.failure is not None:
+            return False
+        if sim.converged is None:
+            converged = self.AspenSimulation.Tree.Elements("Data").Elements("Results Summary").Elements(
+                               "Run-Status").Elements("Output").Elements("PER_ERROR").Value
+            sim.converged = converged == 0
+        return sim.converged
     
+    def RunStatus(self):
+        # Structured status of the last run, see run_status
+        sim = self.simulation
+        self.Flush()
+        if sim.status is None:
+            if sim.failure is not None and sim.failure["restarted"]:
+                # The summary of the engine that failed is gone with it
+                status = {"errors": None, "warnings": None, "messages": None, "lines": {}, "blocks": [],
+                          "iterations": {}}
+            else:
+                blocks = list(sim.blocks) + [name for name, _ in sim.tears.values()]
+                status = run_status(self.AspenSimulation, blocks)
+            limit = sim.max_iterations
+            status.update({
+                "converged": self.Convergence(),
+                "elapsed": sim.elapsed,
+                "failure": sim.failure,
+                "iteration_limit": limit is not None and any(n >= limit for n in status["iterations"].values())})
+            sim.status = status
+        return sim.status
+
+    def IterationLimit(self, maxit):
+        limit = self.simulation.max_iterations
+        return maxit if limit is None else min(maxit, limit)
+
     def StreamConnect(self, Blockname, Streamname, Portname):
+        sim = self.simulation
+        connection = (Blockname, Streamname, Portname)
+        sim.declared.add(("PORT",) + connection)
+        if Blockname not in sim.pending_blocks:
+            # Rewiring a block that already ran (a recycle) can change any stream
+            sim.fresh.clear()
+        if Portname == "F(IN)":
+            for outlet, (block, inlet) in list(sim.passthrough.items()):
+                if block == Blockname and inlet != Streamname:
+                    del sim.passthrough[outlet]
+        if connection in sim.connections:
+            return
         self.BLK.Elements(Blockname).Elements("Ports").Elements(Portname).Elements.Add(Streamname)
+        sim.connections.add(connection)
 
     def StreamDisconnect(self, Blockname, Streamname, Portname):
         self.BLK.Elements(Blockname).Elements("Ports").Elements(Portname).Elements.Remove(Streamname)
-    
+        self.simulation.connections.discard((Blockname, Streamname, Portname))
+        self.ForgetInputs(Streamname, [Blockname])
+
+    def AddBlock(self, Blockname, uo):
+        # Returns False when an identical block is already in the flowsheet and is reused
+        sim = self.simulation
+        sim.declared.add(("BLOCK", Blockname))
+        sim.pending_blocks.add(Blockname)
+        if sim.blocks.get(Blockname) == uo:
+            return False
+        if Blockname in sim.blocks:
+            self.RemoveBlock(Blockname)
+        self.BLK.Elements.Add(Blockname + "!" + uo)
+        sim.blocks[Blockname] = uo
+        return True
+
+    def RemoveBlock(self, Blockname):
+        sim = self.simulation
+        self.BLK.Elements.Remove(Blockname)
+        sim.blocks.pop(Blockname, None)
+        sim.inputs.pop(Blockname, None)
+        sim.input_nodes.pop(Blockname, None)
+        sim.connections = {c for c in sim.connections if c[0] != Blockname}
+
+    def WriteInputs(self, Blockname, specs, parent=("Input",)):
+        # specs: {element or path under parent: value}, written in one pass over cached parent nodes
+        sim = self.simulation
+        inputs = sim.inputs.setdefault(Blockname, {})
+        nodes = sim.input_nodes.setdefault(Blockname, {})
+        for key, value in specs.items():
+            path = parent + (key if isinstance(key, tuple) else (key,))
+            if path in inputs and inputs[path] == value:
+                sim.skipped_writes += 1
+                continue
+            node = nodes.get(path[:-1])
+            if node is None:
+                node = self.BLK.Elements(Blockname)
+                for element in path[:-1]:
+                    node = node.Elements(element)
+                nodes[path[:-1]] = node
+            node.Elements(path[-1]).Value = value
+            inputs[path] = value
+            sim.writes += 1
+
+    def AddStream(self, Streamname):
+        sim = self.simulation
+        sim.declared.add(("STREAM", Streamname))
+        if Streamname in sim.streams:
+            return False
+        self.STRM.Elements.Add(Streamname + "!" + "MATERIAL")
+        sim.streams.add(Streamname)
+        return True
+
+    def RemoveStream(self, Streamname):
+        sim = self.simulation
+        self.STRM.Elements.Remove(Streamname)
+        sim.streams.discard(Streamname)
+        sim.connections = {c for c in sim.connections if c[1] != Streamname}
+        self.ForgetInputs(Streamname, list(sim.inputs))
+
+    def ForgetInputs(self, Streamname, Blocknames):
+        # Specs keyed by a stream (feed stage, side draws) go with its connection
+        for Blockname in Blocknames:
+            inputs = self.simulation.inputs.get(Blockname, {})
+            for path in [path for path in inputs if Streamname in path]:
+                del inputs[path]
+
+    def FlowsheetDiff(self):
+        # Blocks, streams and connections in the engine that were not declared since the last Reinitialize
+        sim = self.simulation
+        blocks = [b for b in sim.blocks if ("BLOCK", b) not in sim.declared]
+        streams = [s for s in sim.streams if ("STREAM", s) not in sim.declared]
+        connections = [c for c in sim.connections if ("PORT",) + c not in sim.declared
+                       and c[0] not in blocks and c[1] not in streams]
+        return blocks, streams, connections
+
+    def Sweep(self):
+        blocks, streams, connections = self.FlowsheetDiff()
+        for connection in connections:
+            self.StreamDisconnect(*connection)
+        for b in blocks:
+            self.RemoveBlock(b)
+        for s in streams:
+            self.RemoveStream(s)
+        tears = [s for s in self.simulation.tears if ("TEAR", s) not in self.simulation.declared]
+        for s in tears:
+            self.RemoveTear(s)
+        # The journal only keeps what a rebuild needs for the flowsheet left in the engine
+        self.simulation.journal[:] = EngineJournal.compact(self.simulation.journal)
+        return len(blocks) + len(streams) + len(connections) + len(tears)
+
+    def TearStream(self, Streamname, method=None, maxit=None):
+        # Tear Streamname in a convergence block of its own instead of letting the engine choose the tears
+        sim = self.simulation
+        method = method or sim.tear_method or "WEGSTEIN"
+        sim.declared.add(("TEAR", Streamname))
+        if Streamname in sim.tears and sim.tears[Streamname][1] != method:
+            self.RemoveTear(Streamname)
+        if Streamname not in sim.tears:
+            sim.tear_count += 1
+            name = f"CV{sim.tear_count}"
+            self.CONV.Elements.Add(name + "!" + method)
+            nodes = self.AspenSimulation.Application.Tree.FindNode(f"/Data/Convergence/Convergence/{name}/Input/TEAR").Elements
+            nodes.InsertRow(1, nodes.Count)
+            nodes(nodes.Count - 1).Value = Streamname
+            sim.tears[Streamname] = (name, method)
+        name = sim.tears[Streamname][0]
+        self.CONV.Elements(name).Elements("Input").Elements("MAXIT").Value = self.IterationLimit(maxit or sim.tear_maxit)
+        return name
+
+    def RemoveTear(self, Streamname):
+        sim = self.simulation
+        name, _ = sim.tears.pop(Streamname)
+        self.CONV.Elements.Remove(name)
+
+    def FlowsheetSignature(self):
+        sim = self.simulation
+        return hash((tuple(sorted(sim.blocks.items())), tuple(sorted(sim.connections))))
+
+    def SeedTears(self):
+        # Initial estimates of the tear streams from the last converged run
+        sim = self.simulation
+        signature = sim.FlowsheetSignature()
+        for stream in sim.tears:
+            estimate = sim.tear_estimates.get((signature, stream))
+            if estimate is None:
+                continue
+            T, P, flows = estimate
+            node = self.STRM.Elements(stream).Elements("Input")
+            node.Elements("TEMP").Elements("MIXED").Value = T
+            node.Elements("PRES").Elements("MIXED").Value = P
+            for compound, flow in flows.items():
+                node.Elements("FLOW").Elements("MIXED").Elements(compound).Value = flow
+        return signature
+
+    def SaveTears(self, signature):
+        sim = self.simulation
+        for stream in sim.tears:
+            out = self.STRM.Elements(stream).Elements("Output")
+            flows = {compound.Name: compound.Value for compound in out.Elements("MOLEFLOW").Elements("MIXED").Elements}
+            sim.tear_estimates[(signature, stream)] = (
+                out.Elements("TEMP_OUT").Elements("MIXED").Value,
+                out.Elements("PRES_OUT").Elements("MIXED").Value,
+                flows)
+
+    def StreamResults(self):
+        # Converged outputs of every stream in the flowsheet, keyed like Stream.output
+        sim = self.simulation
+        if any(self.Resolve(name) is None for name in sim.streams):
+            self.Flush()
+        results = {}
+        for name in sim.streams:
+            out = self.STRM.Elements(self.Resolve(name)).Elements("Output")
+            values = {
+                ("TEMP_OUT", "MIXED"): out.Elements("TEMP_OUT").Elements("MIXED").Value,
+                ("PRES_OUT", "MIXED"): out.Elements("PRES_OUT").Elements("MIXED").Value,
+                ("MOLEFLMX", "MIXED"): out.Elements("MOLEFLMX").Elements("MIXED").Value,
+                ("STR_MAIN", "VFRAC", "MIXED"): out.Elements("STR_MAIN").Elements("VFRAC").Elements("MIXED").Value}
+            for compound in out.Elements("MOLEFLOW").Elements("MIXED").Elements:
+                values[("MOLEFLOW", "MIXED", compound.Name)] = compound.Value
+            results[name] = values
+        return results
+
+    def SaveSnapshot(self, path):
+        # Archive of the engine state plus the flowsheet model and stream results.
+        # Backends other than Aspen can provide their own snapshot()/restore()
+        sim = self.simulation
+        self.Flush()
+        engine = sim.engine
+        if hasattr(engine, "snapshot"):
+            state = engine.snapshot()
+        else:
+            state = os.path.abspath(path)
+            engine.SaveAs(state, True)
+        return {"state": state, "blocks": dict(sim.blocks), "streams": set(sim.streams),
+                "connections": set(sim.connections), "tears": dict(sim.tears), "results": self.StreamResults()}
+
+    def LoadSnapshot(self, snapshot):
+        sim = self.simulation
+        engine = sim.engine
+        if hasattr(engine, "restore"):
+            engine.restore(snapshot["state"])
+        else:
+            engine.InitFromArchive2(snapshot["state"])
+        sim.blocks = dict(snapshot["blocks"])
+        sim.streams = set(snapshot["streams"])
+        sim.connections = set(snapshot["connections"])
+        sim.tears = dict(snapshot["tears"])
+        sim.inputs.clear()
+        sim.input_nodes.clear()
+        sim.units.clear()
+        sim.feeds.clear()
+        sim.declared = ({("BLOCK", b) for b in sim.blocks} | {("STREAM", s) for s in sim.streams}
+                        | {("PORT",) + c for c in sim.connections} | {("TEAR", s) for s in sim.tears})
+        sim.results = None
+        self.ClearPending()
+        sim.fresh = set(sim.streams)
+
+    def Archives(self):
+        # Archive files a restart of the engine loads again (snapshots that must be kept)
+        return {args[0] for _, op, args in self.simulation.journal if op == "InitFromArchive2"}
+
+    def ClearPending(self):
+        sim = self.simulation
+        sim.pending = False
+        sim.pending_blocks.clear()
+        sim.passthrough.clear()
+        sim.fresh.clear()
+        sim.converged = None
+
     def Reinitialize(self):
-        self.STRM.RemoveAll()
-        self.BLK.RemoveAll()
+        sim = self.simulation
+        if not sim.incremental:
+            for stream in list(sim.tears):
+                self.RemoveTear(stream)
+            self.STRM.RemoveAll()
+            self.BLK.RemoveAll()
+            # Only the archive load and the teardown are left to rebuild the empty flowsheet
+            sim.journal[:] = EngineJournal.compact(sim.journal)
+            sim.blocks.clear()
+            sim.inputs.clear()
+            sim.input_nodes.clear()
+            sim.streams.clear()
+            sim.connections.clear()
+        sim.declared.clear()
+        sim.units.clear()
+        sim.feeds.clear()
+        sim.results = None
+        sim.failure = None
+        sim.status = None
+        self.ClearPending()
         self.AspenSimulation.Reinit()
 
 
 
 class Stream(Simulation):
-    def __init__(self, name, inlet=False):
+    def __init__(self, name, inlet=False, *, sim):
+        self.simulation = sim
         self.name = name.upper()       
         self.inlet = inlet
 
@@ -73,16 +718,16 @@ class Stream(Simulation):
     
 
     def StreamPlace(self):
-        compositstring = self.name + "!" + "MATERIAL"
-        self.STRM.Elements.Add(compositstring)
+        self.AddStream(self.name)
 
     def StreamDelete(self): 
-        self.STRM.Elements.Remove(self.name)
+        self.RemoveStream(self.name)
     
     def inlet_stream(self):
         T = self.inlet[0]
         P = self.inlet[1]
         comp = self.inlet[2]
+        self.simulation.feeds[self.name] = self.inlet
 
         self.STRM.Elements(self.name).Elements("Input").Elements("TEMP").Elements("MIXED").Value = T
         self.STRM.Elements(self.name).Elements("Input").Elements("PRES").Elements("MIXED").Value = P
@@ -91,42 +736,85 @@ class Stream(Simulation):
             self.STRM.Elements(self.name).Elements("Input").Elements("FLOW").Elements("MIXED").Elements(
                 chemical).Value = comp[chemical]
     
+    def output(self, *path):
+        results = self.simulation.results
+        if results is not None:
+            return results[self.name][path]
+        name = self.Resolve(self.name)
+        if name is None:
+            self.Flush()
+            name = self.name
+        node = self.STRM.Elements(name).Elements("Output")
+        for element in path:
+            node = node.Elements(element)
+        return node.Value
+
     def get_temp(self):
-        return self.STRM.Elements(self.name).Elements("Output").Elements("TEMP_OUT").Elements("MIXED").Value
+        return self.output("TEMP_OUT", "MIXED")
     
     def get_press(self):
-        return self.STRM.Elements(self.name).Elements("Output").Elements("PRES_OUT").Elements("MIXED").Value
+        return self.output("PRES_OUT", "MIXED")
     
     def get_molar_flow(self, compound):
-        return self.STRM.Elements(self.name).Elements("Output").Elements("MOLEFLOW").Elements("MIXED").Elements(compound).Value
+        return self.output("MOLEFLOW", "MIXED", compound)
     
     def get_total_molar_flow(self):
-        return self.STRM.Elements(self.name).Elements("Output").Elements("MOLEFLMX").Elements("MIXED").Value
+        return self.output("MOLEFLMX", "MIXED")
     
     def get_vapor_fraction(self):
-        return self.STRM.Elements(self.name).Elements("Output").Elements("STR_MAIN").Elements("VFRAC").Elements("MIXED").Value
+        return self.output("STR_MAIN", "VFRAC", "MIXED")
 
 
 
 class Block(Simulation):
-    def __init__(self, name, uo):
+    # Surrogates: whether the unit is learned from the engine, the attributes that parametrize it,
+    # its outlet ports and the elements read from it (see Surrogate)
+    learned = True
+    params = ()
+    outlets = ("P(OUT)",)
+    results_paths = ()
+
+    def __init__(self, name, uo, sim):
+        self.simulation = sim
         self.name = name.upper()
         self.uo = uo
 
     def BlockCreate(self):
-        compositestring = self.name + "!" + self.uo
-        self.BLK.Elements.Add(compositestring)
+        # False when the block is reused from the previous episode, its one-off setup is then already done
+        self.created = self.AddBlock(self.name, self.uo)
+        self.simulation.units[self.name] = self
 
     def BlockDelete(self):
-        self.BLK.Elements.Remove(self.name)
+        self.RemoveBlock(self.name)
+
+    def specify(self, specs, *parent):
+        # Input specs of the block, see Simulation.WriteInputs
+        self.WriteInputs(self.name, specs, parent or ("Input",))
+
+    def value(self, *path):
+        # Element under the block (results, sizing...) read after any deferred run
+        results = self.simulation.results
+        if results is not None and self.name in results:
+            return results[self.name][path]
+        self.Flush()
+        node = self.BLK.Elements(self.name)
+        for element in path:
+            node = node.Elements(element)
+        return node.Value
+
+    def predict(self, inlets, outlets, surrogate):
+        # Outlet vectors {stream: vector} and results {path: value} of the unit, None when it cannot be predicted
+        return surrogate.predict(self, inlets, outlets)
 
 
 
 # -------------------------------------------------- UNIT OPERATIONS ------------------------------------------------
 
 class Mixer(Block):
+    learned = False
+
     def __init__(self, name, inlet_stream):
-        super().__init__(name, "Mixer")
+        super().__init__(name, "Mixer", inlet_stream.simulation)
         self.name = name
         self.inlet_stream = inlet_stream
 
@@ -137,16 +825,23 @@ class Mixer(Block):
         # Inlet connection
         self.StreamConnect(self.name, self.inlet_stream.name, "F(IN)")
         
-        self.BLK.Elements(self.name).Elements("Input").Elements("NPHASE").Value = 2
+        self.specify({"NPHASE": 2})
 
-        s = Stream(f"{self.name}OUT")
+        s = Stream(f"{self.name}OUT", sim=self.simulation)
         self.StreamConnect(self.name, s.name, "P(OUT)")
+        self.simulation.passthrough[s.name] = (self.name, self.inlet_stream.name)
         return s
 
+    def predict(self, inlets, outlets, surrogate):
+        out = surrogate.mix(inlets)
+        return {name: out for name in outlets.get("P(OUT)", [])}, {}
+
 
 class Splitter(Block):
+    learned = False
+
     def __init__(self, name, rr, inlet_stream):
-        super().__init__(name, "FSplit")
+        super().__init__(name, "FSplit", inlet_stream.simulation)
 
         self.name = name
         self.rr = rr
@@ -157,19 +852,29 @@ class Splitter(Block):
     def recycle(self):
         self.StreamConnect(self.name, self.inlet_stream.name, "F(IN)")
 
-        rec = Stream(f"{self.name}REC")
-        s1 = Stream(f"{self.name}PURGE")
+        rec = Stream(f"{self.name}REC", sim=self.simulation)
+        s1 = Stream(f"{self.name}PURGE", sim=self.simulation)
 
         self.StreamConnect(self.name, rec.name, "P(OUT)")
         self.StreamConnect(self.name, s1.name, "P(OUT)")
 
-        self.BLK.Elements(self.name).Elements("Input").Elements("FRAC").Elements(rec.name).Value = self.rr
+        self.specify({("FRAC", rec.name): self.rr})
+        self.fractions = {rec.name: self.rr, s1.name: 1 - self.rr}
         return rec, s1
 
+    def predict(self, inlets, outlets, surrogate):
+        streams = {}
+        for name in outlets.get("P(OUT)", []):
+            streams[name] = inlets[0].copy()
+            streams[name][3:] *= self.fractions[name]
+        return streams, {}
+
 
 class Vaporizer(Block):
+    results_paths = (("Output", "QCALC"),)
+
     def __init__(self, name, inlet_stream):
-        super().__init__(name, "Heater")
+        super().__init__(name, "Heater", inlet_stream.simulation)
 
         self.name = name
         self.inlet_stream = inlet_stream
@@ -179,24 +884,25 @@ class Vaporizer(Block):
     def vaporize(self):
         self.StreamConnect(self.name, self.inlet_stream.name, "F(IN)")
 
-        self.BLK.Elements(self.name).Elements("Input").Elements("SPEC_OPT").Value = "PV"
-        self.BLK.Elements(self.name).Elements("Input").Elements("VFRAC").Value = 1
-        self.BLK.Elements(self.name).Elements("Input").Elements("PRES").Value = 0
+        self.specify({"SPEC_OPT": "PV", "VFRAC": 1, "PRES": 0})
          
         
-        s = Stream(f"{self.name}OUT")
+        s = Stream(f"{self.name}OUT", sim=self.simulation)
         self.StreamConnect(self.name, s.name, "P(OUT)")
         return s
     
     def enery_consumption(self):
-        q = abs(self.BLK.Elements(self.name).Elements("Output").Elements("QCALC").Value)
+        q = abs(self.value("Output", "QCALC"))
         return q
 
 
 
 class Heater(Block):
+    params = ("Temp",)
+    results_paths = (("Output", "QCALC"),)
+
     def __init__(self, name, Temp, inlet_stream):
-        super().__init__(name, "Heater")
+        super().__init__(name, "Heater", inlet_stream.simulation)
 
         self.name = name
         self.Temp = Temp
@@ -207,23 +913,23 @@ class Heater(Block):
     def heat(self):
         self.StreamConnect(self.name, self.inlet_stream.name, "F(IN)")
 
-        self.BLK.Elements(self.name).Elements("Input").Elements("SPEC_OPT").Value = "TP"
-        self.BLK.Elements(self.name).Elements("Input").Elements("TEMP").Value = self.Temp 
-        self.BLK.Elements(self.name).Elements("Input").Elements("PRES").Value = 0
+        self.specify({"SPEC_OPT": "TP", "TEMP": self.Temp, "PRES": 0})
          
         
-        s = Stream(f"{self.name}OUT")
+        s = Stream(f"{self.name}OUT", sim=self.simulation)
         self.StreamConnect(self.name, s.name, "P(OUT)")
         return s
     
     def enery_consumption(self):
-        q = abs(self.BLK.Elements(self.name).Elements("Output").Elements("QCALC").Value)
+        q = abs(self.value("Output", "QCALC"))
         return q
 
 
 class Condenser(Block):
+    results_paths = (("Output", "QCALC"),)
+
     def __init__(self, name, inlet_stream):
-        super().__init__(name, "Heater")
+        super().__init__(name, "Heater", inlet_stream.simulation)
 
         self.name = name
         self.inlet_stream = inlet_stream
@@ -233,24 +939,25 @@ class Condenser(Block):
     def condense(self):
         self.StreamConnect(self.name, self.inlet_stream.name, "F(IN)")
 
-        self.BLK.Elements(self.name).Elements("Input").Elements("SPEC_OPT").Value = "PV"
-        self.BLK.Elements(self.name).Elements("Input").Elements("VFRAC").Value = 0
-        self.BLK.Elements(self.name).Elements("Input").Elements("PRES").Value = 0
+        self.specify({"SPEC_OPT": "PV", "VFRAC": 0, "PRES": 0})
          
         
-        s = Stream(f"{self.name}OUT")
+        s = Stream(f"{self.name}OUT", sim=self.simulation)
         self.StreamConnect(self.name, s.name, "P(OUT)")
         return s
     
     def enery_consumption(self):
-        q = abs(self.BLK.Elements(self.name).Elements("Output").Elements("QCALC").Value)
+        q = abs(self.value("Output", "QCALC"))
         return q
 
 
 
 class Cooler(Block):
+    params = ("Temp",)
+    results_paths = (("Output", "QCALC"),)
+
     def __init__(self, name, Temp, inlet_stream):
-        super().__init__(name, "Heater")
+        super().__init__(name, "Heater", inlet_stream.simulation)
 
         self.name = name
         self.Temp = Temp
@@ -261,24 +968,25 @@ class Cooler(Block):
     def cool(self):
         self.StreamConnect(self.name, self.inlet_stream.name, "F(IN)")
 
-        self.BLK.Elements(self.name).Elements("Input").Elements("SPEC_OPT").Value = "TP"
-        self.BLK.Elements(self.name).Elements("Input").Elements("TEMP").Value = self.Temp 
-        self.BLK.Elements(self.name).Elements("Input").Elements("PRES").Value = 0
+        self.specify({"SPEC_OPT": "TP", "TEMP": self.Temp, "PRES": 0})
          
         
-        s = Stream(f"{self.name}OUT")
+        s = Stream(f"{self.name}OUT", sim=self.simulation)
         self.StreamConnect(self.name, s.name, "P(OUT)")
         return s
     
     def enery_consumption(self):
-        q = abs(self.BLK.Elements(self.name).Elements("Output").Elements("QCALC").Value)
+        q = abs(self.value("Output", "QCALC"))
         return q
 
 
 
 class Pump(Block):
+    params = ("press",)
+    results_paths = (("Output", "WNET"),)
+
     def __init__(self, name, press, inlet_stream):
-        super().__init__(name, "Pump")
+        super().__init__(name, "Pump", inlet_stream.simulation)
         self.name = name
         self.press = press
         self.inlet_stream = inlet_stream
@@ -288,22 +996,24 @@ class Pump(Block):
     def pump(self):
         # Inlet connection
         self.StreamConnect(self.name, self.inlet_stream.name, "F(IN)")
-        self.BLK.Elements(self.name).Elements("Input").Elements("OPT_SPEC").Value = "PRES"
-        self.BLK.Elements(self.name).Elements("Input").Elements("PRES").Value = self.press
+        self.specify({"OPT_SPEC": "PRES", "PRES": self.press})
 
-        s = Stream(f"{self.name}OUT")
+        s = Stream(f"{self.name}OUT", sim=self.simulation)
         self.StreamConnect(self.name, s.name, "P(OUT)")
         return s
 
     def enery_consumption(self):
-        q = abs(self.BLK.Elements(self.name).Elements("Output").Elements("WNET").Value)
+        q = abs(self.value("Output", "WNET"))
         return q
 
 
 
 class PFR(Block):
+    params = ("D", "L")
+    results_paths = (("Output", "QCALC"),)
+
     def __init__(self, name, D, L, inlet_stream):
-        super().__init__(name, "RPlug")
+        super().__init__(name, "RPlug", inlet_stream.simulation)
         self.name = name
         self.inlet_stream = inlet_stream
         self.D = D
@@ -315,46 +1025,49 @@ class PFR(Block):
         # Inlet connection
         self.StreamConnect(self.name, self.inlet_stream.name, "F(IN)")
 
-        # Reactors specifications
-        self.BLK.Elements(self.name).Elements("Input").Elements("TYPE").Value = "TCOOL-SPEC"
-        self.BLK.Elements(self.name).Elements("Input").Elements("U").Value = 60
-        self.BLK.Elements(self.name).Elements("Input").Elements("CTEMP").Value = 260
+        # Reaction
+        if self.created:
+            nodes = self.AspenSimulation.Application.Tree.FindNode(f"/Data/Blocks/{self.name}/Input/RXN_ID").Elements
+            nodes.InsertRow(1, nodes.Count)
+            nodes(nodes.Count - 1).Value = "R-1"
 
-        # Sizing
-        self.BLK.Elements(self.name).Elements("Input").Elements("NPHASE").Value = 2
-        self.BLK.Elements(self.name).Elements("Input").Elements("LENGTH").Value = self.L
-        self.BLK.Elements(self.name).Elements("Input").Elements("DIAM").Value = self.D
+        cat_weight = 1.47e3*np.pi*(self.D/2)**2*self.L
+        self.specify({
+            # Reactors specifications
+            "TYPE": "TCOOL-SPEC",
+            "U": 60,
+            "CTEMP": 260,
 
-        # Reaction
-        nodes = self.AspenSimulation.Application.Tree.FindNode(f"/Data/Blocks/{self.name}/Input/RXN_ID").Elements
-        nodes.InsertRow(1, nodes.Count)
-        nodes(nodes.Count - 1).Value = "R-1"
+            # Sizing
+            "NPHASE": 2,
+            "LENGTH": self.L,
+            "DIAM": self.D,
 
+            # Pressure
+            "OPT_PDROP": "CORRELATION",
+            "DP_FCOR": "ERGUN",
 
-        # Pressure
-        self.BLK.Elements(self.name).Elements("Input").Elements("OPT_PDROP").Value = "CORRELATION"
-        self.BLK.Elements(self.name).Elements("Input").Elements("DP_FCOR").Value = "ERGUN"
-        
-        # Catalyst 
-        self.BLK.Elements(self.name).Elements("Input").Elements("CAT_PRESENT").Value = "YES"
-        cat_weight = 1.47e3*np.pi*(self.D/2)**2*self.L
-        self.BLK.Elements(self.name).Elements("Input").Elements("CATWT").Value = cat_weight
-        self.BLK.Elements(self.name).Elements("Input").Elements("BED_VOIDAGE").Value = 0.4
-        self.BLK.Elements(self.name).Elements("Input").Elements("DIA_PART").Value = 3e-3
+            # Catalyst
+            "CAT_PRESENT": "YES",
+            "CATWT": cat_weight,
+            "BED_VOIDAGE": 0.4,
+            "DIA_PART": 3e-3})
 
 
-        s = Stream(f"{self.name}OUT")
+        s = Stream(f"{self.name}OUT", sim=self.simulation)
         self.StreamConnect(self.name, s.name, "P(OUT)")
         return s
 
     def enery_consumption(self):
-        q = abs(self.BLK.Elements(self.name).Elements("Output").Elements("QCALC").Value)
+        q = abs(self.value("Output", "QCALC"))
         return q
 
 
 class PFR_A(Block):
+    params = ("D", "L")
+
     def __init__(self, name, D, L, inlet_stream):
-        super().__init__(name, "RPlug")
+        super().__init__(name, "RPlug", inlet_stream.simulation)
         self.name = name
         self.inlet_stream = inlet_stream
         self.D = D
@@ -366,41 +1079,47 @@ class PFR_A(Block):
         # Inlet connection
         self.StreamConnect(self.name, self.inlet_stream.name, "F(IN)")
 
-        # Reactors specifications
-        self.BLK.Elements(self.name).Elements("Input").Elements("TYPE").Value = "ADIABATIC"
-       
-        # Sizing
-        self.BLK.Elements(self.name).Elements("Input").Elements("NPHASE").Value = 2
-        self.BLK.Elements(self.name).Elements("Input").Elements("LENGTH").Value = self.L
-        self.BLK.Elements(self.name).Elements("Input").Elements("DIAM").Value = self.D
-
         # Reaction
-        nodes = self.AspenSimulation.Application.Tree.FindNode(f"/Data/Blocks/{self.name}/Input/RXN_ID").Elements
-        nodes.InsertRow(1, nodes.Count)
-        nodes(nodes.Count - 1).Value = "R-1"
-
+        if self.created:
+            nodes = self.AspenSimulation.Application.Tree.FindNode(f"/Data/Blocks/{self.name}/Input/RXN_ID").Elements
+            nodes.InsertRow(1, nodes.Count)
+            nodes(nodes.Count - 1).Value = "R-1"
 
-        # Pressure
-        self.BLK.Elements(self.name).Elements("Input").Elements("OPT_PDROP").Value = "CORRELATION"
-        self.BLK.Elements(self.name).Elements("Input").Elements("DP_FCOR").Value = "ERGUN"
-        
-        # Catalyst 
-        self.BLK.Elements(self.name).Elements("Input").Elements("CAT_PRESENT").Value = "YES"
         cat_weight = 1.47e3*np.pi*(self.D/2)**2*self.L
-        self.BLK.Elements(self.name).Elements("Input").Elements("CATWT").Value = cat_weight
-        self.BLK.Elements(self.name).Elements("Input").Elements("BED_VOIDAGE").Value = 0.4
-        self.BLK.Elements(self.name).Elements("Input").Elements("DIA_PART").Value = 3e-3
+        self.specify({
+            # Reactors specifications
+            "TYPE": "ADIABATIC",
+
+            # Sizing
+            "NPHASE": 2,
+            "LENGTH": self.L,
+            "DIAM": self.D,
 
+            # Pressure
+            "OPT_PDROP": "CORRELATION",
+            "DP_FCOR": "ERGUN",
 
-        s = Stream(f"{self.name}OUT")
+            # Catalyst
+            "CAT_PRESENT": "YES",
+            "CATWT": cat_weight,
+            "BED_VOIDAGE": 0.4,
+            "DIA_PART": 3e-3})
+
+
+        s = Stream(f"{self.name}OUT", sim=self.simulation)
         self.StreamConnect(self.name, s.name, "P(OUT)")
         return s
 
 
 
 class Column(Block):
+    params = ("nstages", "dist_rate", "reflux_ratio", "press")
+    outlets = ("LD(OUT)", "B(OUT)")
+    results_paths = (("Output", "COND_DUTY"), ("Output", "REB_DUTY"),
+                     ("Subobjects", "Tray Sizing", "1", "Output", "DIAM4", "1"))
+
     def __init__(self, name, nstages, dist_rate, reflux_ratio, press, inlet_stream):
-        super().__init__(name, "Radfrac")
+        super().__init__(name, "Radfrac", inlet_stream.simulation)
         self.name = name
         self.nstages = nstages
         self.dist_rate = dist_rate
@@ -413,47 +1132,47 @@ class Column(Block):
     def distill(self):
         self.StreamConnect(self.name, self.inlet_stream.name, "F(IN)")
                 
-        # Configuration
-        self.BLK.Elements(self.name).Elements("Input").Elements("CALC_MODE").Value = "EQUILIBRIUM"
-        self.BLK.Elements(self.name).Elements("Input").Elements("NSTAGE").Value = self.nstages
-        self.BLK.Elements(self.name).Elements("Input").Elements("CONDENSER").Value = "TOTAL"
-        self.BLK.Elements(self.name).Elements("Input").Elements("REBOILER").Value = "KETTLE"
-        self.BLK.Elements(self.name).Elements("Input").Elements("NO_PHASE").Value = 2
-        self.BLK.Elements(self.name).Elements("Input").Elements("CONV_METH").Value = "STANDARD" 
-        self.BLK.Elements(self.name).Elements("Input").Elements("BASIS_D").Value = self.dist_rate
-        self.BLK.Elements(self.name).Elements("Input").Elements("BASIS_RR").Value = self.reflux_ratio
-
-        # Streams
-        self.BLK.Elements(self.name).Elements("Input").Elements("FEED_STAGE").Elements(self.inlet_stream.name).Value = round(self.nstages/2, 0)
-        self.BLK.Elements(self.name).Elements("Input").Elements("FEED_CONVE2").Elements(self.inlet_stream.name).Value = "ABOVE-STAGE"
-
-        # Pressure
-        self.BLK.Elements(self.name).Elements("Input").Elements("PRES1").Value = self.press
-
-        # Convergence
-        self.BLK.Elements(self.name).Elements("Input").Elements("MAXOL").Value = 200
+        self.specify({
+            # Configuration
+            "CALC_MODE": "EQUILIBRIUM",
+            "NSTAGE": self.nstages,
+            "CONDENSER": "TOTAL",
+            "REBOILER": "KETTLE",
+            "NO_PHASE": 2,
+            "CONV_METH": "STANDARD",
+            "BASIS_D": self.dist_rate,
+            "BASIS_RR": self.reflux_ratio,
+
+            # Streams
+            ("FEED_STAGE", self.inlet_stream.name): round(self.nstages/2, 0),
+            ("FEED_CONVE2", self.inlet_stream.name): "ABOVE-STAGE",
+
+            # Pressure
+            "PRES1": self.press,
+
+            # Convergence
+            "MAXOL": self.IterationLimit(200)})
 
         # Tray sizing
-        self.BLK.Elements(self.name).Elements("Subobjects").Elements("Tray Sizing").Elements.Add("1")
-      
-        self.BLK.Elements(self.name).Elements("Subobjects").Elements("Tray Sizing").Elements("1").Elements("Input").Elements("TS_STAGE1").Elements("1").Value = 2
-        self.BLK.Elements(self.name).Elements("Subobjects").Elements("Tray Sizing").Elements("1").Elements("Input").Elements("TS_STAGE2").Elements("1").Value = self.nstages - 1
-        self.BLK.Elements(self.name).Elements("Subobjects").Elements("Tray Sizing").Elements("1").Elements("Input").Elements("TS_TRAYTYPE").Elements("1").Value = "SIEVE"
+        if self.created:
+            self.BLK.Elements(self.name).Elements("Subobjects").Elements("Tray Sizing").Elements.Add("1")
+        self.specify({("TS_STAGE1", "1"): 2, ("TS_STAGE2", "1"): self.nstages - 1, ("TS_TRAYTYPE", "1"): "SIEVE"},
+                     "Subobjects", "Tray Sizing", "1", "Input")
 
 
-        d = Stream(f"{self.name}DOUT")
+        d = Stream(f"{self.name}DOUT", sim=self.simulation)
         self.StreamConnect(self.name, d.name, "LD(OUT)")
-        b = Stream(f"{self.name}BOUT")
+        b = Stream(f"{self.name}BOUT", sim=self.simulation)
         self.StreamConnect(self.name, b.name, "B(OUT)")
         return d, b
     
     def enery_consumption(self):
-        q1 = abs(self.BLK.Elements(self.name).Elements("Output").Elements("COND_DUTY").Value)
-        q2 = abs(self.BLK.Elements(self.name).Elements("Output").Elements("REB_DUTY").Value)
+        q1 = abs(self.value("Output", "COND_DUTY"))
+        q2 = abs(self.value("Output", "REB_DUTY"))
         return q1 + q2
     
     def sizing(self):
-        D = self.BLK.Elements(self.name).Elements("Subobjects").Elements("Tray Sizing").Elements("1").Elements("Output").Elements("DIAM4").Elements("1").Value
+        D = self.value("Subobjects", "Tray Sizing", "1", "Output", "DIAM4", "1")
         H = 1.2*0.61*(self.nstages - 2)
 
         return D, H
@@ -461,8 +1180,13 @@ class Column(Block):
 
 
 class TriColumn(Block):
+    params = ("nstages", "dist_rate", "reflux_ratio", "press", "mid_rate")
+    outlets = ("LD(OUT)", "SP(OUT)", "B(OUT)")
+    results_paths = (("Output", "COND_DUTY"), ("Output", "REB_DUTY"),
+                     ("Subobjects", "Tray Sizing", "1", "Output", "DIAM4", "1"))
+
     def __init__(self, name, nstages, dist_rate, reflux_ratio, press, mid_rate, inlet_stream):
-        super().__init__(name, "Radfrac")
+        super().__init__(name, "Radfrac", inlet_stream.simulation)
         self.name = name
         self.nstages = nstages
         self.dist_rate = dist_rate
@@ -476,56 +1200,737 @@ class TriColumn(Block):
     def distill(self):
         self.StreamConnect(self.name, self.inlet_stream.name, "F(IN)")
         
-        # Configuration
-        self.BLK.Elements(self.name).Elements("Input").Elements("CALC_MODE").Value = "EQUILIBRIUM"
-        self.BLK.Elements(self.name).Elements("Input").Elements("NSTAGE").Value = self.nstages
-        self.BLK.Elements(self.name).Elements("Input").Elements("CONDENSER").Value = "TOTAL"
-        self.BLK.Elements(self.name).Elements("Input").Elements("REBOILER").Value = "KETTLE"
-        self.BLK.Elements(self.name).Elements("Input").Elements("NO_PHASE").Value = 2
-        self.BLK.Elements(self.name).Elements("Input").Elements("CONV_METH").Value = "STANDARD" 
-        self.BLK.Elements(self.name).Elements("Input").Elements("BASIS_D").Value = self.dist_rate
-        self.BLK.Elements(self.name).Elements("Input").Elements("BASIS_RR").Value = self.reflux_ratio
-
-        # Streams
-        self.BLK.Elements(self.name).Elements("Input").Elements("FEED_STAGE").Elements(self.inlet_stream.name).Value = round(self.nstages/3, 0)
-        self.BLK.Elements(self.name).Elements("Input").Elements("FEED_CONVE2").Elements(self.inlet_stream.name).Value = "ABOVE-STAGE"
-                
-        # Pressure
-        self.BLK.Elements(self.name).Elements("Input").Elements("PRES1").Value = self.press
-
-        # Convergence
-        self.BLK.Elements(self.name).Elements("Input").Elements("MAXOL").Value = 200
+        self.specify({
+            # Configuration
+            "CALC_MODE": "EQUILIBRIUM",
+            "NSTAGE": self.nstages,
+            "CONDENSER": "TOTAL",
+            "REBOILER": "KETTLE",
+            "NO_PHASE": 2,
+            "CONV_METH": "STANDARD",
+            "BASIS_D": self.dist_rate,
+            "BASIS_RR": self.reflux_ratio,
+
+            # Streams
+            ("FEED_STAGE", self.inlet_stream.name): round(self.nstages/3, 0),
+            ("FEED_CONVE2", self.inlet_stream.name): "ABOVE-STAGE",
+
+            # Pressure
+            "PRES1": self.press,
+
+            # Convergence
+            "MAXOL": self.IterationLimit(200)})
 
         # Tray sizing
-        self.BLK.Elements(self.name).Elements("Subobjects").Elements("Tray Sizing").Elements.Add("1")
-      
-        self.BLK.Elements(self.name).Elements("Subobjects").Elements("Tray Sizing").Elements("1").Elements("Input").Elements("TS_STAGE1").Elements("1").Value = 2
-        self.BLK.Elements(self.name).Elements("Subobjects").Elements("Tray Sizing").Elements("1").Elements("Input").Elements("TS_STAGE2").Elements("1").Value = self.nstages - 1
-        self.BLK.Elements(self.name).Elements("Subobjects").Elements("Tray Sizing").Elements("1").Elements("Input").Elements("TS_TRAYTYPE").Elements("1").Value = "SIEVE"
+        if self.created:
+            self.BLK.Elements(self.name).Elements("Subobjects").Elements("Tray Sizing").Elements.Add("1")
+        self.specify({("TS_STAGE1", "1"): 2, ("TS_STAGE2", "1"): self.nstages - 1, ("TS_TRAYTYPE", "1"): "SIEVE"},
+                     "Subobjects", "Tray Sizing", "1", "Input")
 
 
-        d = Stream(f"{self.name}DOUT")
+        d = Stream(f"{self.name}DOUT", sim=self.simulation)
         self.StreamConnect(self.name, d.name, "LD(OUT)")
-        mid = Stream(f"{self.name}MOUT")
+        mid = Stream(f"{self.name}MOUT", sim=self.simulation)
         self.StreamConnect(self.name, mid.name, "SP(OUT)")
-        b = Stream(f"{self.name}BOUT")
+        b = Stream(f"{self.name}BOUT", sim=self.simulation)
         self.StreamConnect(self.name, b.name, "B(OUT)")
 
-        self.BLK.Elements(self.name).Elements("Input").Elements("PROD_PHASE").Elements(mid.name).Value = "L"
-        self.BLK.Elements(self.name).Elements("Input").Elements("PROD_STAGE").Elements(mid.name).Value = round(self.nstages/2, 0)
-        self.BLK.Elements(self.name).Elements("Input").Elements("PROD_FLOW").Elements(mid.name).Value = self.mid_rate
+        self.specify({("PROD_PHASE", mid.name): "L",
+                      ("PROD_STAGE", mid.name): round(self.nstages/2, 0),
+                      ("PROD_FLOW", mid.name): self.mid_rate})
 
 
         return d, mid, b
     
 
     def enery_consumption(self):
-        q1 = abs(self.BLK.Elements(self.name).Elements("Output").Elements("COND_DUTY").Value)
-        q2 = abs(self.BLK.Elements(self.name).Elements("Output").Elements("REB_DUTY").Value)
+        q1 = abs(self.value("Output", "COND_DUTY"))
+        q2 = abs(self.value("Output", "REB_DUTY"))
         return q1 + q2
     
     def sizing(self):
-        D = self.BLK.Elements(self.name).Elements("Subobjects").Elements("Tray Sizing").Elements("1").Elements("Output").Elements("DIAM4").Elements("1").Value
+        D = self.value("Subobjects", "Tray Sizing", "1", "Output", "DIAM4", "1")
         H = 1.2*0.61*(self.nstages - 2)
 
         return D, H
+
+
+
+# -------------------------------------------------- SHORTCUT COLUMNS ------------------------------------------------
+
+# Pure component data of the MeOH/water/DME system: Antoine constants (log10 mmHg, °C), heat of
+# vaporization (kJ/mol), molar mass (g/mol) and liquid density (kg/m3)
+SHORTCUT_PROPERTIES = {
+    "DME": ((6.98985, 894.669, 242.546), 21.5, 46.07, 670),
+    "METHANOL": ((8.08097, 1582.271, 239.726), 35.3, 32.04, 790),
+    "WATER": ((8.07131, 1730.63, 233.426), 40.7, 18.02, 960),
+}
+
+
+def vapor_pressure(T, components):
+    # bar
+    antoine = np.array([SHORTCUT_PROPERTIES[c][0] for c in components])
+    return 10**(antoine[:, 0] - antoine[:, 1]/(antoine[:, 2] + T))*1.01325/760
+
+
+def bubble_temperature(x, P, components):
+    # °C of the liquid x (mole fractions) at P (bar), by bisection
+    terms = [(float(xi), SHORTCUT_PROPERTIES[c][0]) for xi, c in zip(x, components) if xi > 0]
+    P = P*760/1.01325
+    low, high = -150., 400.
+    for _ in range(50):
+        T = (low + high)/2
+        if sum(xi*10**(A - B/(C + T)) for xi, (A, B, C) in terms) > P:
+            high = T
+        else:
+            low = T
+    return T
+
+
+def shortcut_column(flows, vfrac, nstages, dist_rate, reflux_ratio, press, mid_rate=0, min_recovery=0.8):
+    """Fenske-Underwood-Gilliland rating of a column with a total condenser: the sharpest split
+    of the key components that nstages (including the reboiler) reach at reflux_ratio with the
+    distillate rate dist_rate. Flows in kmol/h, pressure in bar, temperatures in °C, duties in kW
+    and diameter in m. A liquid side draw (mid_rate) is approximated as a second split of the
+    bottoms over the stages below the draw.
+
+    Returns the predicted products, the keys, the minimum stages and reflux of the predicted
+    split and "feasible": False with a "reason" when the distillate or side draw does not fit in
+    the feed ("distillate", "side draw") or either key is recovered below min_recovery
+    ("separation")."""
+    components = [c for c in SHORTCUT_PROPERTIES if flows.get(c, 0) > 0]
+    f = np.array([flows[c] for c in components], dtype=float)
+    F = f.sum()
+    result = {"feasible": False, "reason": None, "components": components}
+    if not 0 < dist_rate < F or len(components) < 2:
+        result["reason"] = "distillate"
+        return result
+    if mid_rate and not 0 < mid_rate < F - dist_rate:
+        result["reason"] = "side draw"
+        return result
+
+    top = shortcut_split(f, 1 - vfrac, nstages - 1, dist_rate, reflux_ratio, press, components)
+    if top is None:
+        result["reason"] = "separation"
+        return result
+    result.update(top)
+    products = [top["distillate"], top["bottoms"]]
+    if mid_rate:
+        # Stripping section below the draw, fed by the liquid leaving the top split
+        stages = nstages - round(nstages/2)
+        side = shortcut_split(top["bottoms"], 1, stages, mid_rate, reflux_ratio, press, components)
+        if side is None:
+            result["reason"] = "separation"
+            return result
+        result["side"], result["bottoms"] = side["distillate"], side["bottoms"]
+        products = [top["distillate"], side["distillate"], side["bottoms"]]
+        result["recoveries"] += side["recoveries"]
+
+    result["temperatures"] = [bubble_temperature(p/p.sum(), press, components) for p in products]
+    for product in ("distillate", "side", "bottoms"):
+        if product in result:
+            result[product] = {c: float(flow) for c, flow in zip(components, result[product])}
+    result["feasible"] = min(result["recoveries"]) >= min_recovery
+    result["reason"] = None if result["feasible"] else "separation"
+    return result
+
+
+def shortcut_split(f, q, stages, D, R, P, components):
+    # Two-product split of the feed flows f with the liquid fraction q, None when no split reaches D
+    F = f.sum()
+    z = f/F
+    Tb = bubble_temperature(z, P, components)
+    volatility = vapor_pressure(Tb, components)
+    order = np.array([i for i in np.argsort(-volatility) if f[i] > 0])
+    if len(order) < 2:
+        return None
+
+    # Keys: the adjacent pair around the cut at D, the lighter components go to the distillate and
+    # the heavier ones (zero in d below) to the bottoms
+    cut = min(int(np.searchsorted(np.cumsum(f[order]), D)), len(order) - 1)
+    i = max(cut - 1, 0) if cut == len(order) - 1 else cut
+    lk, hk = order[i], order[i + 1]
+    lighter = order[:i]
+    D_keys = D - f[lighter].sum()
+    alpha = volatility/volatility[hk]
+
+    # Heavy key leaving with the distillate, from the sharpest split to the no-separation one
+    x_min = max(0., D_keys - f[lk])
+    x_eq = D_keys*f[hk]/(f[lk] + f[hk])
+    if not 0 <= x_min < x_eq:
+        return None
+    x = x_min + (x_eq - x_min)*np.geomspace(1e-9, 1, 400)[:-1]
+    d = np.zeros((len(x), len(f)))
+    d[:, lighter] = f[lighter]
+    d[:, lk] = D_keys - x
+    d[:, hk] = x
+    b = f - d
+
+    # Fenske
+    with np.errstate(divide="ignore"):
+        separation = (d[:, lk]/b[:, lk])*(b[:, hk]/d[:, hk])
+    min_stages = np.log(separation)/np.log(alpha[lk])
+
+    # Underwood, the root between the keys depends on the feed only
+    low, high = alpha[hk], alpha[lk]
+    for _ in range(60):
+        theta = (low + high)/2
+        if (alpha*z/(alpha - theta)).sum() > 1 - q:
+            high = theta
+        else:
+            low = theta
+    min_reflux = np.maximum((alpha*d/(alpha - theta)).sum(axis=1)/D - 1, 0)
+
+    # Gilliland (Molokanov)
+    X = np.clip((R - min_reflux)/(R + 1), 1e-9, 1)
+    Y = 1 - np.exp((1 + 54.4*X)/(11 + 117.2*X)*(X - 1)/np.sqrt(X))
+    with np.errstate(divide="ignore"):
+        required = np.where(R > min_reflux, (min_stages + Y)/(1 - Y), np.inf)
+    reached = np.flatnonzero(required <= stages)
+    if not len(reached):
+        return None
+    j = reached[0]
+
+    # Duties from the vapor flows at the top and the bottom, diameter from the flooding velocity
+    properties = [SHORTCUT_PROPERTIES[c] for c in components]
+    latent = np.array([p[1] for p in properties])
+    mass = np.array([p[2] for p in properties])
+    density = np.array([p[3] for p in properties])
+    V = (R + 1)*D
+    V_bottom = max(V - F*(1 - q), 1e-9)
+    x_D, x_B = d[j]/D, b[j]/b[j].sum()
+    diameter = 0
+    for flow, composition in ((V, x_D), (V_bottom, x_B)):
+        T = bubble_temperature(composition, P, components) + 273.15
+        M = composition @ mass
+        rho_V = P*1e5*M/(8314*T)
+        rho_L = 1/(composition*mass/M @ (1/density))
+        u = 0.8*0.08*np.sqrt((rho_L - rho_V)/rho_V)
+        area = flow*M/3600/rho_V/u/0.9
+        diameter = max(diameter, np.sqrt(4*area/np.pi))
+
+    return {
+        "light_key": components[lk],
+        "heavy_key": components[hk],
+        "alpha": float(alpha[lk]),
+        "min_stages": float(min_stages[j]),
+        "min_reflux": float(min_reflux[j]),
+        "stages": float(required[j]),
+        "distillate": d[j],
+        "bottoms": b[j],
+        "recoveries": [float(d[j, lk]/f[lk]), float(b[j, hk]/f[hk])],
+        "condenser_duty": float(-V*(x_D @ latent)/3.6),
+        "reboiler_duty": float(V_bottom*(x_B @ latent)/3.6),
+        "diameter": float(diameter)}
+
+
+
+# -------------------------------------------------- PACKED BED REACTOR ------------------------------------------------
+
+# Methanol dehydration 2 MeOH <-> DME + H2O over the catalyst bed of PFR/PFR_A, components in the
+# order of PACKED_BED_COMPONENTS. Gas heat capacities (J/kmol/K) at reaction conditions, heat of
+# reaction (J/kmol of DME) and molar masses (kg/kmol)
+PACKED_BED_COMPONENTS = ("METHANOL", "WATER", "DME")
+PACKED_BED_STOICHIOMETRY = np.array([-2., 1., 1.])
+PACKED_BED_CP = np.array([60e3, 35.5e3, 98e3])
+PACKED_BED_MASS = np.array([32.04, 18.02, 46.07])
+PACKED_BED_HEAT = -23.4e6
+
+
+def dme_rate(C, T):
+    """Rate (kmol/kg cat/h) of the dehydration at the concentrations C (kmol/m3, rows of
+    MeOH, water, DME) and T (K), Bercic & Levec (1992) with the equilibrium constant of
+    Diep & Wainwright (1987)."""
+    C = np.maximum(C, 0)
+    k = 5.35e13*np.exp(-17280/T)
+    K_M = 5.39e-4*np.exp(8487/T)
+    K_W = 8.47e-2*np.exp(5070/T)
+    K_eq = np.exp(2835.2/T + 1.675*np.log(T) - 2.39e-4*T - 0.21e-6*T**2 - 13.360)
+    driving = C[..., 0]**2 - C[..., 1]*C[..., 2]/K_eq
+    return k*K_M**2*driving/(1 + 2*np.sqrt(K_M*C[..., 0]) + K_W*C[..., 1])**4
+
+
+def packed_bed(flows, T, P, D, L, adiabatic=False, U=60, Tc=260, bulk_density=1.47e3, voidage=0.4,
+               particle=3e-3, viscosity=2e-5, rtol=1e-4, max_steps=10000):
+    """Outlet of gas-phase packed bed reactors, integrated together along the bed: flows
+    (kmol/h, rows in PACKED_BED_COMPONENTS order), T (°C), P (bar), D and L (m) and adiabatic
+    are per reactor or shared. Cooled reactors exchange U (W/m2/K) with a coolant at Tc (°C),
+    the pressure drop follows Ergun. Returns the outlet flows, T (°C), P (bar) and the duty
+    (kW, heat added to the process), NaN for the beds whose pressure collapses."""
+    flows = np.atleast_2d(np.asarray(flows, dtype=float))
+    n = len(flows)
+    T, P, D, L, adiabatic = (np.broadcast_to(np.asarray(v, dtype=float), (n,)) for v in (T, P, D, L, adiabatic))
+    area = np.pi*(D/2)**2
+    exchange = np.where(adiabatic > 0, 0, U*np.pi*D)     # W/m/K
+
+    def derivatives(y):
+        # d/dxi of (flows, T [K], P [bar], duty [W]), xi = z/L
+        F, T, P = y[:, :3], y[:, 3], np.maximum(y[:, 4], 1e-3)
+        total = np.maximum(F.sum(axis=1), 1e-12)
+        C = F/total[:, None]*(P*1e5/(8314*T))[:, None]
+        r = dme_rate(C, T)
+        heat = exchange*(Tc + 273.15 - T)
+        dF = (bulk_density*area*r)[:, None]*PACKED_BED_STOICHIOMETRY
+        dT = (-PACKED_BED_HEAT*r/3600*bulk_density*area + heat)/np.maximum(F @ PACKED_BED_CP/3600, 1e-12)
+        rho = P*1e5*(F @ PACKED_BED_MASS/total)/(8314*T)
+        u = F.sum(axis=1)/3600*8314*T/(P*1e5)/area
+        dP = -(150*viscosity*(1 - voidage)**2/(voidage**3*particle**2)*u
+               + 1.75*rho*(1 - voidage)/(voidage**3*particle)*u**2)/1e5
+        return np.column_stack([dF, dT, dP, heat])*L[:, None]
+
+    # The equilibrium is reached fast in hot beds (stiff), linearly implicit Rosenbrock ROS2 with an
+    # embedded first order solution for the error and a step size per reactor
+    gamma = 1 + 1/np.sqrt(2)
+    y = np.column_stack([flows, T + 273.15, P, np.zeros(n)])
+    # Error of the flows relative to the total flow, the duty follows the temperature
+    typical = np.abs(y[:, :5])
+    typical[:, :3] = flows.sum(axis=1, keepdims=True)
+    xi = np.zeros(n)
+    h = np.full(n, 1e-4)
+    identity = np.eye(y.shape[1])
+    with np.errstate(invalid="ignore", over="ignore", divide="ignore"):
+        for _ in range(max_steps):
+            active = xi < 1 - 1e-12
+            if not active.any():
+                break
+            h = np.where(active, np.minimum(h, 1 - xi), 0)
+            f0 = derivatives(y)
+            jacobian = np.empty((n,) + identity.shape)
+            for j in range(y.shape[1]):
+                delta = 1e-7*np.maximum(np.abs(y[:, j]), 1)
+                shifted = y.copy()
+                shifted[:, j] += delta
+                jacobian[:, :, j] = (derivatives(shifted) - f0)/delta[:, None]
+            W = identity - (gamma*h)[:, None, None]*jacobian
+            k1 = np.linalg.solve(W, f0[..., None])[..., 0]
+            k2 = np.linalg.solve(W, (derivatives(y + h[:, None]*k1) - 2*k1)[..., None])[..., 0]
+            step = y + h[:, None]*(1.5*k1 + 0.5*k2)
+            error = h[:, None]*0.5*(k1 + k2)
+            scale = rtol*(np.maximum(np.abs(y[:, :5]), np.abs(step[:, :5])) + typical)
+            norm = np.sqrt(np.mean((error[:, :5]/scale)**2, axis=1))
+            norm[~np.isfinite(norm) | (step[:, 3] <= 0)] = np.inf
+            accept = active & (norm <= 1)
+            y[accept] = step[accept]
+            xi[accept] += h[accept]
+            # Beds whose pressure collapses (Ergun) have no outlet
+            choked = y[:, 4] < 0.01*P
+            xi[choked] = 1
+            h = h*np.clip(0.9/np.sqrt(np.maximum(norm, 1e-10)), 0.2, 5)
+        else:
+            raise RuntimeError(f"packed_bed did not reach the outlet in {max_steps} steps")
+
+    y[choked] = np.nan
+    return np.maximum(y[:, :3], 0), y[:, 3] - 273.15, y[:, 4], y[:, 5]/1e3
+
+
+
+# -------------------------------------------------- PREFIX CACHE ------------------------------------------------
+
+class PrefixNode():
+    def __init__(self, parent, key):
+        self.parent = parent
+        self.key = key
+        self.children = {}
+        self.snapshot = None    # Engine state after the step (None for terminal steps)
+        self.results = None     # Stream outputs after the step
+        self.outcome = None     # (reward, sout) returned by the step
+        self.episode = None     # Environment attributes after the step
+
+
+class PrefixCache():
+    """Trie over action sequences. Each node holds the engine snapshot and the step outcome
+    reached after its prefix, at most max_nodes are kept (least recently used leaves go first).
+    With snapshots=False the engine is brought to a prefix by replaying its actions instead."""
+
+    def __init__(self, max_nodes=256, directory=None, decimals=3, snapshots=True):
+        self.max_nodes = max_nodes
+        self.directory = directory
+        self.decimals = decimals    # Rounding of continuous actions in the keys
+        self.snapshots = snapshots
+        self.root = PrefixNode(None, None)
+        self.lru = OrderedDict()
+        self.files = 0
+        self.stale = []     # Snapshot files of evicted nodes the engine can still be rebuilt from
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, action):
+        if isinstance(action, dict):
+            continuous = np.round(np.asarray(action["continuous"], dtype=float), self.decimals)
+            return (int(action["discrete"]), tuple(continuous.tolist()))
+        return int(action)
+
+    def action(self, key):
+        if isinstance(key, tuple):
+            return {"discrete": key[0], "continuous": np.array(key[1])}
+        return key
+
+    def path(self, node):
+        keys = []
+        while node.parent is not None:
+            keys.append(node.key)
+            node = node.parent
+        return keys[::-1]
+
+    def lookup(self, node, action):
+        child = node.children.get(self.key(action))
+        if child is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.lru.move_to_end(id(child))
+        return child
+
+    def snapshot_path(self):
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix="prefix_cache_")
+        os.makedirs(self.directory, exist_ok=True)
+        self.files += 1
+        return os.path.join(self.directory, f"prefix_{self.files}.bkp")
+
+    def insert(self, node, action, keep=(), archives=()):
+        # keep: nodes still in use (the engine's), archives: files the engine is rebuilt from
+        key = self.key(action)
+        child = PrefixNode(node, key)
+        node.children[key] = child
+        self.lru[id(child)] = child
+        keep = (child,) + tuple(keep)
+        while len(self.lru) > self.max_nodes and self.evict(keep, archives):
+            pass
+        return child
+
+    def evict(self, keep=(), archives=()):
+        # Drops the least recently used leaf not in keep, False when there is none
+        for leaf in self.lru.values():
+            if not leaf.children and not any(leaf is node for node in keep):
+                break
+        else:
+            return False
+        del self.lru[id(leaf)]
+        del leaf.parent.children[leaf.key]
+        if leaf.snapshot is not None and isinstance(leaf.snapshot["state"], str):
+            self.stale.append(leaf.snapshot["state"])
+        # Snapshot files are only deleted once a restart of the engine no longer loads them
+        for path in self.stale:
+            if path not in archives and os.path.exists(path):
+                os.remove(path)
+        self.stale = [path for path in self.stale if path in archives]
+        return True
+
+    def __len__(self):
+        return len(self.lru)
+
+
+
+# -------------------------------------------------- RESULT CACHE ------------------------------------------------
+
+class ResultCache():
+    """Simulation results stored in SQLite, keyed by the canonical flowsheet, the quantized
+    decision variables and the inlet specs. Several worker processes can share the same file."""
+
+    def __init__(self, path="results.sqlite", digits=6, timeout=60):
+        self.path = os.path.abspath(path)
+        self.digits = digits    # Significant digits kept when quantizing numbers in the keys
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._connection = None
+        self._pid = None
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, flowsheet TEXT, value BLOB, created REAL)")
+
+    @property
+    def connection(self):
+        # One connection per process, workers forked or spawned from the parent open their own
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._pid = os.getpid()
+        return self._connection
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_connection"] = None
+        state["_pid"] = None
+        return state
+
+    def quantize(self, value):
+        if isinstance(value, dict):
+            return [[str(k), self.quantize(v)] for k, v in sorted(value.items(), key=lambda item: str(item[0]))]
+        if isinstance(value, (list, tuple, np.ndarray)):
+            return [self.quantize(v) for v in value]
+        if isinstance(value, (bool, np.bool_)):
+            return bool(value)
+        if isinstance(value, (int, np.integer)):
+            return int(value)
+        if isinstance(value, (float, np.floating)):
+            return float(f"{value:.{self.digits}g}")
+        return value
+
+    def canonical(self, flowsheet, decision_variables=(), inlet_specs=()):
+        return json.dumps(self.quantize([flowsheet, decision_variables, inlet_specs]), separators=(",", ":"))
+
+    def key(self, flowsheet, decision_variables=(), inlet_specs=()):
+        return hashlib.sha256(self.canonical(flowsheet, decision_variables, inlet_specs).encode()).hexdigest()
+
+    def dumps(self, value):
+        # Simulation objects (the engine) are not stored, they are bound again when loading
+        buffer = io.BytesIO()
+        pickler = pickle.Pickler(buffer, protocol=pickle.HIGHEST_PROTOCOL)
+        pickler.persistent_id = lambda obj: "simulation" if type(obj) is Simulation else None
+        pickler.dump(value)
+        return buffer.getvalue()
+
+    def loads(self, data, sim=None):
+        unpickler = pickle.Unpickler(io.BytesIO(data))
+        unpickler.persistent_load = self.bind(sim)
+        return unpickler.load()
+
+    @staticmethod
+    def bind(sim):
+        # Simulations referenced by the stored value are replaced by sim
+        def persistent_load(pid):
+            if sim is None:
+                raise pickle.UnpicklingError("The cached value references a simulation, pass sim to bind it")
+            return sim
+        return persistent_load
+
+    def get(self, key, sim=None):
+        row = self.connection.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self.loads(row[0], sim)
+
+    def put(self, key, value, flowsheet=""):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO results (key, flowsheet, value, created) VALUES (?, ?, ?, ?)",
+            (key, str(flowsheet), self.dumps(value), time.time()))
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+
+
+# -------------------------------------------------- SURROGATES ------------------------------------------------
+
+class Surrogate():
+    """Per-unit models of the engine for the multi-fidelity mode: inverse distance weighted
+    k-nearest neighbours over the inlet stream and the parameters of each unit type, with the
+    samples recorded from the converged engine runs. Streams are vectors (T, P, vapor fraction,
+    component flows), mixers and splitters are balanced exactly and recycles are converged by
+    successive substitution. Units without a model yet are estimated instead of going to the
+    engine: columns by shortcut_column with shortcut=True, reactors by packed_bed with native=True."""
+
+    def __init__(self, components=("METHANOL", "WATER", "DME"), k=5, min_samples=20, max_distance=None,
+                 max_sweeps=50, tol=1e-4, shortcut=False, native=False):
+        self.components = tuple(components)
+        self.k = k
+        self.min_samples = min_samples      # Unit types with fewer samples go to the engine
+        self.max_distance = max_distance    # Standardized distance to the nearest sample beyond which the engine is used
+        self.max_sweeps = max_sweeps        # Successive substitution of the recycles
+        self.tol = tol
+        self.shortcut = shortcut
+        self.native = native
+        self.samples = {}   # unit type -> {inputs key: (inputs, outputs)}
+        self.models = {}    # unit type -> (X, Y, scale) or None, rebuilt after new samples
+        self.feeds = {}     # (stream, specs) -> vector from the engine
+        self.predictions = 0
+        self.fallbacks = 0
+
+    def ports(self, sim, Blockname):
+        # Inlet streams and {port: streams} of the outlets of a block declared in the flowsheet
+        inlets, outlets = [], {}
+        for block, stream, port in sorted(sim.connections):
+            if block != Blockname or ("PORT", block, stream, port) not in sim.declared:
+                continue
+            if port == "F(IN)":
+                inlets.append(stream)
+            else:
+                outlets.setdefault(port, []).append(stream)
+        return inlets, outlets
+
+    def read(self, sim, Streamname):
+        # Vector of a stream from the engine, None when it has no results
+        out = sim.STRM.Elements(Streamname).Elements("Output")
+        values = [out.Elements("TEMP_OUT").Elements("MIXED").Value,
+                  out.Elements("PRES_OUT").Elements("MIXED").Value,
+                  out.Elements("STR_MAIN").Elements("VFRAC").Elements("MIXED").Value]
+        values += [out.Elements("MOLEFLOW").Elements("MIXED").Elements(c).Value for c in self.components]
+        if any(value is None for value in values):
+            return None
+        return np.array(values, dtype=float)
+
+    def record(self, sim):
+        # Samples of the learned units from the last converged engine run
+        streams = {s: self.read(sim, s) for s in sim.streams if ("STREAM", s) in sim.declared}
+        for name, inlet in sim.feeds.items():
+            if streams.get(name) is not None:
+                self.feeds[(name, repr(inlet))] = streams[name]
+
+        for name, unit in sim.units.items():
+            if not unit.learned or ("BLOCK", name) not in sim.declared:
+                continue
+            inlets, outlets = self.ports(sim, name)
+            vectors = [streams.get(s) for port in unit.outlets for s in outlets.get(port, [])]
+            if len(inlets) != 1 or streams.get(inlets[0]) is None or len(vectors) != len(unit.outlets) \
+                    or any(v is None for v in vectors):
+                continue
+            values = []
+            for path in unit.results_paths:
+                node = sim.BLK.Elements(name)
+                for element in path:
+                    node = node.Elements(element)
+                values.append(node.Value)
+            if any(value is None for value in values):
+                continue
+            x = np.concatenate([streams[inlets[0]], [getattr(unit, p) for p in unit.params]]).astype(float)
+            y = np.concatenate(vectors + [np.array(values, dtype=float)])
+            kind = type(unit).__name__
+            self.samples.setdefault(kind, {})[np.round(x, 6).tobytes()] = (x, y)
+            self.models.pop(kind, None)
+
+    def model(self, kind):
+        if kind not in self.models:
+            samples = list(self.samples.get(kind, {}).values())
+            if len(samples) < self.min_samples:
+                self.models[kind] = None
+            else:
+                X = np.array([x for x, _ in samples])
+                Y = np.array([y for _, y in samples])
+                std = X.std(axis=0)
+                # Inputs that never changed in the samples (the feed...) are scaled by their magnitude
+                scale = np.where(std > 0, std, np.maximum(np.abs(X[0]), 1))
+                self.models[kind] = (X, Y, 1/scale)
+        return self.models[kind]
+
+    def predict(self, unit, inlets, outlets):
+        model = self.model(type(unit).__name__)
+        if len(inlets) != 1:
+            return None
+        if model is None:
+            return self.estimate(unit, inlets[0], outlets)
+        X, Y, scale = model
+        x = np.concatenate([inlets[0], [getattr(unit, p) for p in unit.params]])
+        distance = np.sqrt((((X - x)*scale)**2).sum(axis=1))
+        k = min(self.k, len(distance))
+        nearest = np.argpartition(distance, k - 1)[:k]
+        if self.max_distance is not None and distance[nearest].min() > self.max_distance:
+            return None
+        weights = 1/(distance[nearest] + 1e-9)
+        y = weights @ Y[nearest]/weights.sum()
+
+        n = 3 + len(self.components)
+        streams = {}
+        for i, port in enumerate(unit.outlets):
+            for name in outlets.get(port, []):
+                streams[name] = y[i*n:(i + 1)*n]
+        values = dict(zip(unit.results_paths, y[len(unit.outlets)*n:]))
+        return streams, values
+
+    def estimate(self, unit, inlet, outlets):
+        # Shortcut prediction of a column or native one of a reactor, None for other units and infeasible specs
+        if self.native and isinstance(unit, (PFR, PFR_A)):
+            flows = [inlet[3 + self.components.index(c)] for c in PACKED_BED_COMPONENTS]
+            F, T, P, duty = packed_bed(flows, inlet[0], inlet[1], unit.D, unit.L, adiabatic=isinstance(unit, PFR_A))
+            if np.isnan(T[0]):
+                return None
+            out = dict(zip(PACKED_BED_COMPONENTS, F[0]))
+            streams = {name: np.array([T[0], P[0], 1] + [out.get(c, 0) for c in self.components])
+                       for name in outlets.get("P(OUT)", [])}
+            return streams, dict(zip(unit.results_paths, duty))
+        if not self.shortcut or not isinstance(unit, (Column, TriColumn)):
+            return None
+        screen = shortcut_column(dict(zip(self.components, inlet[3:])), inlet[2], unit.nstages, unit.dist_rate,
+                                 unit.reflux_ratio, unit.press, getattr(unit, "mid_rate", 0))
+        if not screen["feasible"]:
+            return None
+        products = [screen[p] for p in ("distillate", "side", "bottoms") if p in screen]
+        streams = {}
+        for port, product, T in zip(unit.outlets, products, screen["temperatures"]):
+            for name in outlets.get(port, []):
+                streams[name] = np.array([T, unit.press, 0] + [product.get(c, 0) for c in self.components])
+        values = dict(zip(unit.results_paths, (screen["condenser_duty"], screen["reboiler_duty"], screen["diameter"])))
+        return streams, values
+
+    def mix(self, inlets):
+        # Adiabatic mixing approximated by the flow weighted temperature, at the lowest inlet pressure
+        inlets = np.array(inlets)
+        totals = inlets[:, 3:].sum(axis=1)
+        weights = totals/totals.sum() if totals.sum() > 0 else np.full(len(inlets), 1/len(inlets))
+        out = np.empty(inlets.shape[1])
+        out[0] = weights @ inlets[:, 0]
+        out[1] = inlets[:, 1].min()
+        out[2] = weights @ inlets[:, 2]
+        out[3:] = inlets[:, 3:].sum(axis=0)
+        return out
+
+    def feed(self, Streamname, inlet):
+        vector = self.feeds.get((Streamname, repr(inlet)))
+        if vector is None:
+            # Not seen by the engine yet, taken as liquid
+            T, P, comp = inlet
+            vector = np.array([T, P, 0] + [comp.get(c, 0) for c in self.components], dtype=float)
+        return vector
+
+    def solve(self, sim):
+        # Results of the declared flowsheet keyed like Simulation.StreamResults (plus {path: value}
+        # of the blocks), None when a unit cannot be predicted or the recycles do not converge
+        units = [unit for name, unit in sim.units.items() if ("BLOCK", name) in sim.declared]
+        ports = {unit.name: self.ports(sim, unit.name) for unit in units}
+        streams = {name: self.feed(name, inlet) for name, inlet in sim.feeds.items()}
+        blocks = {}
+
+        recycle = False
+        for sweep in range(self.max_sweeps):
+            previous = dict(streams)
+            for unit in units:
+                inlets, outlets = ports[unit.name]
+                vectors = [streams[s] for s in inlets if s in streams]
+                # Recycles are placed after the units they feed, they start from zero flow
+                recycle |= len(vectors) < len(inlets)
+                prediction = unit.predict(vectors, outlets, self) if vectors else None
+                if prediction is None:
+                    self.fallbacks += 1
+                    return None
+                outputs, blocks[unit.name] = prediction
+                streams.update(outputs)
+            if not recycle:
+                break
+            change = max((np.abs(streams[s] - v).max()/(np.abs(v).max() + 1e-9) for s, v in previous.items()),
+                         default=0)
+            if sweep and change < self.tol:
+                break
+        else:
+            self.fallbacks += 1
+            return None
+
+        results = {}
+        for name, v in streams.items():
+            values = {
+                ("TEMP_OUT", "MIXED"): float(v[0]),
+                ("PRES_OUT", "MIXED"): float(v[1]),
+                ("MOLEFLMX", "MIXED"): float(v[3:].sum()),
+                ("STR_MAIN", "VFRAC", "MIXED"): float(v[2])}
+            for compound, flow in zip(self.components, v[3:]):
+                values[("MOLEFLOW", "MIXED", compound)] = float(flow)
+            results[name] = values
+        for name, values in blocks.items():
+            results[name] = {path: float(value) for path, value in values.items()}
+        self.predictions += 1
+        return results
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            pickle.dump({"samples": self.samples, "feeds": self.feeds}, f)
+
+    def load(self, path):
+        # Adds the samples logged in path
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        for kind, samples in data["samples"].items():
+            self.samples.setdefault(kind, {}).update(samples)
+        self.feeds.update(data["feeds"])
+        self.models.clear()
@@ -7,13 +7,39 @@ from gym import Env
 from gym.spaces import Discrete, Box, Dict
 from gym.utils import seeding
 
+# Tag of the stored results, bumped when the stored episodes change so that older stores are not read
+RESULT_VERSION = 2
+
 
 class Flowsheet(Env):
-    def __init__(self, sim, pure, max_iter, inlet_specs):
+    def __init__(
+        self,
+        sim,
+        pure,
+        max_iter,
+        inlet_specs,
+        prefix_cache=None,
+        result_cache=None,
+        validate=0.1,
+        validate_final=True,
+    ):
 
         # Establish connection with ASPEN
         self.sim = sim
 
+        # Optional PrefixCache, steps along an already simulated action prefix are replayed.
+        # An optional ResultCache keeps the steps across runs (it needs a trie to replay them)
+        if result_cache is not None and prefix_cache is None:
+            prefix_cache = PrefixCache(snapshots=False)
+        self.prefix_cache = prefix_cache
+        self.result_cache = result_cache
+
+        # Multi-fidelity (sim with a Surrogate): steps go through the surrogates, a fraction validate
+        # of them and, with validate_final, the final flowsheet of each episode go to the engine.
+        # The caches are not used in this mode
+        self.validate = validate
+        self.validate_final = validate_final
+
         # Characteristics of the environment
         self.d_actions = 10
         self.pure = pure
@@ -94,7 +120,150 @@ class Flowsheet(Env):
 
         return out_list
 
+    # Attributes that describe the episode so far (stored in the prefix cache)
+    episode_attrs = (
+        "iter",
+        "actions_list",
+        "info",
+        "state",
+        "done",
+        "avail_actions",
+        "value_step",
+        "mixer_count",
+        "hex_count",
+        "cooler_count",
+        "pump_count",
+        "reac_count",
+        "column_count",
+        "water_pure",
+        "dme_pure",
+        "dme_extra_added",
+        "dme_out",
+    )
+
+    def save_episode(self):
+        return {
+            attr: copy.deepcopy(getattr(self, attr), {id(self.sim): self.sim})
+            for attr in self.episode_attrs
+        }
+
+    def load_episode(self, episode):
+        for attr, value in episode.items():
+            setattr(self, attr, copy.deepcopy(value, {id(self.sim): self.sim}))
+
     def step(self, action, sin):
+        if self.sim.surrogate is not None:
+            return self.surrogate_step(action, sin)
+        if self.prefix_cache is None:
+            return self.simulate(action, sin)
+
+        node = self.prefix_cache.lookup(self.cache_node, action)
+        if node is None and self.result_cache is not None:
+            node = self.load_result(action)
+        if node is not None:
+            # Prefix already simulated: replay it, streams are read from the stored results
+            self.cache_node = node
+            self.load_episode(node.episode)
+            self.sim.results = node.results
+            reward, sout = node.outcome
+            return self.state, reward, self.done, self.info, sout
+
+        # Bring the engine to the deepest cached prefix before simulating the new unit
+        self.sync_engine()
+        self.sim.results = None
+        state, reward, done, info, sout = self.simulate(action, sin)
+        if self.sim.failure is not None:
+            # Failed runs (timeouts, engine crashes) are not cached
+            self.engine_node = None
+            return state, reward, done, info, sout
+
+        node = self.prefix_cache.insert(self.cache_node, action, (self.engine_node,), self.sim.Archives())
+        if not done and self.prefix_cache.snapshots:
+            node.snapshot = self.sim.SaveSnapshot(self.prefix_cache.snapshot_path())
+            node.results = node.snapshot["results"]
+        else:
+            node.results = self.sim.StreamResults()
+        node.outcome = (reward, sout)
+        node.episode = self.save_episode()
+        self.cache_node = self.engine_node = node
+        if self.result_cache is not None:
+            record = {
+                "results": node.results,
+                "outcome": node.outcome,
+                "episode": node.episode,
+            }
+            self.result_cache.put(self.result_key(node), record, self.actions_list)
+        return state, reward, done, info, sout
+
+    def surrogate_step(self, action, sin):
+        self.sim.fidelity = (
+            "engine" if self.np_random.random() < self.validate else "surrogate"
+        )
+        state, reward, done, info, sout = self.simulate(action, sin)
+        # Units the surrogates cannot predict yet go to the engine as well
+        predicted = self.sim.results is not None
+        info["fidelity"] = "surrogate" if predicted else "engine"
+        if done and predicted and self.validate_final:
+            info["validation"] = self.validation(sout)
+        return state, reward, done, info, sout
+
+    def validation(self, sout):
+        # Runs the engine on the flowsheet predicted by the surrogates, its samples are recorded
+        predicted = self.observe(sout)
+        self.sim.fidelity = "engine"
+        self.sim.results = None
+        converged = self.sim.Convergence()
+        validation = {
+            "converged": converged,
+            "surrogate_state": predicted,
+            "state": self.observe(sout) if converged else None,
+        }
+        if not converged:
+            validation["status"] = self.sim.RunStatus()
+        return validation
+
+    def result_key(self, node):
+        flowsheet = ["DME", RESULT_VERSION, self.d_actions] + self.prefix_cache.path(node)
+        return self.result_cache.key(flowsheet, [self.pure, self.max_iter], self.inlet_specs)
+
+    def load_result(self, action):
+        node = self.prefix_cache.insert(self.cache_node, action, (self.engine_node,), self.sim.Archives())
+        record = self.result_cache.get(self.result_key(node), self.sim)
+        if record is None:
+            del self.prefix_cache.lru[id(node)]
+            del self.cache_node.children[node.key]
+            return None
+        node.results = record["results"]
+        node.outcome = record["outcome"]
+        node.episode = record["episode"]
+        return node
+
+    def sync_engine(self):
+        # Walk up to the engine state, a snapshot or the feed, then replay the actions
+        path = []
+        node = self.cache_node
+        while node is not self.engine_node and node.snapshot is None and node.parent:
+            path.append(node)
+            node = node.parent
+        if node is not self.engine_node:
+            if node.snapshot is not None:
+                self.sim.LoadSnapshot(node.snapshot)
+            else:
+                self.sim.Reinitialize()
+                Stream("IN", self.inlet_specs, sim=self.sim)
+        if path:
+            # The replay runs from the episode of the prefix, the current one (masks included) is restored after
+            current = self.save_episode()
+            self.sim.results = None
+            self.load_episode(node.episode)
+            sin = node.outcome[1]
+            for step_node in reversed(path):
+                action = self.prefix_cache.action(step_node.key)
+                sin = self.simulate(action, sin)[4]
+            self.load_episode(current)
+        self.engine_node = self.cache_node
+
+    def simulate(self, action, sin):
         self.iter += 1
 
         d_action = action["discrete"]
@@ -286,6 +455,8 @@ class Flowsheet(Env):
             for i, uo in enumerate(self.actions_list):
                 if "M" in uo:
                     self.sim.StreamConnect(self.actions_list[i], rec.name, "F(IN)")
+                    if self.sim.tear_method is not None:
+                        self.sim.TearStream(rec.name)
                     break
 
             self.sim.EngineRun()
@@ -369,6 +540,8 @@ class Flowsheet(Env):
             for i, uo in enumerate(self.actions_list):
                 if "M" in uo:
                     self.sim.StreamConnect(self.actions_list[i], rec.name, "F(IN)")
+                    if self.sim.tear_method is not None:
+                        self.sim.TearStream(rec.name)
                     break
 
             self.sim.EngineRun()
@@ -449,24 +622,30 @@ class Flowsheet(Env):
 
             reward = cost + bonus + bonus_T + penalty + reward_flow + dme_extra
 
-            self.state = np.array(
-                [
-                    sout.get_temp() / 400,
-                    sout.get_press() / 10,
-                    sout.get_molar_flow("METHANOL") / sout.get_total_molar_flow(),
-                    sout.get_molar_flow("WATER") / sout.get_total_molar_flow(),
-                    sout.get_molar_flow("DME") / sout.get_total_molar_flow(),
-                    self.iter / self.max_iter,
-                ]
-            )
+            self.state = self.observe(sout)
 
         else:
             self.done = True
             reward = -8
+            if self.sim.failure is not None:
+                self.info["failure"] = self.sim.failure
+            self.info["status"] = self.sim.RunStatus()
 
         # Return step information
         return self.state, reward, self.done, self.info, sout
 
+    def observe(self, sout):
+        return np.array(
+            [
+                sout.get_temp() / 400,
+                sout.get_press() / 10,
+                sout.get_molar_flow("METHANOL") / sout.get_total_molar_flow(),
+                sout.get_molar_flow("WATER") / sout.get_total_molar_flow(),
+                sout.get_molar_flow("DME") / sout.get_total_molar_flow(),
+                self.iter / self.max_iter,
+            ]
+        )
+
     def fixed_cost_reactor(self, D, H):
         M_S = 1638.2  # Marshall & Swift equipment index 2018 (1638.2, fixed)
         f_cost = (M_S) / 280 * 101.9 * D**1.066 * H**0.802 * (2.18 + 1.15)
@@ -574,7 +753,7 @@ class Flowsheet(Env):
         T, P, compounds = self.inlet_specs
         Fm, Fw, Fdme = compounds["METHANOL"], compounds["WATER"], compounds["DME"]
         tot_flow = Fw + Fm + Fdme
-        sin = Stream("IN", self.inlet_specs)
+        sin = Stream("IN", self.inlet_specs, sim=self.sim)
 
         self.state = np.array(
             [
@@ -606,6 +785,11 @@ class Flowsheet(Env):
 
         self.dme_out = 0
 
+        if self.prefix_cache is not None:
+            self.cache_node = self.engine_node = self.prefix_cache.root
+            self.cache_node.episode = self.save_episode()
+            self.cache_node.outcome = (0, sin)
+
         return self.state, sin
 
     def masking(self, sin, inlet):
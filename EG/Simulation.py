@@ -1,25 +1,292 @@
 import os
-import win32com.client as win32
+import io
+import re
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
 import numpy as np
 
 
-class Simulation:
-    AspenSimulation = win32.gencache.EnsureDispatch("Apwn.Document")
+def aspen_backend():
+    # Imported here so that the modules stay importable without pywin32/Aspen
+    import win32com.client as win32
+
+    return win32.gencache.EnsureDispatch("Apwn.Document")
+
+
+def run_status(engine, blocks=()):
+    """Status of the last run from the engine's run summary: counts and lines of the
+    errors, warnings and messages, the blocks named in the errors/warnings and the
+    iterations reported for them (e.g. "NOT CONVERGED IN 50 ITERATIONS").
+    """
+    status = {
+        "errors": 0,
+        "warnings": 0,
+        "messages": 0,
+        "lines": {},
+        "blocks": [],
+        "iterations": {},
+    }
+    for key, field in (
+        ("PER_ERROR", "errors"),
+        ("PER_WARNING", "warnings"),
+        ("PER_MESSAGE", "messages"),
+    ):
+        node = engine.Tree.FindNode(f"/Data/Results Summary/Run-Status/Output/{key}")
+        count = node.Value if node else 0
+        status[field] = count or 0
+        status["lines"][field] = (
+            [str(child.Value) for child in node.Elements] if count else []
+        )
+
+    lines = status["lines"]["errors"] + status["lines"]["warnings"]
+    for block in blocks:
+        pattern = re.compile(rf"\b{re.escape(block)}\b")
+        named = [line for line in lines if pattern.search(line)]
+        if named:
+            status["blocks"].append(block)
+        for line in named:
+            match = re.search(r"(\d+)\s+ITERATIONS", line)
+            if match:
+                status["iterations"][block] = int(match.group(1))
+    return status
+
+
+class EngineJournal:
+    """Proxy of the engine COM objects that records every change made to the flowsheet
+    (element adds/removes, rows, input values, archive loads), so that it can be rebuilt
+    on a fresh engine after a crash.
+    """
+
+    MUTATING = (
+        "Add",
+        "Remove",
+        "RemoveAll",
+        "InsertRow",
+        "RemoveRow",
+        "InitFromArchive2",
+        "restore",
+    )
+    VALUES = (int, float, str, bool, tuple, type(None))
+    NAVIGATION = ("Application", "Tree", "Elements", "FindNode")
+
+    def __init__(self, target, journal, steps=()):
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_journal", journal)
+        object.__setattr__(self, "_steps", steps)
+
+    def _wrap(self, value, step):
+        if isinstance(value, self.VALUES):
+            return value
+        return EngineJournal(value, self._journal, self._steps + (step,))
+
+    def __getattr__(self, name):
+        return self._wrap(getattr(self._target, name), ("attr", name))
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
+        if self._steps:  # Document level settings are applied again on every dispatch
+            self._journal.append((self._steps, "set", (name, value)))
+
+    def __call__(self, *args):
+        result = self._target(*args)
+        kind, name = self._steps[-1] if self._steps else (None, None)
+        if kind == "attr" and name in self.MUTATING:
+            if name in ("InitFromArchive2", "restore"):
+                # Loading a whole archive/state makes the earlier changes irrelevant
+                del self._journal[:]
+            self._journal.append((self._steps[:-1], name, args))
+        return self._wrap(result, ("call", args))
+
+    def __iter__(self):
+        for item in self._target:
+            yield self._wrap(item, ("call", (item.Name,)))
+
+    @classmethod
+    def path(cls, steps):
+        # Element names along steps, the same for Elements() chains and FindNode paths
+        names = []
+        for kind, value in steps:
+            if kind == "attr":
+                if value not in cls.NAVIGATION:
+                    names.append(value)
+            elif len(value) == 1 and str(value[0]).startswith("/"):
+                names.extend(value[0].strip("/").split("/"))
+            else:
+                names.extend(value)
+        return tuple(names)
+
+    @classmethod
+    def target(cls, entry):
+        # Element changed by an entry: node set, element added/removed, collection emptied
+        steps, op, args = entry
+        path = cls.path(steps)
+        if op in ("Add", "Remove"):
+            return path + (str(args[0]).split("!")[0],)
+        return path
+
+    @staticmethod
+    def removes(op, target, entry_op, entry_target):
+        # Whether removing target drops an earlier entry: everything done under it and,
+        # for streams, the block ports and specs that refer to them
+        if entry_target[: len(target)] == target:
+            # Earlier removes are kept, the element may come from the archive
+            return op == "RemoveAll" or entry_op not in ("Remove", "RemoveAll")
+        if target[:2] != ("Data", "Streams") or entry_target[:2] != ("Data", "Blocks"):
+            return False
+        if op == "RemoveAll":
+            return "Ports" in entry_target
+        return target[2] in entry_target[4:]
+
+    @classmethod
+    def compact(cls, journal):
+        """Journal reduced to the changes still in effect, so that a rebuild replays the
+        current flowsheet only: the last value set on every node, adds cancelled by later
+        removes, and what was done under (or connected to) removed elements dropped.
+        """
+        kept = {}  # position in the journal -> (target, entry)
+        values = {}  # (target, attribute) -> position of the value in effect
+        for position, entry in enumerate(journal):
+            steps, op, args = entry
+            if op in ("InitFromArchive2", "restore"):
+                kept.clear()
+            target = cls.target(entry)
+            if op == "set":
+                kept.pop(values.get((target, args[0])), None)
+                values[(target, args[0])] = position
+            elif op in ("Remove", "RemoveAll"):
+                dropped = [
+                    p
+                    for p, (t, (_, o, _)) in kept.items()
+                    if cls.removes(op, target, o, t)
+                ]
+                added = any(
+                    kept[p][0] == target and kept[p][1][1] == "Add" for p in dropped
+                )
+                for p in dropped:
+                    del kept[p]
+                if op == "Remove" and added:
+                    continue
+            kept[position] = (target, entry)
+        return [entry for _, entry in kept.values()]
+
+    @staticmethod
+    def replay(engine, journal):
+        for steps, op, args in journal:
+            node = engine
+            for kind, value in steps:
+                node = getattr(node, value) if kind == "attr" else node(*value)
+            if op == "set":
+                setattr(node, *args)
+            else:
+                getattr(node, op)(*args)
+
 
-    def __init__(self, AspenFileName, WorkingDirectoryPath, VISIBILITY=False):
+class Simulation:
+    def __init__(
+        self,
+        AspenFileName,
+        WorkingDirectoryPath,
+        VISIBILITY=False,
+        backend=aspen_backend,
+        incremental=False,
+        run_timeout=None,
+        max_restarts=3,
+        kill=None,
+        tear_method=None,
+        tear_maxit=50,
+        lazy=False,
+        max_iterations=None,
+    ):
         os.chdir(WorkingDirectoryPath)
         print(f"Working Directory: {os.getcwd()}")
         print(f"Aspen File: {AspenFileName}")
-        self.AspenSimulation.InitFromArchive2(os.path.abspath(AspenFileName))
-        self.AspenSimulation.Visible = VISIBILITY
-        self.AspenSimulation.SuppressDialogs = True
+        self.AspenFilePath = os.path.abspath(AspenFileName)
+        self.VISIBILITY = VISIBILITY
+        self.backend = backend
+        self.simulation = self
+        self._engine = None
+
+        # Model of the flowsheet in the engine. With incremental=True, Reinitialize keeps it
+        # and only the elements that were not declared again are removed before the next run
+        self.incremental = incremental
+        self.blocks = {}  # block name -> unit operation type
+        self.streams = set()
+        self.connections = set()  # (block, stream, port)
+        self.declared = set()
+
+        # Supervised runs: with run_timeout (s) the engine runs asynchronously, changes to
+        # the flowsheet are journaled and a dead/stuck engine is restarted and rebuilt.
+        # kill(engine) can be given to terminate the server process of an unresponsive engine
+        self.run_timeout = run_timeout
+        self.max_restarts = max_restarts
+        self.kill = kill
+        self.poll_interval = 0.05
+        self.journal = []
+        self.failure = None  # Reason of the last failed run
+        self.failures = []
+        self.restarts = 0
+
+        # Recycles: tear streams in convergence blocks of their own ("WEGSTEIN"/"BROYDEN"),
+        # seeded with the values they converged to the last time in the same flowsheet
+        self.tear_method = tear_method
+        self.tear_maxit = tear_maxit
+        self.tears = {}  # tear stream -> (convergence block, method)
+        self.tear_estimates = {}  # (flowsheet signature, stream) -> (T, P, flows)
+        self.tear_count = 0
+
+        # Budgets of a run: run_timeout (s) aborts it, max_iterations caps the iterations
+        # of the tear convergence blocks (MAXIT) and of the columns (MAXOL). RunStatus()
+        # reports the outcome, status keeps it until the next run
+        self.max_iterations = max_iterations
+        self.elapsed = None
+        self.status = None
+
+        # Deferred runs: with lazy=True EngineRun only marks the flowsheet as pending and
+        # the engine runs when an output (stream, block or convergence status) is read
+        self.lazy = lazy
+        self.pending = False
+        self.converged = None  # Status of the last run, None until it is read
+        self.runs = 0
+        self.run_requests = 0
+
+        # Block inputs: values last written and parent nodes of the specs, per block, so
+        # that unchanged specs are not written again. Counts of the writes made/skipped
+        # for the next run, run_writes keeps them for the last one
+        self.inputs = {}  # block -> {path: value}
+        self.input_nodes = {}  # block -> {parent path: engine node}
+        self.writes = 0
+        self.skipped_writes = 0
+        self.run_writes = (0, 0)
+
+    @property
+    def engine(self):
+        # The engine is only dispatched the first time it is needed
+        if self._engine is None:
+            self._engine = self.backend()
+            if self.run_timeout is not None:
+                self._engine = EngineJournal(self._engine, self.journal)
+            self._engine.InitFromArchive2(self.AspenFilePath)
+            self._engine.Visible = self.VISIBILITY
+            self._engine.SuppressDialogs = True
+        return self._engine
+
+    @property
+    def AspenSimulation(self):
+        return self.simulation.engine
 
     def CloseAspen(self):
         AspenFileName = self.Give_AspenDocumentName()
         self.AspenSimulation.Close(os.path.abspath(AspenFileName))
+        self._engine = None
+        self.simulation.input_nodes.clear()
 
     def Quit(self):
         self.AspenSimulation.Quit()
+        self._engine = None
+        self.simulation.input_nodes.clear()
 
     def Give_AspenDocumentName(self):
         return self.AspenSimulation.FullName
@@ -32,44 +299,381 @@ class Simulation:
     def STRM(self):
         return self.AspenSimulation.Tree.Elements("Data").Elements("Streams")
 
+    @property
+    def CONV(self):
+        return (
+            self.AspenSimulation.Tree.Elements("Data")
+            .Elements("Convergence")
+            .Elements("Convergence")
+        )
+
     def EngineRun(self):
-        self.AspenSimulation.Run2()
+        sim = self.simulation
+        sim.pending = True
+        sim.run_requests += 1
+        if not sim.lazy:
+            sim.Flush()
+
+    def Flush(self):
+        # Runs the engine if changes to the flowsheet are pending
+        sim = self.simulation
+        if not sim.pending:
+            return
+        sim.pending = False
+        if sim.incremental:
+            sim.Sweep()
+        signature = sim.SeedTears() if sim.tears else None
+        start = time.time()
+        if sim.run_timeout is None:
+            self.AspenSimulation.Run2()
+        else:
+            sim.SupervisedRun()
+        sim.elapsed = time.time() - start
+        sim.status = None
+        sim.runs += 1
+        sim.run_writes = (sim.writes, sim.skipped_writes)
+        sim.writes = sim.skipped_writes = 0
+        sim.converged = None
+        if signature is not None and sim.Convergence():
+            sim.SaveTears(signature)
+
+    def SupervisedRun(self):
+        # Returns False (and sets self.failure) when the run timed out or the engine died
+        self.failure = None
+        start = time.time()
+        try:
+            engine = self.engine
+            engine.Run2(True)
+            while engine.Engine.IsRunning:
+                if time.time() - start > self.run_timeout:
+                    break
+                time.sleep(self.poll_interval)
+            else:
+                self.restarts = 0
+                return True
+            reason = "timeout"
+            try:
+                # A stuck but responsive engine only needs to be stopped
+                engine.Engine.Stop()
+                engine.Reinit()
+                restart = False
+            except Exception:
+                restart = True
+            detail = f"run exceeded {self.run_timeout} s"
+        except Exception as error:
+            reason, restart, detail = "engine_dead", True, repr(error)
+
+        self.failure = {
+            "reason": reason,
+            "detail": detail,
+            "elapsed": time.time() - start,
+            "restarted": restart,
+        }
+        self.failures.append(self.failure)
+        if restart:
+            self.failure["rebuilt"] = self.RestartEngine()
+        return False
+
+    def RestartEngine(self):
+        # Fresh engine with the current flowsheet rebuilt from the journal. Returns False
+        # (the error goes to self.failure) when the rebuild fails, the flowsheet is then
+        # dropped and the next engine starts from the base archive
+        self.restarts += 1
+        if self.restarts > self.max_restarts:
+            raise RuntimeError(
+                f"Engine failed {self.restarts} times in a row: {self.failure}"
+            )
+        journal = EngineJournal.compact(self.journal)
+        self.DropEngine()
+        if journal and journal[0][1:] == ("InitFromArchive2", (self.AspenFilePath,)):
+            # The fresh engine has already loaded the base archive
+            journal = journal[1:]
+        # The journal restores the inputs, only the nodes of the old engine are lost
+        self.input_nodes.clear()
+        try:
+            EngineJournal.replay(self.engine, journal)
+        except Exception as error:
+            self.failure["rebuild_error"] = repr(error)
+            self.ResetEngine()
+            return False
+        return True
+
+    def DropEngine(self):
+        engine, self._engine = self._engine, None
+        if self.kill is not None and engine is not None:
+            self.kill(engine._target if isinstance(engine, EngineJournal) else engine)
+
+    def ResetEngine(self):
+        # Engine and flowsheet model dropped, the next engine starts from the base archive
+        self.DropEngine()
+        del self.journal[:]
+        self.blocks.clear()
+        self.streams.clear()
+        self.connections.clear()
+        self.tears.clear()
+        self.inputs.clear()
+        self.input_nodes.clear()
 
     def EngineStop(self):
         self.AspenSimulation.Stop()
 
     def EngineReinit(self):
+        self.simulation.converged = None
         self.AspenSimulation.Reinit()
 
     def Convergence(self):
-        converged = (
-            self.AspenSimulation.Tree.Elements("Data")
-            .Elements("Results Summary")
-            .Elements("Run-Status")
-            .Elements("Output")
-            .Elements("PER_ERROR")
-            .Value
-        )
-        return converged == 0
+        sim = self.simulation
+        self.Flush()
+        if sim.failure is not None:
+            return False
+        if sim.converged is None:
+            converged = (
+                self.AspenSimulation.Tree.Elements("Data")
+                .Elements("Results Summary")
+                .Elements("Run-Status")
+                .Elements("Output")
+                .Elements("PER_ERROR")
+                .Value
+            )
+            sim.converged = converged == 0
+        return sim.converged
+
+    def RunStatus(self):
+        # Structured status of the last run, see run_status
+        sim = self.simulation
+        self.Flush()
+        if sim.status is None:
+            if sim.failure is not None and sim.failure["restarted"]:
+                # The summary of the engine that failed is gone with it
+                status = {
+                    "errors": None,
+                    "warnings": None,
+                    "messages": None,
+                    "lines": {},
+                    "blocks": [],
+                    "iterations": {},
+                }
+            else:
+                blocks = list(sim.blocks) + [name for name, _ in sim.tears.values()]
+                status = run_status(self.AspenSimulation, blocks)
+            limit = sim.max_iterations
+            status.update(
+                {
+                    "converged": self.Convergence(),
+                    "elapsed": sim.elapsed,
+                    "failure": sim.failure,
+                    "iteration_limit": limit is not None
+                    and any(n >= limit for n in status["iterations"].values()),
+                }
+            )
+            sim.status = status
+        return sim.status
+
+    def IterationLimit(self, maxit):
+        limit = self.simulation.max_iterations
+        return maxit if limit is None else min(maxit, limit)
 
     def StreamConnect(self, Blockname, Streamname, Portname):
+        sim = self.simulation
+        connection = (Blockname, Streamname, Portname)
+        sim.declared.add(("PORT",) + connection)
+        if connection in sim.connections:
+            return
         self.BLK.Elements(Blockname).Elements("Ports").Elements(Portname).Elements.Add(
             Streamname
         )
+        sim.connections.add(connection)
 
     def StreamDisconnect(self, Blockname, Streamname, Portname):
         self.BLK.Elements(Blockname).Elements("Ports").Elements(
             Portname
         ).Elements.Remove(Streamname)
+        self.simulation.connections.discard((Blockname, Streamname, Portname))
+        self.ForgetInputs(Streamname, [Blockname])
+
+    def AddBlock(self, Blockname, uo):
+        # Returns False when an identical block is already in the flowsheet and is reused
+        sim = self.simulation
+        sim.declared.add(("BLOCK", Blockname))
+        if sim.blocks.get(Blockname) == uo:
+            return False
+        if Blockname in sim.blocks:
+            self.RemoveBlock(Blockname)
+        self.BLK.Elements.Add(Blockname + "!" + uo)
+        sim.blocks[Blockname] = uo
+        return True
+
+    def RemoveBlock(self, Blockname):
+        sim = self.simulation
+        self.BLK.Elements.Remove(Blockname)
+        sim.blocks.pop(Blockname, None)
+        sim.inputs.pop(Blockname, None)
+        sim.input_nodes.pop(Blockname, None)
+        sim.connections = {c for c in sim.connections if c[0] != Blockname}
+
+    def WriteInputs(self, Blockname, specs, parent=("Input",)):
+        # specs: {element or path under parent: value}, written in one pass over cached
+        # parent nodes
+        sim = self.simulation
+        inputs = sim.inputs.setdefault(Blockname, {})
+        nodes = sim.input_nodes.setdefault(Blockname, {})
+        for key, value in specs.items():
+            path = parent + (key if isinstance(key, tuple) else (key,))
+            if path in inputs and inputs[path] == value:
+                sim.skipped_writes += 1
+                continue
+            node = nodes.get(path[:-1])
+            if node is None:
+                node = self.BLK.Elements(Blockname)
+                for element in path[:-1]:
+                    node = node.Elements(element)
+                nodes[path[:-1]] = node
+            node.Elements(path[-1]).Value = value
+            inputs[path] = value
+            sim.writes += 1
+
+    def AddStream(self, Streamname):
+        sim = self.simulation
+        sim.declared.add(("STREAM", Streamname))
+        if Streamname in sim.streams:
+            return False
+        self.STRM.Elements.Add(Streamname + "!" + "MATERIAL")
+        sim.streams.add(Streamname)
+        return True
+
+    def RemoveStream(self, Streamname):
+        sim = self.simulation
+        self.STRM.Elements.Remove(Streamname)
+        sim.streams.discard(Streamname)
+        sim.connections = {c for c in sim.connections if c[1] != Streamname}
+        self.ForgetInputs(Streamname, list(sim.inputs))
+
+    def ForgetInputs(self, Streamname, Blocknames):
+        # Specs keyed by a stream (feed stage, side draws) go with its connection
+        for Blockname in Blocknames:
+            inputs = self.simulation.inputs.get(Blockname, {})
+            for path in [path for path in inputs if Streamname in path]:
+                del inputs[path]
+
+    def FlowsheetDiff(self):
+        # Blocks, streams and connections in the engine that were not declared
+        # since the last Reinitialize
+        sim = self.simulation
+        blocks = [b for b in sim.blocks if ("BLOCK", b) not in sim.declared]
+        streams = [s for s in sim.streams if ("STREAM", s) not in sim.declared]
+        connections = [
+            c
+            for c in sim.connections
+            if ("PORT",) + c not in sim.declared
+            and c[0] not in blocks
+            and c[1] not in streams
+        ]
+        return blocks, streams, connections
+
+    def Sweep(self):
+        blocks, streams, connections = self.FlowsheetDiff()
+        for connection in connections:
+            self.StreamDisconnect(*connection)
+        for b in blocks:
+            self.RemoveBlock(b)
+        for s in streams:
+            self.RemoveStream(s)
+        sim = self.simulation
+        tears = [s for s in sim.tears if ("TEAR", s) not in sim.declared]
+        for s in tears:
+            self.RemoveTear(s)
+        # The journal only keeps what a rebuild needs for the flowsheet left in the engine
+        sim.journal[:] = EngineJournal.compact(sim.journal)
+        return len(blocks) + len(streams) + len(connections) + len(tears)
+
+    def TearStream(self, Streamname, method=None, maxit=None):
+        # Tear Streamname in a convergence block of its own instead of letting the
+        # engine choose the tears
+        sim = self.simulation
+        method = method or sim.tear_method or "WEGSTEIN"
+        sim.declared.add(("TEAR", Streamname))
+        if Streamname in sim.tears and sim.tears[Streamname][1] != method:
+            self.RemoveTear(Streamname)
+        if Streamname not in sim.tears:
+            sim.tear_count += 1
+            name = f"CV{sim.tear_count}"
+            self.CONV.Elements.Add(name + "!" + method)
+            nodes = self.AspenSimulation.Application.Tree.FindNode(
+                f"/Data/Convergence/Convergence/{name}/Input/TEAR"
+            ).Elements
+            nodes.InsertRow(1, nodes.Count)
+            nodes(nodes.Count - 1).Value = Streamname
+            sim.tears[Streamname] = (name, method)
+        name = sim.tears[Streamname][0]
+        self.CONV.Elements(name).Elements("Input").Elements("MAXIT").Value = (
+            self.IterationLimit(maxit or sim.tear_maxit)
+        )
+        return name
+
+    def RemoveTear(self, Streamname):
+        sim = self.simulation
+        name, _ = sim.tears.pop(Streamname)
+        self.CONV.Elements.Remove(name)
+
+    def FlowsheetSignature(self):
+        sim = self.simulation
+        return hash((tuple(sorted(sim.blocks.items())), tuple(sorted(sim.connections))))
+
+    def SeedTears(self):
+        # Initial estimates of the tear streams from the last converged run
+        sim = self.simulation
+        signature = sim.FlowsheetSignature()
+        for stream in sim.tears:
+            estimate = sim.tear_estimates.get((signature, stream))
+            if estimate is None:
+                continue
+            T, P, flows = estimate
+            node = self.STRM.Elements(stream).Elements("Input")
+            node.Elements("TEMP").Elements("MIXED").Value = T
+            node.Elements("PRES").Elements("MIXED").Value = P
+            for compound, flow in flows.items():
+                node.Elements("FLOW").Elements("MIXED").Elements(compound).Value = flow
+        return signature
+
+    def SaveTears(self, signature):
+        sim = self.simulation
+        for stream in sim.tears:
+            out = self.STRM.Elements(stream).Elements("Output")
+            flows = {
+                compound.Name: compound.Value
+                for compound in out.Elements("MOLEFLOW").Elements("MIXED").Elements
+            }
+            sim.tear_estimates[(signature, stream)] = (
+                out.Elements("TEMP_OUT").Elements("MIXED").Value,
+                out.Elements("PRES_OUT").Elements("MIXED").Value,
+                flows,
+            )
 
     def Reinitialize(self):
-        self.STRM.RemoveAll()
-        self.BLK.RemoveAll()
+        sim = self.simulation
+        if not sim.incremental:
+            for stream in list(sim.tears):
+                self.RemoveTear(stream)
+            self.STRM.RemoveAll()
+            self.BLK.RemoveAll()
+            # Only the archive load and the teardown are left to rebuild the empty flowsheet
+            sim.journal[:] = EngineJournal.compact(sim.journal)
+            sim.blocks.clear()
+            sim.inputs.clear()
+            sim.input_nodes.clear()
+            sim.streams.clear()
+            sim.connections.clear()
+        sim.declared.clear()
+        sim.failure = None
+        sim.status = None
+        sim.pending = False
+        sim.converged = None
         self.AspenSimulation.Reinit()
 
 
 class Stream(Simulation):
-    def __init__(self, name, inlet=False):
+    def __init__(self, name, inlet=False, *, sim):
+        self.simulation = sim
         self.name = name.upper()
         self.inlet = inlet
 
@@ -79,11 +683,10 @@ class Stream(Simulation):
             self.inlet_stream()
 
     def StreamPlace(self):
-        compositstring = self.name + "!" + "MATERIAL"
-        self.STRM.Elements.Add(compositstring)
+        self.AddStream(self.name)
 
     def StreamDelete(self):
-        self.STRM.Elements.Remove(self.name)
+        self.RemoveStream(self.name)
 
     def inlet_stream(self):
         T = self.inlet[0]
@@ -118,77 +721,60 @@ class Stream(Simulation):
                 "MIXED"
             ).Elements(chemical).Value = comp[chemical]
 
+    def output(self, *path):
+        self.Flush()
+        node = self.STRM.Elements(self.name).Elements("Output")
+        for element in path:
+            node = node.Elements(element)
+        return node.Value
+
     def get_temp(self):
-        return (
-            self.STRM.Elements(self.name)
-            .Elements("Output")
-            .Elements("TEMP_OUT")
-            .Elements("MIXED")
-            .Value
-        )
+        return self.output("TEMP_OUT", "MIXED")
 
     def get_press(self):
-        return (
-            self.STRM.Elements(self.name)
-            .Elements("Output")
-            .Elements("PRES_OUT")
-            .Elements("MIXED")
-            .Value
-        )
+        return self.output("PRES_OUT", "MIXED")
 
     def get_molar_flow(self, compound):
-        return (
-            self.STRM.Elements(self.name)
-            .Elements("Output")
-            .Elements("MOLEFLOW")
-            .Elements("MIXED")
-            .Elements(compound)
-            .Value
-        )
+        return self.output("MOLEFLOW", "MIXED", compound)
 
     def get_total_molar_flow(self):
-        return (
-            self.STRM.Elements(self.name)
-            .Elements("Output")
-            .Elements("MOLEFLMX")
-            .Elements("MIXED")
-            .Value
-        )
+        return self.output("MOLEFLMX", "MIXED")
 
     def get_vapor_fraction(self):
-        return (
-            self.STRM.Elements(self.name)
-            .Elements("Output")
-            .Elements("STR_MAIN")
-            .Elements("VFRAC")
-            .Elements("MIXED")
-            .Value
-        )
+        return self.output("STR_MAIN", "VFRAC", "MIXED")
 
     def get_mass_flow(self):
-        return (
-            self.STRM.Elements(self.name)
-            .Elements("Output")
-            .Elements("MASSFLMX")
-            .Elements("MIXED")
-            .Value
-        )
+        return self.output("MASSFLMX", "MIXED")
 
     def stream_specs(self):
         return (self.get_temp(), self.get_press(), self.get_mass_flow())
 
 
 class Block(Simulation):
-    def __init__(self, name, uo):
+    def __init__(self, name, uo, sim):
+        self.simulation = sim
         self.name = name.upper()
         self.uo = uo
 
     def BlockCreate(self):
-        compositestring = self.name + "!" + self.uo
-        self.BLK.Elements.Add(compositestring)
+        # False when the block is reused from the previous flowsheet, its one-off
+        # setup (reaction rows, tray sizing) is then already in place
+        self.created = self.AddBlock(self.name, self.uo)
 
     def BlockDelete(self):
-        self.BLK.Elements.Remove(self.name)
+        self.RemoveBlock(self.name)
+
+    def specify(self, specs, *parent):
+        # Input specs of the block, see Simulation.WriteInputs
+        self.WriteInputs(self.name, specs, parent or ("Input",))
+
+    def value(self, *path):
+        # Element under the block (results, sizing...) read after any deferred run
+        self.Flush()
+        node = self.BLK.Elements(self.name)
+        for element in path:
+            node = node.Elements(element)
+        return node.Value
 
     def capital_cost(self):
         # Placeholder for capital cost calculation
@@ -204,11 +790,11 @@ class Block(Simulation):
 
 class InitialMixer(Block):
     def __init__(self, name, inlet_streams):
-        super().__init__(name, "Mixer")
+        super().__init__(name, "Mixer", inlet_streams[0].simulation)
         self.name = name
         self.inlet_streams = inlet_streams
         self.BlockCreate()
-        self.BLK.Elements(self.name).Elements("Input").Elements("PRES").Value = 0
+        self.specify({"PRES": 0})
 
     def connect(self):
         # Inlet connection
@@ -218,7 +804,7 @@ class InitialMixer(Block):
         # self.BLK.Elements(self.name).Elements("Input").Elements("NPHASE").Value = 1
         # self.BLK.Elements(self.name).Elements("Input").Elements("PHASE").Value = "L"
 
-        s = Stream(f"{self.name}OUT")
+        s = Stream(f"{self.name}OUT", sim=self.simulation)
         self.StreamConnect(self.name, s.name, "P(OUT)")
         return s
 
@@ -230,15 +816,15 @@ class InitialMixer(Block):
 
 class Mixer(Block):
     def __init__(self, name, inlet_streams):
-        super().__init__(name, "Mixer")
+        super().__init__(name, "Mixer", inlet_streams.simulation)
         self.name = name
         self.inlet_streams = inlet_streams
         self.BlockCreate()
-        self.BLK.Elements(self.name).Elements("Input").Elements("PRES").Value = 0
+        self.specify({"PRES": 0})
 
     def connect(self, stream):
         self.StreamConnect(self.name, stream.name, "F(IN)")
-        s = Stream(f"{self.name}OUT")
+        s = Stream(f"{self.name}OUT", sim=self.simulation)
         self.StreamConnect(self.name, s.name, "P(OUT)")
         return s
 
@@ -250,7 +836,7 @@ class Mixer(Block):
 
 class Splitter(Block):
     def __init__(self, name, inlet_stream):
-        super().__init__(name, "FSplit")
+        super().__init__(name, "FSplit", inlet_stream.simulation)
 
         self.name = name
         self.inlet_stream = inlet_stream
@@ -260,8 +846,8 @@ class Splitter(Block):
     def connect(self):
         self.StreamConnect(self.name, self.inlet_stream.name, "F(IN)")
 
-        self.s1 = Stream(f"{self.name}S1OUT")
-        s2 = Stream(f"{self.name}S2OUT")
+        self.s1 = Stream(f"{self.name}S1OUT", sim=self.simulation)
+        s2 = Stream(f"{self.name}S2OUT", sim=self.simulation)
 
         self.StreamConnect(self.name, self.s1.name, "P(OUT)")
         self.StreamConnect(self.name, s2.name, "P(OUT)")
@@ -269,14 +855,12 @@ class Splitter(Block):
         return self.s1, s2
 
     def dv_placement(self, split_ratio):
-        self.BLK.Elements(self.name).Elements("Input").Elements("FRAC").Elements(
-            self.s1.name
-        ).Value = split_ratio
+        self.specify({("FRAC", self.s1.name): split_ratio})
 
 
 class Heater(Block):
     def __init__(self, name, inlet_stream):
-        super().__init__(name, "Heater")
+        super().__init__(name, "Heater", inlet_stream.simulation)
 
         self.name = name
         self.inlet_stream = inlet_stream
@@ -287,21 +871,16 @@ class Heater(Block):
     def connect(self):
         self.StreamConnect(self.name, self.inlet_stream.name, "F(IN)")
 
-        self.BLK.Elements(self.name).Elements("Input").Elements(
-            "SPEC_OPT"
-        ).Value = "TDPPARM"
-        self.BLK.Elements(self.name).Elements("Input").Elements("DPPARM").Value = "0"
-        s = Stream(f"{self.name}OUT")
+        self.specify({"SPEC_OPT": "TDPPARM", "DPPARM": "0"})
+        s = Stream(f"{self.name}OUT", sim=self.simulation)
         self.StreamConnect(self.name, s.name, "P(OUT)")
         return s
 
     def dv_placement(self, temp):
-        self.BLK.Elements(self.name).Elements("Input").Elements("TEMP").Value = temp
+        self.specify({"TEMP": temp})
 
     def energy_consumption(self):
-        self.q = abs(
-            self.BLK.Elements(self.name).Elements("Output").Elements("QCALC").Value
-        )
+        self.q = abs(self.value("Output", "QCALC"))
         return self.q
 
     def capital_cost(self):
@@ -319,7 +898,7 @@ class Heater(Block):
 
 class Cooler(Block):
     def __init__(self, name, inlet_stream):
-        super().__init__(name, "Heater")
+        super().__init__(name, "Heater", inlet_stream.simulation)
 
         self.name = name
         self.inlet_stream = inlet_stream
@@ -330,21 +909,16 @@ class Cooler(Block):
     def connect(self):
         self.StreamConnect(self.name, self.inlet_stream.name, "F(IN)")
 
-        self.BLK.Elements(self.name).Elements("Input").Elements(
-            "SPEC_OPT"
-        ).Value = "TDPPARM"
-        self.BLK.Elements(self.name).Elements("Input").Elements("DPPARM").Value = "0"
-        s = Stream(f"{self.name}OUT")
+        self.specify({"SPEC_OPT": "TDPPARM", "DPPARM": "0"})
+        s = Stream(f"{self.name}OUT", sim=self.simulation)
         self.StreamConnect(self.name, s.name, "P(OUT)")
         return s
 
     def dv_placement(self, temp):
-        self.BLK.Elements(self.name).Elements("Input").Elements("TEMP").Value = temp
+        self.specify({"TEMP": temp})
 
     def energy_consumption(self):
-        self.q = abs(
-            self.BLK.Elements(self.name).Elements("Output").Elements("QCALC").Value
-        )
+        self.q = abs(self.value("Output", "QCALC"))
         return self.q
 
     def capital_cost(self):
@@ -359,7 +933,7 @@ class Cooler(Block):
 
 class HeatExchanger(Block):
     def __init__(self, name, inlet_stream1, inlet_stream2=None):
-        super().__init__(name, "HeatX")
+        super().__init__(name, "HeatX", inlet_stream1.simulation)
         self.name = name
         self.inlet_stream1 = inlet_stream1
         self.inlet_stream2 = inlet_stream2
@@ -374,23 +948,21 @@ class HeatExchanger(Block):
     def connect(self, hex_count, sin2=None):
         if hex_count == 1:
             self.StreamConnect(self.name, self.inlet_stream1.name, "H(IN)")
-            s = Stream(f"{self.name}OUT1")
+            s = Stream(f"{self.name}OUT1", sim=self.simulation)
             self.StreamConnect(self.name, s.name, "H(OUT)")
-            self.BLK.Elements(self.name).Elements("Input").Elements(
-                "SPEC"
-            ).Value = "DELT-HOT"
+            self.specify({"SPEC": "DELT-HOT"})
             self.outlet1 = s
         else:
             self.inlet_stream2 = sin2
             self.StreamConnect(self.name, self.inlet_stream2.name, "C(IN)")
-            s = Stream(f"{self.name}OUT2")
+            s = Stream(f"{self.name}OUT2", sim=self.simulation)
             self.StreamConnect(self.name, s.name, "C(OUT)")
             self.outlet2 = s
         return s
 
     def dv_placement(self, DT):
         self.DT = DT
-        self.BLK.Elements(self.name).Elements("Input").Elements("VALUE").Value = self.DT
+        self.specify({"VALUE": self.DT})
 
     def switch_streams(self):
         # Switch the inlet streams for the heat exchanger
@@ -408,12 +980,7 @@ class HeatExchanger(Block):
         self.StreamConnect(self.name, self.outlet1.name, "C(OUT)")
         self.hotside_pres = new_hotside_pres
         self.coldside_pres = new_coldside_pres
-        self.BLK.Elements(self.name).Elements("Input").Elements(
-            "PRES_HOT"
-        ).Value = self.hotside_pres
-        self.BLK.Elements(self.name).Elements("Input").Elements(
-            "PRES_COLD"
-        ).Value = self.coldside_pres
+        self.specify({"PRES_HOT": self.hotside_pres, "PRES_COLD": self.coldside_pres})
 
     def undo_switch(self):
         # Switch the inlet streams back to their original state
@@ -431,17 +998,10 @@ class HeatExchanger(Block):
         self.StreamConnect(self.outlet2.name, "C(OUT)")
         self.hotside_pres = new_hotside_pres
         self.coldside_pres = new_coldside_pres
-        self.BLK.Elements(self.name).Elements("Input").Elements(
-            "PRES_HOT"
-        ).Value = self.hotside_pres
-        self.BLK.Elements(self.name).Elements("Input").Elements(
-            "PRES_COLD"
-        ).Value = self.coldside_pres
+        self.specify({"PRES_HOT": self.hotside_pres, "PRES_COLD": self.coldside_pres})
 
     def energy_consumption(self):
-        self.q = abs(
-            self.BLK.Elements(self.name).Elements("Output").Elements("HX_DUTY").Value
-        )
+        self.q = abs(self.value("Output", "HX_DUTY"))
         return self.q
 
     def capital_cost(self):
@@ -456,7 +1016,7 @@ class HeatExchanger(Block):
 
 class Pump(Block):
     def __init__(self, name, inlet_stream):
-        super().__init__(name, "Pump")
+        super().__init__(name, "Pump", inlet_stream.simulation)
         self.name = name
         self.press = 2.4  # Default pressure in bar
         self.inlet_stream = inlet_stream
@@ -466,23 +1026,17 @@ class Pump(Block):
     def connect(self):
         # Inlet connection
         self.StreamConnect(self.name, self.inlet_stream.name, "F(IN)")
-        self.BLK.Elements(self.name).Elements("Input").Elements("EFF").Value = 0.5
-        self.BLK.Elements(self.name).Elements("Input").Elements("DEFF").Value = 0.9
-        self.BLK.Elements(self.name).Elements("Input").Elements(
-            "OPT_SPEC"
-        ).Value = "PRES"
+        self.specify({"EFF": 0.5, "DEFF": 0.9, "OPT_SPEC": "PRES"})
 
-        s = Stream(f"{self.name}OUT")
+        s = Stream(f"{self.name}OUT", sim=self.simulation)
         self.StreamConnect(self.name, s.name, "P(OUT)")
         return s
 
     def dv_placement(self, press):
-        self.BLK.Elements(self.name).Elements("Input").Elements("PRES").Value = press
+        self.specify({"PRES": press})
 
     def energy_consumption(self):
-        self.q = abs(
-            self.BLK.Elements(self.name).Elements("Output").Elements("WNET").Value
-        )
+        self.q = abs(self.value("Output", "WNET"))
         return self.q
 
     def capital_cost(self):
@@ -495,7 +1049,7 @@ class Pump(Block):
 
 class CSTR_A(Block):
     def __init__(self, name, inlet_stream):
-        super().__init__(name, "RCSTR")
+        super().__init__(name, "RCSTR", inlet_stream.simulation)
         self.name = name
         self.inlet_stream = inlet_stream
         self.volume = 30  # Default volume in m^3
@@ -507,25 +1061,22 @@ class CSTR_A(Block):
         self.StreamConnect(self.name, self.inlet_stream.name, "F(IN)")
 
         # Reactors specifications
-        self.BLK.Elements(self.name).Elements("Input").Elements(
-            "SPEC_OPT"
-        ).Value = "DUTY"
-        self.BLK.Elements(self.name).Elements("Input").Elements("DUTY").Value = 0
-        self.BLK.Elements(self.name).Elements("Input").Elements("PHASE").Value = "L"
+        self.specify({"SPEC_OPT": "DUTY", "DUTY": 0, "PHASE": "L"})
 
         # Reaction
-        nodes = self.AspenSimulation.Application.Tree.FindNode(
-            f"/Data/Blocks/{self.name}/Input/RXN_ID"
-        ).Elements
-        nodes.InsertRow(1, nodes.Count)
-        nodes(nodes.Count - 1).Value = "EGR"
-        s = Stream(f"{self.name}OUT")
+        if self.created:
+            nodes = self.AspenSimulation.Application.Tree.FindNode(
+                f"/Data/Blocks/{self.name}/Input/RXN_ID"
+            ).Elements
+            nodes.InsertRow(1, nodes.Count)
+            nodes(nodes.Count - 1).Value = "EGR"
+        s = Stream(f"{self.name}OUT", sim=self.simulation)
         self.StreamConnect(self.name, s.name, "P(OUT)")
         return s
 
     def dv_placement(self, volume):
         self.volume = volume
-        self.BLK.Elements(self.name).Elements("Input").Elements("VOL").Value = volume
+        self.specify({"VOL": volume})
 
     def capital_cost(self):
         M = 0.45
@@ -537,7 +1088,7 @@ class CSTR_A(Block):
 
 class PFR_A(Block):
     def __init__(self, name, inlet_stream):
-        super().__init__(name, "RPlug")
+        super().__init__(name, "RPlug", inlet_stream.simulation)
         self.name = name
         self.inlet_stream = inlet_stream
         self.volume = 30  # Default volume in m^3
@@ -549,22 +1100,24 @@ class PFR_A(Block):
         self.StreamConnect(self.name, self.inlet_stream.name, "F(IN)")
 
         # Reactors specifications
-        self.BLK.Elements(self.name).Elements("Input").Elements(
-            "TYPE"
-        ).Value = "ADIABATIC"
-
-        # Sizing
-        self.BLK.Elements(self.name).Elements("Input").Elements("NPHASE").Value = 1
-        self.BLK.Elements(self.name).Elements("Input").Elements("PHASE").Value = "L"
+        self.specify(
+            {
+                "TYPE": "ADIABATIC",
+                # Sizing
+                "NPHASE": 1,
+                "PHASE": "L",
+            }
+        )
 
         # Reaction
-        nodes = self.AspenSimulation.Application.Tree.FindNode(
-            f"/Data/Blocks/{self.name}/Input/RXN_ID"
-        ).Elements
-        nodes.InsertRow(1, nodes.Count)
-        nodes(nodes.Count - 1).Value = "EGR"
-
-        s = Stream(f"{self.name}OUT")
+        if self.created:
+            nodes = self.AspenSimulation.Application.Tree.FindNode(
+                f"/Data/Blocks/{self.name}/Input/RXN_ID"
+            ).Elements
+            nodes.InsertRow(1, nodes.Count)
+            nodes(nodes.Count - 1).Value = "EGR"
+
+        s = Stream(f"{self.name}OUT", sim=self.simulation)
         self.StreamConnect(self.name, s.name, "P(OUT)")
         return s
 
@@ -572,8 +1125,7 @@ class PFR_A(Block):
         self.volume = volume
         self.D = (4 * volume / (np.pi * 6)) ** (1 / 3)
         self.L = 6 * self.D
-        self.BLK.Elements(self.name).Elements("Input").Elements("LENGTH").Value = self.L
-        self.BLK.Elements(self.name).Elements("Input").Elements("DIAM").Value = self.D
+        self.specify({"LENGTH": self.L, "DIAM": self.D})
 
     def capital_cost(self):
         M = 0.82
@@ -593,7 +1145,7 @@ class PFR_A(Block):
 
 class Column(Block):
     def __init__(self, name, inlet_stream):
-        super().__init__(name, "Radfrac")
+        super().__init__(name, "Radfrac", inlet_stream.simulation)
         self.name = name
         self.nstages = 12  # Default number of stages
         self.reflux_ratio = 0.024
@@ -607,62 +1159,43 @@ class Column(Block):
         self.StreamConnect(self.name, self.inlet_stream.name, "F(IN)")
 
         # Configuration
-        self.BLK.Elements(self.name).Elements("Input").Elements(
-            "CALC_MODE"
-        ).Value = "EQUILIBRIUM"
-        self.BLK.Elements(self.name).Elements("Input").Elements(
-            "NSTAGE"
-        ).Value = self.nstages
-        self.BLK.Elements(self.name).Elements("Input").Elements(
-            "CONDENSER"
-        ).Value = "TOTAL"
-        self.BLK.Elements(self.name).Elements("Input").Elements(
-            "REBOILER"
-        ).Value = "KETTLE"
-        self.BLK.Elements(self.name).Elements("Input").Elements("NO_PHASE").Value = 2
-        self.BLK.Elements(self.name).Elements("Input").Elements(
-            "CONV_METH"
-        ).Value = "STANDARD"
-
-        # Convergence
-        self.BLK.Elements(self.name).Elements("Input").Elements("MAXOL").Value = 200
-
-        d = Stream(f"{self.name}DOUT")
+        self.specify(
+            {
+                "CALC_MODE": "EQUILIBRIUM",
+                "NSTAGE": self.nstages,
+                "CONDENSER": "TOTAL",
+                "REBOILER": "KETTLE",
+                "NO_PHASE": 2,
+                "CONV_METH": "STANDARD",
+                # Convergence
+                "MAXOL": self.IterationLimit(200),
+            }
+        )
+
+        d = Stream(f"{self.name}DOUT", sim=self.simulation)
         self.StreamConnect(self.name, d.name, "LD(OUT)")
-        b = Stream(f"{self.name}BOUT")
+        b = Stream(f"{self.name}BOUT", sim=self.simulation)
         self.StreamConnect(self.name, b.name, "B(OUT)")
         return d, b
 
     def dv_placement(self, pressure):
-        self.BLK.Elements(self.name).Elements("Input").Elements(
-            "PRES1"
-        ).Value = pressure
+        self.specify({"PRES1": pressure})
 
     def set_ops(self, stages, reflux_ratio, bottoms_ratio):
         self.nstages = stages
-        self.BLK.Elements(self.name).Elements("Input").Elements(
-            "NSTAGE"
-        ).Value = self.nstages
-        self.BLK.Elements(self.name).Elements("Input").Elements("FEED_STAGE").Elements(
-            self.inlet_stream.name
-        ).Value = round(self.nstages / 2, 0)
-        self.BLK.Elements(self.name).Elements("Input").Elements("FEED_CONVE2").Elements(
-            self.inlet_stream.name
-        ).Value = "ABOVE-STAGE"
-        self.BLK.Elements(self.name).Elements("Input").Elements(
-            "BASIS_RR"
-        ).Value = reflux_ratio
-        self.BLK.Elements(self.name).Elements("Input").Elements(
-            "B:F"
-        ).Value = bottoms_ratio
+        self.specify(
+            {
+                "NSTAGE": self.nstages,
+                ("FEED_STAGE", self.inlet_stream.name): round(self.nstages / 2, 0),
+                ("FEED_CONVE2", self.inlet_stream.name): "ABOVE-STAGE",
+                "BASIS_RR": reflux_ratio,
+                "B:F": bottoms_ratio,
+            }
+        )
 
     def energy_consumption(self):
-        q1 = abs(
-            self.BLK.Elements(self.name).Elements("Output").Elements("COND_DUTY").Value
-        )
-        q2 = abs(
-            self.BLK.Elements(self.name).Elements("Output").Elements("REB_DUTY").Value
-        )
+        q1 = abs(self.value("Output", "COND_DUTY"))
+        q2 = abs(self.value("Output", "REB_DUTY"))
         return q1 + q2
 
     def capital_cost(self):
@@ -689,7 +1222,7 @@ class Column(Block):
 
 class SColumn(Block):
     def __init__(self, name, inlet_stream):
-        super().__init__(name, "Distl")
+        super().__init__(name, "Distl", inlet_stream.simulation)
         self.name = name
         self.inlet_stream = inlet_stream
 
@@ -698,39 +1231,34 @@ class SColumn(Block):
     def connect(self):
         self.StreamConnect(self.name, self.inlet_stream.name, "F(IN)")
 
-        d = Stream(f"{self.name}DOUT")
+        d = Stream(f"{self.name}DOUT", sim=self.simulation)
         self.StreamConnect(self.name, d.name, "D(OUT)")
-        b = Stream(f"{self.name}BOUT")
+        b = Stream(f"{self.name}BOUT", sim=self.simulation)
         self.StreamConnect(self.name, b.name, "B(OUT)")
         return d, b
 
     def dv_placement(self, pressure):
-        self.BLK.Elements(self.name).Elements("Input").Elements("PTOP").Value = pressure
-        self.BLK.Elements(self.name).Elements("Input").Elements("PBOT").Value = pressure
+        self.specify({"PTOP": pressure, "PBOT": pressure})
 
     def set_ops(self, nstages, rr, df):
-        self.BLK.Elements(self.name).Elements("Input").Elements(
-            "NSTAGE"
-        ).Value = nstages
-        self.BLK.Elements(self.name).Elements("Input").Elements("FEED_LOC").Value = (
-            round(nstages / 2)
+        self.specify(
+            {
+                "NSTAGE": nstages,
+                "FEED_LOC": round(nstages / 2),
+                "RR": rr,
+                "D_F": df,
+            }
         )
-        self.BLK.Elements(self.name).Elements("Input").Elements("RR").Value = rr
-        self.BLK.Elements(self.name).Elements("Input").Elements("D_F").Value = df
 
     def energy_consumption(self):
-        q1 = abs(
-            self.BLK.Elements(self.name).Elements("Output").Elements("COND_DUTY").Value
-        )
-        q2 = abs(
-            self.BLK.Elements(self.name).Elements("Output").Elements("REB_DUTY").Value
-        )
+        q1 = abs(self.value("Output", "COND_DUTY"))
+        q2 = abs(self.value("Output", "REB_DUTY"))
         return q1 + q2
 
 
 class Compressor(Block):
     def __init__(self, name, inlet_stream):
-        super().__init__(name, "COMPR")
+        super().__init__(name, "COMPR", inlet_stream.simulation)
         self.name = name
         self.inlet_stream = inlet_stream
         self.press = 2.4  # Default pressure in bar
@@ -740,33 +1268,31 @@ class Compressor(Block):
     def connect(self):
         # Inlet connection
         self.StreamConnect(self.name, self.inlet_stream.name, "F(IN)")
-        self.BLK.Elements(self.name).Elements("Input").Elements(
-            "MODEL_TYPE"
-        ).Value = "COMPRESSOR"
-        self.BLK.Elements(self.name).Elements("Input").Elements(
-            "TYPE"
-        ).Value = "ISENTROPIC"
-        self.BLK.Elements(self.name).Elements("Input").Elements(
-            "OPT_SPEC"
-        ).Value = "PRES"
-        self.BLK.Elements(self.name).Elements("Input").Elements("NPHASE").Value = 2
-        self.BLK.Elements(self.name).Elements("Input").Elements("SEFF").Value = 0.82
-
-        s = Stream(f"{self.name}OUT")
+        self.specify(
+            {
+                "MODEL_TYPE": "COMPRESSOR",
+                "TYPE": "ISENTROPIC",
+                "OPT_SPEC": "PRES",
+                "NPHASE": 2,
+                "SEFF": 0.82,
+            }
+        )
+
+        s = Stream(f"{self.name}OUT", sim=self.simulation)
         self.StreamConnect(self.name, s.name, "P(OUT)")
         return s
 
     def energy_consumption(self):
-        q = abs(self.BLK.Elements(self.name).Elements("Output").Elements("WNET").Value)
+        q = abs(self.value("Output", "WNET"))
         return q
 
     def dv_placement(self, press):
-        self.BLK.Elements(self.name).Elements("Input").Elements("PRES").Value = press
+        self.specify({"PRES": press})
 
 
 class Turbine(Block):
     def __init__(self, name, inlet_stream):
-        super().__init__(name, "COMPR")
+        super().__init__(name, "COMPR", inlet_stream.simulation)
         self.name = name
         self.inlet_stream = inlet_stream
         self.press = 2.4  # Default pressure in bar
@@ -776,27 +1302,25 @@ class Turbine(Block):
     def connect(self):
         # Inlet connection
         self.StreamConnect(self.name, self.inlet_stream.name, "F(IN)")
-        self.BLK.Elements(self.name).Elements("Input").Elements(
-            "MODEL_TYPE"
-        ).Value = "TURBINE"
-        self.BLK.Elements(self.name).Elements("Input").Elements(
-            "TYPE"
-        ).Value = "ISENTROPIC"
-        self.BLK.Elements(self.name).Elements("Input").Elements(
-            "OPT_SPEC"
-        ).Value = "PRES"
-        self.BLK.Elements(self.name).Elements("Input").Elements("NPHASE").Value = 2
-        self.BLK.Elements(self.name).Elements("Input").Elements("SEFF").Value = 0.85
-
-        s = Stream(f"{self.name}OUT")
+        self.specify(
+            {
+                "MODEL_TYPE": "TURBINE",
+                "TYPE": "ISENTROPIC",
+                "OPT_SPEC": "PRES",
+                "NPHASE": 2,
+                "SEFF": 0.85,
+            }
+        )
+
+        s = Stream(f"{self.name}OUT", sim=self.simulation)
         self.StreamConnect(self.name, s.name, "P(OUT)")
         return s
 
     def dv_placement(self, press):
-        self.BLK.Elements(self.name).Elements("Input").Elements("PRES").Value = press
+        self.specify({"PRES": press})
 
     def energy_consumption(self):
-        q = abs(self.BLK.Elements(self.name).Elements("Output").Elements("WNET").Value)
+        q = abs(self.value("Output", "WNET"))
         return q
 
 
@@ -804,7 +1328,7 @@ class TriColumn(Block):
     def __init__(
         self, name, nstages, dist_rate, reflux_ratio, press, mid_rate, inlet_stream
     ):
-        super().__init__(name, "Radfrac")
+        super().__init__(name, "Radfrac", inlet_stream.simulation)
         self.name = name
         self.nstages = nstages
         self.dist_rate = dist_rate
@@ -819,112 +1343,187 @@ class TriColumn(Block):
         self.StreamConnect(self.name, self.inlet_stream.name, "F(IN)")
 
         # Configuration
-        self.BLK.Elements(self.name).Elements("Input").Elements(
-            "CALC_MODE"
-        ).Value = "EQUILIBRIUM"
-        self.BLK.Elements(self.name).Elements("Input").Elements(
-            "NSTAGE"
-        ).Value = self.nstages
-        self.BLK.Elements(self.name).Elements("Input").Elements(
-            "CONDENSER"
-        ).Value = "TOTAL"
-        self.BLK.Elements(self.name).Elements("Input").Elements(
-            "REBOILER"
-        ).Value = "KETTLE"
-        self.BLK.Elements(self.name).Elements("Input").Elements("NO_PHASE").Value = 2
-        self.BLK.Elements(self.name).Elements("Input").Elements(
-            "CONV_METH"
-        ).Value = "STANDARD"
-        self.BLK.Elements(self.name).Elements("Input").Elements(
-            "BASIS_D"
-        ).Value = self.dist_rate
-        self.BLK.Elements(self.name).Elements("Input").Elements(
-            "BASIS_RR"
-        ).Value = self.reflux_ratio
-
-        # Streams
-        self.BLK.Elements(self.name).Elements("Input").Elements("FEED_STAGE").Elements(
-            self.inlet_stream.name
-        ).Value = round(self.nstages / 3, 0)
-        self.BLK.Elements(self.name).Elements("Input").Elements("FEED_CONVE2").Elements(
-            self.inlet_stream.name
-        ).Value = "ABOVE-STAGE"
-
-        # Pressure
-        self.BLK.Elements(self.name).Elements("Input").Elements(
-            "PRES1"
-        ).Value = self.press
-
-        # Convergence
-        self.BLK.Elements(self.name).Elements("Input").Elements("MAXOL").Value = 200
+        self.specify(
+            {
+                "CALC_MODE": "EQUILIBRIUM",
+                "NSTAGE": self.nstages,
+                "CONDENSER": "TOTAL",
+                "REBOILER": "KETTLE",
+                "NO_PHASE": 2,
+                "CONV_METH": "STANDARD",
+                "BASIS_D": self.dist_rate,
+                "BASIS_RR": self.reflux_ratio,
+                # Streams
+                ("FEED_STAGE", self.inlet_stream.name): round(self.nstages / 3, 0),
+                ("FEED_CONVE2", self.inlet_stream.name): "ABOVE-STAGE",
+                # Pressure
+                "PRES1": self.press,
+                # Convergence
+                "MAXOL": self.IterationLimit(200),
+            }
+        )
 
         # Tray sizing
-        self.BLK.Elements(self.name).Elements("Subobjects").Elements(
-            "Tray Sizing"
-        ).Elements.Add("1")
-
-        self.BLK.Elements(self.name).Elements("Subobjects").Elements(
-            "Tray Sizing"
-        ).Elements("1").Elements("Input").Elements("TS_STAGE1").Elements("1").Value = 2
-        self.BLK.Elements(self.name).Elements("Subobjects").Elements(
-            "Tray Sizing"
-        ).Elements("1").Elements("Input").Elements("TS_STAGE2").Elements("1").Value = (
-            self.nstages - 1
+        if self.created:
+            self.BLK.Elements(self.name).Elements("Subobjects").Elements(
+                "Tray Sizing"
+            ).Elements.Add("1")
+
+        self.specify(
+            {
+                ("TS_STAGE1", "1"): 2,
+                ("TS_STAGE2", "1"): self.nstages - 1,
+                ("TS_TRAYTYPE", "1"): "SIEVE",
+            },
+            "Subobjects",
+            "Tray Sizing",
+            "1",
+            "Input",
         )
-        self.BLK.Elements(self.name).Elements("Subobjects").Elements(
-            "Tray Sizing"
-        ).Elements("1").Elements("Input").Elements("TS_TRAYTYPE").Elements(
-            "1"
-        ).Value = "SIEVE"
 
-        d = Stream(f"{self.name}DOUT")
+        d = Stream(f"{self.name}DOUT", sim=self.simulation)
         self.StreamConnect(self.name, d.name, "LD(OUT)")
-        mid = Stream(f"{self.name}MOUT")
+        mid = Stream(f"{self.name}MOUT", sim=self.simulation)
         self.StreamConnect(self.name, mid.name, "SP(OUT)")
-        b = Stream(f"{self.name}BOUT")
+        b = Stream(f"{self.name}BOUT", sim=self.simulation)
         self.StreamConnect(self.name, b.name, "B(OUT)")
 
-        self.BLK.Elements(self.name).Elements("Input").Elements("PROD_PHASE").Elements(
-            mid.name
-        ).Value = "L"
-        self.BLK.Elements(self.name).Elements("Input").Elements("PROD_STAGE").Elements(
-            mid.name
-        ).Value = round(self.nstages / 2, 0)
-        self.BLK.Elements(self.name).Elements("Input").Elements("PROD_FLOW").Elements(
-            mid.name
-        ).Value = self.mid_rate
+        self.specify(
+            {
+                ("PROD_PHASE", mid.name): "L",
+                ("PROD_STAGE", mid.name): round(self.nstages / 2, 0),
+                ("PROD_FLOW", mid.name): self.mid_rate,
+            }
+        )
 
         return d, mid, b
 
     def energy_consumption(self):
-        q1 = abs(
-            self.BLK.Elements(self.name).Elements("Output").Elements("COND_DUTY").Value
-        )
-        q2 = abs(
-            self.BLK.Elements(self.name).Elements("Output").Elements("REB_DUTY").Value
-        )
+        q1 = abs(self.value("Output", "COND_DUTY"))
+        q2 = abs(self.value("Output", "REB_DUTY"))
         return q1 + q2
 
     def sizing(self):
-        D = (
-            self.BLK.Elements(self.name)
-            .Elements("Subobjects")
-            .Elements("Tray Sizing")
-            .Elements("1")
-            .Elements("Output")
-            .Elements("DIAM4")
-            .Elements("1")
-            .Value
-        )
+        D = self.value("Subobjects", "Tray Sizing", "1", "Output", "DIAM4", "1")
         H = 1.2 * 0.61 * (self.nstages - 2)
 
         return D, H
 
 
 class Empty_block(Block):
-    def __init__(self, name):
-        super().__init__(name, "Empty")
+    def __init__(self, name, sim):
+        super().__init__(name, "Empty", sim)
         self.name = name
 
     def dv_placement(self, *args):
         pass
+
+
+class ResultCache:
+    """Simulation results stored in SQLite, keyed by the canonical flowsheet, the quantized
+    decision variables and the inlet specs. Several worker processes can share the same file.
+    """
+
+    def __init__(self, path="results.sqlite", digits=6, timeout=60):
+        self.path = os.path.abspath(path)
+        self.digits = digits  # Significant digits kept when quantizing numbers in the keys
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._connection = None
+        self._pid = None
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS results "
+            "(key TEXT PRIMARY KEY, flowsheet TEXT, value BLOB, created REAL)"
+        )
+
+    @property
+    def connection(self):
+        # One connection per process, workers forked or spawned from the parent open their own
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(
+                self.path, timeout=self.timeout, isolation_level=None
+            )
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._pid = os.getpid()
+        return self._connection
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_connection"] = None
+        state["_pid"] = None
+        return state
+
+    def quantize(self, value):
+        if isinstance(value, dict):
+            return [
+                [str(k), self.quantize(v)]
+                for k, v in sorted(value.items(), key=lambda item: str(item[0]))
+            ]
+        if isinstance(value, (list, tuple, np.ndarray)):
+            return [self.quantize(v) for v in value]
+        if isinstance(value, (bool, np.bool_)):
+            return bool(value)
+        if isinstance(value, (int, np.integer)):
+            return int(value)
+        if isinstance(value, (float, np.floating)):
+            return float(f"{value:.{self.digits}g}")
+        return value
+
+    def canonical(self, flowsheet, decision_variables=(), inlet_specs=()):
+        return json.dumps(
+            self.quantize([flowsheet, decision_variables, inlet_specs]),
+            separators=(",", ":"),
+        )
+
+    def key(self, flowsheet, decision_variables=(), inlet_specs=()):
+        canonical = self.canonical(flowsheet, decision_variables, inlet_specs)
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def dumps(self, value):
+        # Simulation objects (the engine) are not stored, they are bound again when loading
+        buffer = io.BytesIO()
+        pickler = pickle.Pickler(buffer, protocol=pickle.HIGHEST_PROTOCOL)
+        pickler.persistent_id = lambda obj: (
+            "simulation" if type(obj) is Simulation else None
+        )
+        pickler.dump(value)
+        return buffer.getvalue()
+
+    def loads(self, data, sim=None):
+        unpickler = pickle.Unpickler(io.BytesIO(data))
+        unpickler.persistent_load = self.bind(sim)
+        return unpickler.load()
+
+    @staticmethod
+    def bind(sim):
+        # Simulations referenced by the stored value are replaced by sim
+        def persistent_load(pid):
+            if sim is None:
+                raise pickle.UnpicklingError(
+                    "The cached value references a simulation, pass sim to bind it"
+                )
+            return sim
+
+        return persistent_load
+
+    def get(self, key, sim=None):
+        row = self.connection.execute(
+            "SELECT value FROM results WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self.loads(row[0], sim)
+
+    def put(self, key, value, flowsheet=""):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO results (key, flowsheet, value, created) "
+            "VALUES (?, ?, ?, ?)",
+            (key, str(flowsheet), self.dumps(value), time.time()),
+        )
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
@@ -0,0 +1,377 @@
+import ast
+import csv
+import datetime
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+
+import numpy as np
+
+# Simulator of the current worker thread/process, made by the setup function of the campaign
+_worker = threading.local()
+
+
+def start_worker(setup, threads):
+    if threads:
+        try:
+            # COM objects (Aspen) need COM initialized in every thread using them
+            import pythoncom
+
+            pythoncom.CoInitialize()
+        except ImportError:
+            pass
+    _worker.state = setup() if setup is not None else None
+
+
+def run_item(evaluate, index, item):
+    start = time.perf_counter()
+    try:
+        record = dict(evaluate(_worker.state, index, item))
+    except Exception as e:
+        record = {"error": f"{type(e).__name__}: {e}"}
+    record["seconds"] = time.perf_counter() - start
+    return record
+
+
+def to_json(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (np.integer, np.floating, np.bool_)):
+        return value.item()
+    return str(value)
+
+
+def read_results(path):
+    """
+    Records of a results file (one JSON object per line), without a partially written last line.
+    """
+    records = []
+    if not os.path.exists(path):
+        return records
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.endswith("\n"):
+                break
+            records.append(json.loads(line))
+    return records
+
+
+class Campaign:
+    """
+    A resumable run of evaluate(state, index, item) over a dataset (e.g. the layouts and positions of
+    scon_main). Every finished item is appended to the results file path as one JSON line, written
+    with a single write and fsync, and the items in progress are saved after every item to
+    path.checkpoint (written to a temporary file and renamed), so a stopped campaign resumes with the
+    items not in the results. An item that was in progress max_attempts times without finishing (it
+    crashed its worker or the kernel) is recorded with an error instead of being run again.
+    Exceptions raised by evaluate are recorded as {"error": ...} and not retried.
+
+    Records hold the item index, the fields returned by evaluate and the seconds it took.
+    """
+
+    def __init__(self, path, items, max_attempts=3, report_every=60):
+        self.path = os.path.abspath(path)
+        self.checkpoint_path = self.path + ".checkpoint"
+        self.items = items
+        self.max_attempts = max_attempts
+        self.report_every = report_every
+        self.repair()
+        self.done = {record["index"] for record in read_results(self.path)}
+        self.attempts = {}
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, encoding="utf-8") as f:
+                self.attempts = {int(index): n for index, n in json.load(f)["running"].items()}
+        self.attempts = {index: n for index, n in self.attempts.items() if index not in self.done}
+
+    def repair(self):
+        # Drops a last line cut by a crash during its write, so that appends start on a new line
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+
+    def append(self, record):
+        line = json.dumps(record, default=to_json, separators=(",", ":")) + "\n"
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode("utf-8"))
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        self.done.add(record["index"])
+
+    def checkpoint(self, running):
+        temporary = self.checkpoint_path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump({"running": {str(index): self.attempts[index] for index in running}}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.checkpoint_path)
+
+    def pending(self, indices=None):
+        indices = range(len(self.items)) if indices is None else indices
+        return [index for index in indices if index not in self.done]
+
+    def results(self):
+        return read_results(self.path)
+
+    def run(self, evaluate, setup=None, workers=1, processes=False, indices=None):
+        """
+        Runs evaluate on the pending items (of indices, default all), workers at a time. Each worker
+        calls setup() once to make its simulator, passed to evaluate as state. With one worker the
+        items run in this thread; otherwise in a thread pool, or a process pool when processes (then
+        evaluate and setup must be importable module functions, one Aspen instance per process).
+        Prints the throughput and the ETA every report_every seconds. Returns the run statistics.
+        """
+        queue = self.pending(indices)
+        total, finished, errors = len(queue), 0, 0
+        start = last_report = time.perf_counter()
+        running = set()
+
+        def complete(index, record):
+            nonlocal finished, errors, last_report
+            record = {"index": index, **record}
+            self.append(record)
+            running.discard(index)
+            self.attempts.pop(index, None)
+            self.checkpoint(running)
+            finished += 1
+            errors += "error" in record
+            now = time.perf_counter()
+            if now - last_report >= self.report_every or finished == total:
+                last_report = now
+                self.report(finished, total, errors, now - start)
+
+        def items():
+            for index in queue:
+                self.attempts[index] = self.attempts.get(index, 0) + 1
+                if self.attempts[index] > self.max_attempts:
+                    complete(index, {"error": f"Abandoned after {self.max_attempts} attempts."})
+                    continue
+                running.add(index)
+                self.checkpoint(running)
+                yield index, self.items[index]
+
+        if workers == 1 and not processes:
+            start_worker(setup, threads=False)
+            for index, item in items():
+                complete(index, run_item(evaluate, index, item))
+        else:
+            pool = ProcessPoolExecutor if processes else ThreadPoolExecutor
+            with pool(workers, initializer=start_worker, initargs=(setup, not processes)) as executor:
+                futures = {}
+                for index, item in items():
+                    futures[executor.submit(run_item, evaluate, index, item)] = index
+                    if len(futures) >= workers:
+                        finished_futures, _ = wait(futures, return_when=FIRST_COMPLETED)
+                        for future in finished_futures:
+                            complete(futures.pop(future), future.result())
+                for future in as_completed(list(futures)):
+                    complete(futures.pop(future), future.result())
+        return {"finished": finished, "errors": errors, "seconds": time.perf_counter() - start}
+
+    def report(self, finished, total, errors, elapsed):
+        rate = finished / elapsed if elapsed else 0.0
+        eta = datetime.timedelta(seconds=round((total - finished) / rate)) if rate else "unknown"
+        print(
+            f"Processed {len(self.done)} items out of {len(self.items)}: {finished}/{total} this run, "
+            f"{errors} errors, {rate * 3600:.0f} items/h, ETA {eta}."
+        )
+
+
+def ragged(rows, offsets):
+    """
+    Entries and offsets of the given rows of a ragged column, whose row i is entries offsets[i] : offsets[i + 1].
+    """
+    starts = offsets[:-1][rows]
+    lengths = offsets[1:][rows] - starts
+    new_offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    return np.repeat(starts - new_offsets[:-1], lengths) + np.arange(new_offsets[-1]), new_offsets
+
+
+class SimulationLog:
+    """
+    Columnar store of simulation logs and PSO results: one row per simulated design, with the layout
+    strings, the scalar columns (index, status, net_power, net_heat, ...), the positions as a ragged
+    float column (position_values, position_offsets) and the unit outputs normalized to one entry per
+    unit and row (unit_ids into unit_names, unit_values, unit_offsets per row). Saved as an
+    uncompressed npz of typed arrays, so loading and filtering a full log takes milliseconds.
+    Rows of a layout are found through a sorted index of the layout strings.
+    """
+
+    # Columns of the CSV logs and campaign records under their store names
+    aliases = {
+        "Index": "index",
+        "Layout": "layout",
+        "Position": "position",
+        "Status": "status",
+        "Unit Outputs": "units",
+        "Net Power": "net_power",
+        "Net Power (MW)": "net_power",
+        "Net Heating Duty": "net_heat",
+        "Net Heat (MW)": "net_heat",
+    }
+
+    def __init__(self, layout, columns=None, position=None, units=None, unit_names=()):
+        """
+        :param layout: Layout strings of the rows.
+        :param columns: Scalar columns, name -> array.
+        :param position: (values, offsets) of the positions.
+        :param units: (ids, values, offsets) of the unit outputs, ids into unit_names.
+        """
+        self.layout = np.asarray(layout, dtype=str)
+        n = len(self.layout)
+        self.columns = {name: np.asarray(column) for name, column in (columns or {}).items()}
+        empty = np.zeros(n + 1, dtype=np.int64)
+        self.position_values, self.position_offsets = position or (np.empty(0), empty)
+        self.unit_ids, self.unit_values, self.unit_offsets = units or (np.empty(0, np.int16), np.empty(0), empty)
+        self.unit_names = np.asarray(unit_names, dtype=str)
+        self.order = np.argsort(self.layout, kind="stable")
+
+    def __len__(self):
+        return len(self.layout)
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    @classmethod
+    def from_records(cls, records):
+        """
+        Store of records (dicts such as campaign results or CSV rows): positions as lists, unit
+        outputs as dicts, everything else a scalar column. Missing numbers are nan.
+        """
+        records = [{cls.aliases.get(key, key): value for key, value in record.items()} for record in records]
+        scalars = [key for key in dict.fromkeys(key for record in records for key in record) if key not in ("layout", "position", "units")]
+        columns = {}
+        for name in scalars:
+            column = [record.get(name) for record in records]
+            if all(isinstance(value, (int, np.integer)) for value in column):
+                columns[name] = np.array(column, dtype=np.int64)
+            elif all(value is None or isinstance(value, (int, float, np.number)) for value in column):
+                columns[name] = np.array([np.nan if value is None else value for value in column], dtype=float)
+            else:
+                columns[name] = np.array(["" if value is None else str(value) for value in column])
+        positions = [np.ravel(record.get("position") or ()).astype(float) for record in records]
+        position_offsets = np.concatenate([[0], np.cumsum([len(p) for p in positions])]).astype(np.int64)
+        unit_names = sorted({unit for record in records if isinstance(record.get("units"), dict) for unit in record["units"]})
+        unit_index = {unit: i for i, unit in enumerate(unit_names)}
+        ids, values, counts = [], [], []
+        for record in records:
+            outputs = record.get("units") if isinstance(record.get("units"), dict) else {}
+            ids += [unit_index[unit] for unit in outputs]
+            values += [np.nan if value is None else value for value in outputs.values()]
+            counts.append(len(outputs))
+        return cls(
+            [record.get("layout", "") for record in records],
+            columns,
+            (np.concatenate(positions) if positions else np.empty(0), position_offsets),
+            (np.array(ids, dtype=np.int16), np.array(values, dtype=float), np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)),
+            unit_names,
+        )
+
+    @classmethod
+    def from_csv(cls, path):
+        """
+        Imports a CSV log (simulation_log_*.csv, NA_F8_PSOresults*.csv): positions and unit outputs
+        are parsed once from their list/dict strings, numbers converted.
+        """
+
+        def parse(key, value):
+            if key in ("Position", "Unit Outputs"):
+                return ast.literal_eval(value) if value not in ("", "0") else None
+            if key == "Layout":
+                return value
+            for number in (int, float):
+                try:
+                    return number(value)
+                except ValueError:
+                    pass
+            return value
+
+        with open(path, newline="", encoding="utf-8") as f:
+            return cls.from_records([{key: parse(key, value) for key, value in row.items()} for row in csv.DictReader(f)])
+
+    @classmethod
+    def from_results(cls, path):
+        return cls.from_records(read_results(path))
+
+    def save(self, path):
+        arrays = {f"column_{name}": column for name, column in self.columns.items()}
+        np.savez(
+            path,
+            layout=self.layout,
+            position_values=self.position_values,
+            position_offsets=self.position_offsets,
+            unit_ids=self.unit_ids,
+            unit_values=self.unit_values,
+            unit_offsets=self.unit_offsets,
+            unit_names=self.unit_names,
+            **arrays,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            columns = {key[len("column_") :]: data[key] for key in data.files if key.startswith("column_")}
+            return cls(
+                data["layout"],
+                columns,
+                (data["position_values"], data["position_offsets"]),
+                (data["unit_ids"], data["unit_values"], data["unit_offsets"]),
+                data["unit_names"],
+            )
+
+    def rows(self, layouts):
+        """
+        Rows of a layout string, or of any of a list of layouts, in row order.
+        """
+        layouts = np.atleast_1d(np.asarray(layouts, dtype=str))
+        ordered = self.layout[self.order]
+        start, stop = np.searchsorted(ordered, layouts, "left"), np.searchsorted(ordered, layouts, "right")
+        return np.sort(np.concatenate([self.order[a:b] for a, b in zip(start, stop)] or [np.empty(0, dtype=np.int64)]))
+
+    def take(self, rows):
+        """
+        Store of the given rows (indices or a boolean mask), e.g. log.take(log["status"] == 1).
+        """
+        rows = np.flatnonzero(rows) if np.asarray(rows).dtype == bool else np.asarray(rows, dtype=np.int64)
+        positions, position_offsets = ragged(rows, self.position_offsets)
+        units, unit_offsets = ragged(rows, self.unit_offsets)
+        return SimulationLog(
+            self.layout[rows],
+            {name: column[rows] for name, column in self.columns.items()},
+            (self.position_values[positions], position_offsets),
+            (self.unit_ids[units], self.unit_values[units], unit_offsets),
+            self.unit_names,
+        )
+
+    def position(self, row):
+        return self.position_values[self.position_offsets[row] : self.position_offsets[row + 1]]
+
+    def unit_outputs(self, row):
+        entries = slice(self.unit_offsets[row], self.unit_offsets[row + 1])
+        return dict(zip(self.unit_names[self.unit_ids[entries]].tolist(), self.unit_values[entries].tolist()))
+
+    def unit(self, name):
+        """
+        Output of a unit (e.g. "T1") in every row, nan where the layout has no such unit.
+        """
+        column = np.full(len(self), np.nan)
+        ids = np.flatnonzero(self.unit_names == name)
+        if len(ids):
+            entries = np.flatnonzero(self.unit_ids == ids[0])
+            column[np.searchsorted(self.unit_offsets, entries, "right") - 1] = self.unit_values[entries]
+        return column
+
+    def unit_matrix(self):
+        """
+        Outputs of all units as a (rows, unit_names) array, nan where a layout has no such unit.
+        """
+        matrix = np.full((len(self), len(self.unit_names)), np.nan)
+        rows = np.repeat(np.arange(len(self)), np.diff(self.unit_offsets))
+        matrix[rows, self.unit_ids] = self.unit_values
+        return matrix
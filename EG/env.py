@@ -212,6 +212,8 @@ class Flowsheet:
             for i, uo in enumerate(self.actions_list):
                 if "M" in uo:
                     self.sim.StreamConnect(self.actions_list[i], rec.name, "F(IN)")
+                    if self.sim.tear_method is not None:
+                        self.sim.TearStream(rec.name)
                     break
 
             self.sim.EngineRun()
@@ -500,7 +502,7 @@ class Flowsheet:
                 compounds["DEG"],
             )
             tot_flow = Feo + Fw + Feg + Fdeg
-            sin[i] = Stream(f"IN{i+1}", self.inlet_specs[i])
+            sin[i] = Stream(f"IN{i+1}", self.inlet_specs[i], sim=self.sim)
 
             self.state[i] = np.array(
                 [
@@ -0,0 +1,588 @@
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+import numpy as np
+from scipy.linalg import cho_solve, solve_triangular
+
+
+def evaluate(objective, positions, batched=False, executor=None):
+    """
+    Objective values of a block of positions as a float array.
+    batched: objective takes the (n, dim) array and returns n values.
+    executor: positions are submitted one by one to a concurrent.futures pool.
+    Otherwise objective is called on each position in turn. Failed evaluations
+    (None, nan) are returned as inf so the swarm moves away from them.
+    """
+    if batched:
+        values = objective(positions)
+    elif executor is not None:
+        values = list(executor.map(objective, positions))
+    else:
+        values = [objective(x) for x in positions]
+    if not batched:
+        values = [np.inf if value is None else value for value in values]
+    values = np.asarray(values, dtype=float).reshape(len(positions))
+    values[np.isnan(values)] = np.inf
+    return values
+
+
+def penalize(value):
+    """
+    A single objective value as a float, inf for a failed evaluation (None or nan).
+    """
+    return np.inf if value is None or np.isnan(value) else float(value)
+
+
+def snap(positions, resolution):
+    """
+    Positions rounded to the grid of resolution (one step per dimension, 0 to leave it continuous).
+    """
+    step = np.where(resolution > 0, resolution, 1)
+    return np.where(resolution > 0, np.round(positions / step) * step, positions)
+
+
+class EvaluationArchive:
+    """
+    Objective values memoized on a hash grid of the positions, shared by any number of optimizers.
+    Positions falling in the same cell of resolution (exact positions where it is 0 or None) are
+    evaluated once, later requests are answered from the archive. hits counts the evaluations
+    answered from the archive (the simulations avoided) and misses the ones evaluated.
+    """
+
+    def __init__(self, resolution=None):
+        self.resolution = None if resolution is None else np.asarray(resolution, dtype=float)
+        self.values = {}
+        self.hits = 0
+        self.misses = 0
+
+    def keys(self, positions):
+        cells = np.atleast_2d(np.asarray(positions, dtype=float))
+        if self.resolution is not None:
+            step = np.where(self.resolution > 0, self.resolution, 1)
+            cells = np.where(self.resolution > 0, np.round(cells / step), cells)
+        # + 0.0 merges -0.0 and 0.0
+        return [row.tobytes() for row in cells + 0.0]
+
+    def lookup(self, position):
+        """
+        Key of a single position and its archived value, None when it has to be evaluated.
+        """
+        key = self.keys(position)[0]
+        value = self.values.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return key, value
+
+    def evaluate(self, objective, positions, batched=False, executor=None):
+        """
+        evaluate() of the positions missing from the archive (once per cell), the others looked up.
+        """
+        keys = self.keys(positions)
+        missing = {}
+        for row, key in enumerate(keys):
+            if key not in self.values and key not in missing:
+                missing[key] = row
+        if missing:
+            values = evaluate(objective, positions[list(missing.values())], batched, executor)
+            self.values.update(zip(missing, values.tolist()))
+        self.misses += len(missing)
+        self.hits += len(keys) - len(missing)
+        return np.array([self.values[key] for key in keys])
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def summary(self):
+        return {
+            "evaluations": self.hits + self.misses,
+            "simulations": self.misses,
+            "avoided": self.hits,
+            "hit_rate": self.hit_rate,
+            "archived": len(self.values),
+        }
+
+
+class PSO:
+    """
+    Particle swarm minimizer with an ask/tell interface. ask() returns the positions to evaluate and
+    tell() takes their objective values, so the evaluation can be done in a loop, in one batched call or
+    by a worker pool (see run). The swarm update is vectorized over all particles and follows improved_pso:
+    linearly decaying inertia, a social coefficient growing with the iterations, velocity clamping,
+    reflective bounds, velocity mutation and a restart of the worst particles when the best value
+    stalls for patience // 2 iterations. The search stops after max_iter iterations, after patience
+    iterations without improvement in the second half of the run, or when target is reached.
+
+    With a resolution the asked positions are snapped to its grid, and run() looks them up in archive
+    (an EvaluationArchive, possibly shared with other runs) before evaluating them.
+
+    history holds the iteration, the evaluation count, the simulations actually run, the elapsed time
+    and the best value after every tell; reached holds the evaluation count, time and iteration at
+    which target was first reached.
+    """
+
+    def __init__(
+        self,
+        bounds,
+        dim=None,
+        swarm_size=50,
+        max_iter=500,
+        w=(0.95, 0.2),
+        c1=2.0,
+        c2=2.1,
+        adaptive_social=True,
+        v_max_ratio=0.25,
+        boundary="reflect",
+        mutation=0.0,
+        tol=0.0,
+        patience=25,
+        restart_ratio=0.15,
+        target=None,
+        resolution=None,
+        archive=None,
+        seed=None,
+    ):
+        """
+        :param bounds: (lower, upper) for every dimension (then dim is required) or an array of shape (dim, 2).
+        :param w: Constant inertia or (start, end) of the linear decay.
+        :param v_max_ratio: Velocity limit as a fraction of the bound range, None to leave the velocity
+            unclamped (new velocities are then drawn within the bound range).
+        :param boundary: "reflect" reverts the move and reverses half the velocity, "clip" clips to the bounds.
+        :param mutation: Probability of redrawing each velocity component within the velocity limit
+            (the bound range when unclamped).
+        :param tol: Smallest decrease of the best value counted as an improvement.
+        :param patience: Stalled iterations before stopping, None to run all max_iter iterations.
+        :param restart_ratio: Fraction of the swarm restarted when it stalls, 0 to disable restarts.
+        :param resolution: Grid step of every dimension (0: continuous), defaults to the archive's.
+        """
+        bounds = np.asarray(bounds, dtype=float)
+        if bounds.ndim == 1:
+            if dim is None:
+                raise ValueError("dim is required with scalar bounds.")
+            bounds = np.tile(bounds, (dim, 1))
+        self.lower, self.upper = bounds[:, 0].copy(), bounds[:, 1].copy()
+        self.dim = len(bounds)
+        self.swarm_size = swarm_size
+        self.max_iter = max_iter
+        self.w = w if isinstance(w, tuple) else (w, w)
+        self.c1, self.c2 = c1, c2
+        self.adaptive_social = adaptive_social
+        self.velocity_limit = None if v_max_ratio is None else v_max_ratio * (self.upper - self.lower)
+        self.velocity_spread = self.upper - self.lower if v_max_ratio is None else self.velocity_limit
+        if boundary not in ("reflect", "clip"):
+            raise ValueError(f"Unknown boundary handling {boundary}.")
+        self.boundary = boundary
+        self.mutation = mutation
+        self.tol = tol
+        self.patience = patience
+        self.restart_size = int(restart_ratio * swarm_size)
+        self.target = target
+        self.archive = archive
+        if resolution is None and archive is not None:
+            resolution = archive.resolution
+        self.resolution = None if resolution is None else np.broadcast_to(np.asarray(resolution, dtype=float), (self.dim,))
+        self.rng = np.random.default_rng(seed)
+
+        shape = (swarm_size, self.dim)
+        self.position = self.rng.uniform(self.lower, self.upper, shape)
+        self.velocity = self.rng.uniform(-self.velocity_spread, self.velocity_spread, shape)
+        self.pbest = self.position.copy()
+        self.pbest_value = np.full(swarm_size, np.inf)
+        self.best = None
+        self.best_value = np.inf
+        self.iteration = 0
+        self.evaluations = 0
+        self.avoided = 0
+        self.stalled = 0
+        self.restart_counter = 0
+        self.history = {"iteration": [], "evaluations": [], "simulations": [], "time": [], "best": []}
+        self.reached = None
+        self.pending = np.arange(swarm_size)
+        self.phase = "init"
+        self.start = time.perf_counter()
+
+    @property
+    def done(self):
+        if self.reached is not None or self.iteration >= self.max_iter:
+            return True
+        return self.patience is not None and self.stalled >= self.patience and self.iteration > self.max_iter // 2
+
+    def ask(self):
+        """
+        Positions to evaluate next: the whole swarm, or only the restarted particles after a restart.
+        """
+        if self.pending is None:
+            self.move()
+            self.pending = np.arange(self.swarm_size)
+            self.phase = "move"
+        self.quantize(self.pending)
+        return self.position[self.pending].copy()
+
+    def tell(self, values):
+        """
+        Objective values of the positions returned by the last ask().
+        """
+        if self.pending is None:
+            raise RuntimeError("tell() called without a pending ask().")
+        index, self.pending = self.pending, None
+        values = np.asarray(values, dtype=float).reshape(len(index))
+        self.evaluations += len(index)
+        if self.phase == "move":
+            improved = values < self.pbest_value
+            index, values = index[improved], values[improved]
+        # Initial and restarted particles overwrite their personal bests
+        self.pbest[index] = self.position[index]
+        self.pbest_value[index] = values
+        improved = self.update_best()
+        if self.phase == "move":
+            self.iteration += 1
+            self.stalled = 0 if improved else self.stalled + 1
+            self.record()
+            self.restart()
+        elif self.phase == "init":
+            self.record()
+        else:
+            self.stalled = 0
+
+    def update_best(self):
+        i = int(np.argmin(self.pbest_value))
+        if self.best is None or self.pbest_value[i] < self.best_value:
+            improved = self.pbest_value[i] < self.best_value - self.tol
+            self.best = self.pbest[i].copy()
+            self.best_value = float(self.pbest_value[i])
+            return improved
+        return False
+
+    def record(self):
+        elapsed = time.perf_counter() - self.start
+        self.history["iteration"].append(self.iteration)
+        self.history["evaluations"].append(self.evaluations)
+        self.history["simulations"].append(self.evaluations - self.avoided)
+        self.history["time"].append(elapsed)
+        self.history["best"].append(self.best_value)
+        if self.reached is None and self.target is not None and self.best_value <= self.target:
+            self.reached = {"iteration": self.iteration, "evaluations": self.evaluations, "time": elapsed}
+
+    def move(self, index=slice(None)):
+        """
+        Velocity and position update of the particles at index (a slice or a single particle).
+        """
+        w_start, w_end = self.w
+        w = max(w_start - (self.iteration + 1) * (w_start - w_end) / self.max_iter, w_end)
+        c2 = self.c2 * (0.5 + 0.5 * self.iteration / self.max_iter) if self.adaptive_social else self.c2
+        position, velocity = self.position[index], self.velocity[index]
+        r1, r2 = self.rng.random((2,) + velocity.shape)
+        velocity *= w
+        velocity += self.c1 * r1 * (self.pbest[index] - position)
+        velocity += c2 * r2 * (self.best - position)
+        if self.mutation:
+            mutated = self.rng.random(velocity.shape) < self.mutation
+            velocity[mutated] = self.rng.uniform(-self.velocity_spread, self.velocity_spread, velocity.shape)[mutated]
+        if self.velocity_limit is not None:
+            np.clip(velocity, -self.velocity_limit, self.velocity_limit, out=velocity)
+        position += velocity
+        if self.boundary == "clip":
+            np.clip(position, self.lower, self.upper, out=position)
+            return
+        outside = (position < self.lower) | (position > self.upper)
+        np.subtract(position, velocity, out=position, where=outside)
+        velocity[outside] *= -0.5
+
+    def quantize(self, index):
+        if self.resolution is not None:
+            self.position[index] = np.clip(snap(self.position[index], self.resolution), self.lower, self.upper)
+
+    def restart(self):
+        if not self.restart_size or self.patience is None or self.done or self.stalled <= self.patience // 2:
+            return
+        self.restart_counter += 1
+        if self.restart_counter < self.restart_size:
+            return
+        self.restart_counter = 0
+        self.reset(np.argsort(self.pbest_value)[-self.restart_size :])
+
+    def reset(self, index):
+        shape = (len(index), self.dim)
+        self.position[index] = self.rng.uniform(self.lower, self.upper, shape)
+        self.velocity[index] = self.rng.uniform(-self.velocity_spread, self.velocity_spread, shape)
+        self.pending = index
+        self.phase = "restart"
+
+    def run(self, objective, batched=False, executor=None):
+        """
+        Ask/tell loop until done, evaluating with evaluate(objective, ..., batched, executor).
+        Returns the best position and value.
+        """
+        while not self.done:
+            self.tell(self.simulate(objective, self.ask(), batched, executor))
+        return self.best, self.best_value
+
+    def simulate(self, objective, positions, batched=False, executor=None):
+        if self.archive is None:
+            return evaluate(objective, positions, batched, executor)
+        hits = self.archive.hits
+        values = self.archive.evaluate(objective, positions, batched, executor)
+        self.avoided += self.archive.hits - hits
+        return values
+
+
+class AsyncPSO(PSO):
+    """
+    Steady-state PSO for evaluations of uneven duration, such as Aspen runs of different layouts.
+    Particles are asked and told one at a time and a particle is moved towards the current global
+    best as soon as its own value comes back, so a free worker never waits for the rest of the swarm.
+    Every swarm_size evaluations count as one iteration for the inertia schedule, the patience, the
+    restarts and the history. Restarted particles are redrawn the next time they are asked.
+    """
+
+    def __init__(self, bounds, dim=None, **settings):
+        super().__init__(bounds, dim, **settings)
+        self.idle = deque(range(self.swarm_size))
+        # Next value of the particle overwrites its personal best (initial and restarted particles)
+        self.fresh = np.ones(self.swarm_size, dtype=bool)
+        self.redraw = np.zeros(self.swarm_size, dtype=bool)
+        self.improved = False
+        self.utilization = None
+
+    def ask(self):
+        """
+        Index and position of the next idle particle, None when every particle is being evaluated.
+        """
+        if not self.idle:
+            return None
+        index = self.idle.popleft()
+        if self.redraw[index]:
+            self.position[index] = self.rng.uniform(self.lower, self.upper)
+            self.velocity[index] = self.rng.uniform(-self.velocity_spread, self.velocity_spread)
+            self.redraw[index] = False
+            self.fresh[index] = True
+        elif not self.fresh[index]:
+            self.move(index)
+        self.quantize(index)
+        return index, self.position[index].copy()
+
+    def tell(self, index, value):
+        """
+        Objective value of the particle index returned by ask().
+        """
+        value = penalize(value)
+        self.evaluations += 1
+        if self.fresh[index] or value < self.pbest_value[index]:
+            self.fresh[index] = False
+            self.pbest[index] = self.position[index]
+            self.pbest_value[index] = value
+            if self.best is None or value < self.best_value:
+                self.improved |= value < self.best_value - self.tol
+                self.best = self.pbest[index].copy()
+                self.best_value = value
+        self.idle.append(index)
+        if self.evaluations % self.swarm_size:
+            return
+        if self.evaluations > self.swarm_size:
+            self.iteration += 1
+            self.stalled = 0 if self.improved else self.stalled + 1
+        self.improved = False
+        self.record()
+        self.restart()
+
+    def reset(self, index):
+        self.redraw[index] = True
+        self.stalled = 0
+
+    def lookup(self, position):
+        if self.archive is None:
+            return None, None
+        key, value = self.archive.lookup(position)
+        self.avoided += value is not None
+        return key, value
+
+    def run(self, objective, executor=None, workers=None):
+        """
+        Keeps workers evaluations of objective in flight on executor (default: its max_workers) until
+        done, then waits for the running ones. Without executor the particles are evaluated in turn.
+        Positions found in the archive are told at once. utilization is the fraction of the workers'
+        time spent in evaluations. Returns the best position and value.
+        """
+        if executor is None:
+            while not self.done:
+                index, position = self.ask()
+                key, value = self.lookup(position)
+                if value is None:
+                    value = penalize(objective(position))
+                    if key is not None:
+                        self.archive.values[key] = value
+                self.tell(index, value)
+            self.utilization = 1.0
+            return self.best, self.best_value
+        workers = min(workers or getattr(executor, "_max_workers", 1), self.swarm_size)
+        running = {}
+        busy = 0.0
+        start = time.perf_counter()
+        while running or not self.done:
+            while not self.done and len(running) < workers:
+                index, position = self.ask()
+                key, value = self.lookup(position)
+                if value is not None:
+                    self.tell(index, value)
+                    continue
+                running[executor.submit(objective, position)] = index, key, time.perf_counter()
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            now = time.perf_counter()
+            for future in finished:
+                index, key, submitted = running.pop(future)
+                busy += now - submitted
+                value = penalize(future.result())
+                if key is not None:
+                    self.archive.values[key] = value
+                self.tell(index, value)
+        self.utilization = busy / (workers * (time.perf_counter() - start))
+        return self.best, self.best_value
+
+
+class RBFSurrogate:
+    """
+    Gaussian RBF model of an objective, with a constant mean and a nugget (a Gaussian process with a
+    fixed length scale). Positions are scaled to the unit cube of the bounds; the length scale is the
+    median distance between the first points added unless given. Points are added by extending the
+    Cholesky factor of the kernel matrix, O(n^2) per point instead of a full O(n^3) refit, and points
+    the model already explains within the nugget (near duplicates) are skipped.
+    Failed evaluations (inf) are modelled as the worst finite value seen.
+    """
+
+    def __init__(self, lower, upper, length_scale=None, nugget=1e-6):
+        self.lower = np.asarray(lower, dtype=float)
+        self.scale = np.where(np.asarray(upper) > self.lower, np.asarray(upper) - self.lower, 1.0)
+        self.length_scale = length_scale
+        self.nugget = nugget
+        self.size = 0
+        self.points = np.empty((64, len(self.lower)))
+        self.values = np.empty(64)
+        self.factor = np.zeros((64, 64))
+        self.weights = np.empty(0)
+        self.mean, self.spread = 0.0, 1.0
+
+    def __len__(self):
+        return self.size
+
+    def kernel(self, a, b):
+        distance = np.sum(a * a, axis=1)[:, None] + np.sum(b * b, axis=1)[None, :] - 2 * a @ b.T
+        return np.exp(-np.maximum(distance, 0) / (2 * self.length_scale**2))
+
+    def grow(self):
+        capacity = 2 * len(self.values)
+        self.points = np.resize(self.points, (capacity, self.points.shape[1]))
+        self.values = np.resize(self.values, capacity)
+        factor = np.zeros((capacity, capacity))
+        factor[: self.size, : self.size] = self.factor[: self.size, : self.size]
+        self.factor = factor
+
+    def add(self, positions, values):
+        """
+        Adds the evaluated positions and refits the weights.
+        """
+        positions = (np.atleast_2d(positions) - self.lower) / self.scale
+        values = np.asarray(values, dtype=float).reshape(len(positions))
+        if self.length_scale is None:
+            if len(positions) < 2:
+                return
+            distance = np.sqrt(np.sum((positions[:, None] - positions[None]) ** 2, axis=2))
+            self.length_scale = float(np.median(distance[np.triu_indices(len(positions), 1)])) or 1.0
+        for x, value in zip(positions, values):
+            n = self.size
+            k = self.kernel(self.points[:n], x[None])[:, 0]
+            row = solve_triangular(self.factor[:n, :n], k, lower=True) if n else k
+            residual = 1 + self.nugget - row @ row
+            if residual <= 2 * self.nugget:
+                continue
+            if n == len(self.values):
+                self.grow()
+            self.factor[n, :n] = row
+            self.factor[n, n] = np.sqrt(residual)
+            self.points[n], self.values[n] = x, value
+            self.size += 1
+        values = self.values[: self.size]
+        finite = np.isfinite(values)
+        if not finite.any():
+            return
+        targets = np.where(finite, values, values[finite].max())
+        self.mean, self.spread = targets.mean(), targets.std() or 1.0
+        self.weights = cho_solve((self.factor[: self.size, : self.size], True), (targets - self.mean) / self.spread)
+
+    def predict(self, positions, std=False):
+        """
+        Predicted values of positions, and their standard deviations when std.
+        """
+        positions = (np.atleast_2d(positions) - self.lower) / self.scale
+        k = self.kernel(positions, self.points[: self.size])
+        mean = self.mean + self.spread * (k @ self.weights)
+        if not std:
+            return mean
+        v = solve_triangular(self.factor[: self.size, : self.size], k.T, lower=True)
+        return mean, self.spread * np.sqrt(np.maximum(1 - np.sum(v * v, axis=0), 0))
+
+
+class SurrogatePSO(PSO):
+    """
+    PSO with surrogate prescreening. The initial swarm and restarted particles are all simulated, then
+    every generation is ranked by an RBFSurrogate fitted on the simulations so far: only the top_k
+    candidates with the best predicted values, plus the explore candidates the model is least sure of,
+    are simulated. The others are told inf, which keeps their personal bests and counts them as avoided
+    simulations. top_k and explore are counts, or fractions of the swarm when below 1.
+    """
+
+    def __init__(self, bounds, dim=None, top_k=0.2, explore=0.05, length_scale=None, **settings):
+        super().__init__(bounds, dim, **settings)
+        self.top_k = top_k
+        self.explore = explore
+        self.surrogate = RBFSurrogate(self.lower, self.upper, length_scale)
+
+    def quota(self, share):
+        return int(share) if share >= 1 else int(np.ceil(share * self.swarm_size))
+
+    def screen(self, positions):
+        """
+        Indices of the positions to simulate.
+        """
+        top_k, explore = self.quota(self.top_k), self.quota(self.explore)
+        if self.phase != "move" or len(self.surrogate.weights) == 0 or top_k + explore >= len(positions):
+            return np.arange(len(positions))
+        mean, std = self.surrogate.predict(positions, std=True)
+        order = np.argsort(mean)
+        rest = order[top_k:]
+        return np.concatenate([order[:top_k], rest[np.argsort(-std[rest])[:explore]]])
+
+    def run(self, objective, batched=False, executor=None):
+        while not self.done:
+            positions = self.ask()
+            chosen = self.screen(positions)
+            values = np.full(len(positions), np.inf)
+            values[chosen] = self.simulate(objective, positions[chosen], batched, executor)
+            self.avoided += len(positions) - len(chosen)
+            self.surrogate.add(positions[chosen], values[chosen])
+            self.tell(values)
+        return self.best, self.best_value
+
+
+def minimize(
+    objective, bounds, dim=None, batched=False, executor=None, asynchronous=False, workers=None, prescreen=False, **settings
+):
+    """
+    Runs a PSO(bounds, dim, **settings), an AsyncPSO when asynchronous or a SurrogatePSO when prescreen,
+    on objective and returns the best position, the best value and the history (as arrays).
+    """
+    if prescreen:
+        optimizer = SurrogatePSO(bounds, dim, **settings)
+        best, best_value = optimizer.run(objective, batched, executor)
+    elif asynchronous:
+        optimizer = AsyncPSO(bounds, dim, **settings)
+        best, best_value = optimizer.run(objective, executor, workers)
+    else:
+        optimizer = PSO(bounds, dim, **settings)
+        best, best_value = optimizer.run(objective, batched, executor)
+    return best, best_value, {key: np.asarray(value) for key, value in optimizer.history.items()}
@@ -0,0 +1,171 @@
+import numpy as np
+
+
+def lhs(rng, n, dim, candidates=1):
+    """
+    Latin hypercube of n points in the unit cube: every column has one point in each of its n strata.
+    With candidates > 1 the design with the largest minimum distance between points is kept (maximin),
+    O(n^2) per candidate, for small designs.
+    """
+    best, best_distance = None, -1.0
+    for _ in range(candidates):
+        strata = rng.permuted(np.tile(np.arange(n), (dim, 1)), axis=1).T
+        points = (strata + rng.random((n, dim))) / n
+        if candidates == 1:
+            return points
+        squared = np.sum(points * points, axis=1)
+        distance = squared[:, None] + squared[None, :] - 2 * points @ points.T
+        np.fill_diagonal(distance, np.inf)
+        if distance.min() > best_distance:
+            best, best_distance = points, distance.min()
+    return best
+
+
+def sobol(rng, n, dim):
+    """
+    First n points of a scrambled Sobol sequence in the unit cube.
+    """
+    # Imported here so that the module stays importable without scipy
+    from scipy.stats import qmc
+
+    return qmc.Sobol(dim, scramble=True, seed=rng).random_base2(max(0, int(np.ceil(np.log2(n)))))[:n]
+
+
+def rows(samples):
+    """
+    The designs of a sample (name -> column) one at a time as dicts.
+    """
+    names = list(samples)
+    for values in zip(*samples.values()):
+        yield dict(zip(names, values))
+
+
+class DesignSpace:
+    """
+    Box of design variables with vectorized constraints, sampled in the unit cube and mapped to the
+    variables in the order they are declared. A bound can be a number, the name of a variable declared
+    before, or a function of the columns sampled so far, so that constraints such as P_out < P_in are
+    built into the space ("P_out": (74e5, "P_in")) instead of rejected. Constraints are predicates
+    taking a dict of columns (name -> array) and returning a boolean array, written as for a single
+    design with & and | in place of and/or.
+
+    sample() draws a large LHS, Sobol or random batch, keeps the valid designs and tops the rest up in
+    rounds drawn from the least filled strata of every variable, which keeps the valid designs spread
+    like a Latin hypercube where the constraints allow it.
+    """
+
+    def __init__(self, bounds, constraints=()):
+        """
+        :param bounds: name -> (lower, upper), in dependency order.
+        :param constraints: Vectorized predicates of the columns.
+        """
+        self.names = list(bounds)
+        self.bounds = dict(bounds)
+        self.constraints = list(constraints)
+        self.dim = len(self.names)
+
+    def limits(self, name, columns):
+        return [
+            bound(columns) if callable(bound) else columns[bound] if isinstance(bound, str) else bound
+            for bound in self.bounds[name]
+        ]
+
+    def transform(self, unit):
+        """
+        Columns of the designs at unit cube points (n, dim).
+        """
+        columns = {}
+        for j, name in enumerate(self.names):
+            lower, upper = self.limits(name, columns)
+            columns[name] = lower + unit[:, j] * (upper - lower)
+        return columns
+
+    def inverse(self, columns):
+        """
+        Unit cube points (n, dim) of designs given as columns.
+        """
+        unit = np.empty((len(columns[self.names[0]]), self.dim))
+        for j, name in enumerate(self.names):
+            lower, upper = self.limits(name, columns)
+            width = np.asarray(upper - lower, dtype=float)
+            unit[:, j] = (columns[name] - lower) / np.where(width > 0, width, 1)
+        return np.clip(unit, 0, np.nextafter(1, 0))
+
+    def valid(self, columns):
+        n = len(columns[self.names[0]])
+        mask = np.ones(n, dtype=bool)
+        for name in self.names:
+            lower, upper = self.limits(name, columns)
+            mask &= np.broadcast_to(upper >= lower, n)
+        for constraint in self.constraints:
+            mask &= np.broadcast_to(np.asarray(constraint(columns), dtype=bool), n)
+        return mask
+
+    def generate(self, rng, n, method="lhs"):
+        if method == "lhs":
+            return lhs(rng, n, self.dim)
+        if method == "sobol":
+            return sobol(rng, n, self.dim)
+        if method == "random":
+            return rng.random((n, self.dim))
+        raise ValueError(f"Unknown sampling method {method}.")
+
+    def stratified(self, rng, unit, strata, size):
+        """
+        size unit cube points whose coordinates fall in the least filled of strata bins of every
+        variable (counting the points of unit), paired at random across variables.
+        """
+        points = np.empty((size, self.dim))
+        for j in range(self.dim):
+            counts = np.bincount((unit[:, j] * strata).astype(np.int64), minlength=strata)[:strata]
+            order = np.argsort(counts + rng.random(strata), kind="stable")
+            points[:, j] = (rng.permutation(np.resize(order, size)) + rng.random(size)) / strata
+        return points
+
+    def occupancy(self, unit, strata, candidates):
+        # How many points of unit share the strata of every candidate, summed over the variables
+        score = np.zeros(len(candidates))
+        for j in range(self.dim):
+            counts = np.bincount((unit[:, j] * strata).astype(np.int64), minlength=strata)
+            score += counts[np.minimum((candidates[:, j] * strata).astype(np.int64), strata - 1)]
+        return score
+
+    def fill(self, rng, unit, n, oversample=1.2, max_rounds=100, rate=None):
+        """
+        Adds valid stratified points to unit until it holds n, in rounds sized by the acceptance rate.
+        """
+        strata = n
+        for _ in range(max_rounds):
+            missing = n - len(unit)
+            if missing <= 0:
+                return unit[:n]
+            size = int(np.ceil(missing / max(1.0 if rate is None else rate, 1e-3) * oversample))
+            candidates = self.stratified(rng, unit, strata, size)
+            accepted = candidates[self.valid(self.transform(candidates))]
+            rate = max(len(accepted) / size, 1e-3)
+            if len(accepted) > missing:
+                accepted = accepted[np.argsort(self.occupancy(unit, strata, accepted), kind="stable")[:missing]]
+            unit = np.vstack([unit, accepted])
+        raise RuntimeError(
+            f"Only {len(unit)} valid samples found after {max_rounds} rounds. "
+            f"Consider relaxing the constraints or building them into the bounds."
+        )
+
+    def sample(self, n, method="lhs", seed=None, oversample=1.2, max_rounds=100):
+        """
+        n valid designs as columns (name -> array): a first batch of method, then stratified top-ups.
+        """
+        rng = np.random.default_rng(seed)
+        unit = self.generate(rng, int(np.ceil(n * oversample)), method)
+        valid = self.valid(self.transform(unit))
+        unit = unit[valid]
+        return self.transform(self.fill(rng, unit[:n], n, oversample, max_rounds, valid.mean()))
+
+    def top_up(self, samples, m, seed=None, oversample=1.2, max_rounds=100):
+        """
+        samples (columns) with m more valid designs, drawn from the strata the existing ones leave
+        emptiest out of as many strata as there will be designs.
+        """
+        rng = np.random.default_rng(seed)
+        unit = self.inverse(samples)
+        return self.transform(self.fill(rng, unit, len(unit) + m, oversample, max_rounds))
@@ -3,25 +3,48 @@ import os
 from re import A
 from tokenize import String
 from typing import Union, Dict, Literal
-import win32com.client as win32
 import numpy as np
 import time
 
 
-class Simulation:
-    AspenSimulation = win32.gencache.EnsureDispatch("Apwn.Document")
+def aspen_backend():
+    # Imported here so that the modules stay importable without pywin32/Aspen
+    import win32com.client as win32
+
+    return win32.gencache.EnsureDispatch("Apwn.Document")
+
 
-    def __init__(self, AspenFileName, WorkingDirectoryPath, VISIBILITY=False):
+class Simulation:
+    def __init__(
+        self, AspenFileName, WorkingDirectoryPath, VISIBILITY=False, backend=aspen_backend
+    ):
         os.chdir(WorkingDirectoryPath)
         print(f"Working Directory: {os.getcwd()}")
         print(f"Aspen File: {AspenFileName}")
-        self.AspenSimulation.InitFromArchive2(os.path.abspath(AspenFileName))
-        self.AspenSimulation.Visible = VISIBILITY
-        self.AspenSimulation.SuppressDialogs = True
+        self.AspenFilePath = os.path.abspath(AspenFileName)
+        self.VISIBILITY = VISIBILITY
+        self.backend = backend
+        self.simulation = self
+        self._engine = None
+
+    @property
+    def engine(self):
+        # The engine is only dispatched the first time it is needed
+        if self._engine is None:
+            self._engine = self.backend()
+            self._engine.InitFromArchive2(self.AspenFilePath)
+            self._engine.Visible = self.VISIBILITY
+            self._engine.SuppressDialogs = True
+        return self._engine
+
+    @property
+    def AspenSimulation(self):
+        return self.simulation.engine
 
     def CloseAspen(self):
         AspenFileName = self.Give_AspenDocumentName()
         self.AspenSimulation.Close(os.path.abspath(AspenFileName))
+        self._engine = None
 
     def Give_AspenDocumentName(self):
         return self.AspenSimulation.FullName
@@ -71,7 +94,8 @@ class Simulation:
 
 
 class Stream(Simulation):
-    def __init__(self, name, inlet=False):
+    def __init__(self, name, inlet=False, *, sim):
+        self.simulation = sim
         self.name = name.upper()
         self.inlet = inlet
 
@@ -162,7 +186,8 @@ class Stream(Simulation):
 
 
 class Block(Simulation):
-    def __init__(self, name, uo):
+    def __init__(self, name, uo, sim):
+        self.simulation = sim
         self.name = name.upper()
         self.uo = uo
 
@@ -179,7 +204,7 @@ class Block(Simulation):
 
 class Mixer(Block):
     def __init__(self, name, inlet_stream, mixer_count):
-        super().__init__(name, "Mixer")
+        super().__init__(name, "Mixer", inlet_stream.simulation)
         self.name = name
         self.inlet_stream = inlet_stream
         self.mixer_count = mixer_count
@@ -192,14 +217,14 @@ class Mixer(Block):
         if self.mixer_count == 1:
             s = None
         else:
-            s = Stream(f"{self.name}OUT")
+            s = Stream(f"{self.name}OUT", sim=self.simulation)
             self.StreamConnect(self.name, s.name, "P(OUT)")
         return s
 
 
 class Splitter(Block):
     def __init__(self, name, sr, inlet_stream):
-        super().__init__(name, "FSplit")
+        super().__init__(name, "FSplit", inlet_stream.simulation)
 
         self.name = name
         self.sr = sr
@@ -210,8 +235,8 @@ class Splitter(Block):
     def split(self):
         self.StreamConnect(self.name, self.inlet_stream.name, "F(IN)")
 
-        s1 = Stream(f"{self.name}S1OUT")
-        s2 = Stream(f"{self.name}S2OUT")
+        s1 = Stream(f"{self.name}S1OUT", sim=self.simulation)
+        s2 = Stream(f"{self.name}S2OUT", sim=self.simulation)
 
         self.StreamConnect(self.name, s1.name, "P(OUT)")
         self.StreamConnect(self.name, s2.name, "P(OUT)")
@@ -224,7 +249,7 @@ class Splitter(Block):
 
 class Heater(Block):
     def __init__(self, name, Temp, Pres, inlet_stream):
-        super().__init__(name, "Heater")
+        super().__init__(name, "Heater", inlet_stream.simulation)
 
         self.name = name
         self.Temp = Temp
@@ -244,7 +269,7 @@ class Heater(Block):
             "PRES"
         ).Value = self.Pres
 
-        s = Stream(f"{self.name}OUT")
+        s = Stream(f"{self.name}OUT", sim=self.simulation)
         self.StreamConnect(self.name, s.name, "P(OUT)")
         return s
 
@@ -255,7 +280,7 @@ class Heater(Block):
 
 class HeatExchanger(Block):
     def __init__(self, name, DT, inlet_stream, hex_count):
-        super().__init__(name, "HeatX")
+        super().__init__(name, "HeatX", inlet_stream.simulation)
 
         self.name = name
         self.DT = DT
@@ -267,7 +292,7 @@ class HeatExchanger(Block):
     def heat(self):
         if self.hex_count == 1:
             self.StreamConnect(self.name, self.inlet_stream.name, "H(IN)")
-            s = Stream(f"{self.name}HOUT")
+            s = Stream(f"{self.name}HOUT", sim=self.simulation)
             self.StreamConnect(self.name, s.name, "H(OUT)")
             self.BLK.Elements(self.name).Elements("Input").Elements(
                 "SPEC"
@@ -277,7 +302,7 @@ class HeatExchanger(Block):
             ).Value = self.DT
         else:
             self.StreamConnect(self.name, self.inlet_stream.name, "C(IN)")
-            s = Stream(f"{self.name}COUT")
+            s = Stream(f"{self.name}COUT", sim=self.simulation)
             self.StreamConnect(self.name, s.name, "C(OUT)")
 
         return s
@@ -289,7 +314,7 @@ class HeatExchanger(Block):
 
 class Cooler(Block):
     def __init__(self, name, Temp, Pres, inlet_stream):
-        super().__init__(name, "Heater")
+        super().__init__(name, "Heater", inlet_stream.simulation)
 
         self.name = name
         self.Temp = Temp
@@ -309,7 +334,7 @@ class Cooler(Block):
             "PRES"
         ).Value = self.Pres
 
-        s = Stream(f"{self.name}OUT")
+        s = Stream(f"{self.name}OUT", sim=self.simulation)
         self.StreamConnect(self.name, s.name, "P(OUT)")
         return s
 
@@ -320,7 +345,7 @@ class Cooler(Block):
 
 class Pump(Block):
     def __init__(self, name, press, inlet_stream):
-        super().__init__(name, "Pump")
+        super().__init__(name, "Pump", inlet_stream.simulation)
         self.name = name
         self.press = press
         self.inlet_stream = inlet_stream
@@ -339,7 +364,7 @@ class Pump(Block):
             "PRES"
         ).Value = self.press
 
-        s = Stream(f"{self.name}OUT")
+        s = Stream(f"{self.name}OUT", sim=self.simulation)
         self.StreamConnect(self.name, s.name, "P(OUT)")
         return s
 
@@ -350,7 +375,7 @@ class Pump(Block):
 
 class Turbine(Block):
     def __init__(self, name, press, inlet_stream):
-        super().__init__(name, "COMPR")
+        super().__init__(name, "COMPR", inlet_stream.simulation)
         self.name = name
         self.press = press
         self.inlet_stream = inlet_stream
@@ -375,7 +400,7 @@ class Turbine(Block):
             "PRES"
         ).Value = self.press
 
-        s = Stream(f"{self.name}OUT")
+        s = Stream(f"{self.name}OUT", sim=self.simulation)
         self.StreamConnect(self.name, s.name, "P(OUT)")
         return s
 
@@ -386,7 +411,7 @@ class Turbine(Block):
 
 class Compressor(Block):
     def __init__(self, name, press, inlet_stream):
-        super().__init__(name, "COMPR")
+        super().__init__(name, "COMPR", inlet_stream.simulation)
         self.name = name
         self.press = press
         self.inlet_stream = inlet_stream
@@ -411,7 +436,7 @@ class Compressor(Block):
             "PRES"
         ).Value = self.press
 
-        s = Stream(f"{self.name}OUT")
+        s = Stream(f"{self.name}OUT", sim=self.simulation)
         self.StreamConnect(self.name, s.name, "P(OUT)")
         return s
 
@@ -422,7 +447,7 @@ class Compressor(Block):
 
 class PFR(Block):
     def __init__(self, name, D, L, inlet_stream):
-        super().__init__(name, "RPlug")
+        super().__init__(name, "RPlug", inlet_stream.simulation)
         self.name = name
         self.inlet_stream = inlet_stream
         self.D = D
@@ -474,7 +499,7 @@ class PFR(Block):
         ).Value = 0.4
         self.BLK.Elements(self.name).Elements("Input").Elements("DIA_PART").Value = 3e-3
 
-        s = Stream(f"{self.name}OUT")
+        s = Stream(f"{self.name}OUT", sim=self.simulation)
         self.StreamConnect(self.name, s.name, "P(OUT)")
         return s
 
@@ -485,7 +510,7 @@ class PFR(Block):
 
 class PFR_A(Block):
     def __init__(self, name, D, L, inlet_stream):
-        super().__init__(name, "RPlug")
+        super().__init__(name, "RPlug", inlet_stream.simulation)
         self.name = name
         self.inlet_stream = inlet_stream
         self.D = D
@@ -518,14 +543,14 @@ class PFR_A(Block):
         nodes.InsertRow(1, nodes.Count)
         nodes(nodes.Count - 1).Value = "EGR"
 
-        s = Stream(f"{self.name}OUT")
+        s = Stream(f"{self.name}OUT", sim=self.simulation)
         self.StreamConnect(self.name, s.name, "P(OUT)")
         return s
 
 
 class Column(Block):
     def __init__(self, name, n_stages, press, inlet_stream):
-        super().__init__(name, "Radfrac")
+        super().__init__(name, "Radfrac", inlet_stream.simulation)
         self.name = name
         self.nstages = n_stages
         self.reflux_ratio = 0.024
@@ -578,9 +603,9 @@ class Column(Block):
         # Convergence
         self.BLK.Elements(self.name).Elements("Input").Elements("MAXOL").Value = 200
 
-        d = Stream(f"{self.name}DOUT")
+        d = Stream(f"{self.name}DOUT", sim=self.simulation)
         self.StreamConnect(self.name, d.name, "LD(OUT)")
-        b = Stream(f"{self.name}BOUT")
+        b = Stream(f"{self.name}BOUT", sim=self.simulation)
         self.StreamConnect(self.name, b.name, "B(OUT)")
         return d, b
 
@@ -613,7 +638,7 @@ class TriColumn(Block):
     def __init__(
         self, name, nstages, dist_rate, reflux_ratio, press, mid_rate, inlet_stream
     ):
-        super().__init__(name, "Radfrac")
+        super().__init__(name, "Radfrac", inlet_stream.simulation)
         self.name = name
         self.nstages = nstages
         self.dist_rate = dist_rate
@@ -686,11 +711,11 @@ class TriColumn(Block):
             "1"
         ).Value = "SIEVE"
 
-        d = Stream(f"{self.name}DOUT")
+        d = Stream(f"{self.name}DOUT", sim=self.simulation)
         self.StreamConnect(self.name, d.name, "LD(OUT)")
-        mid = Stream(f"{self.name}MOUT")
+        mid = Stream(f"{self.name}MOUT", sim=self.simulation)
         self.StreamConnect(self.name, mid.name, "SP(OUT)")
-        b = Stream(f"{self.name}BOUT")
+        b = Stream(f"{self.name}BOUT", sim=self.simulation)
         self.StreamConnect(self.name, b.name, "B(OUT)")
 
         self.BLK.Elements(self.name).Elements("Input").Elements("PROD_PHASE").Elements(
@@ -732,7 +757,7 @@ class TriColumn(Block):
 
 class CSTR_A(Block):
     def __init__(self, name, V, inlet_stream):
-        super().__init__(name, "RCSTR")
+        super().__init__(name, "RCSTR", inlet_stream.simulation)
         self.name = name
         self.inlet_stream = inlet_stream
         self.V = V
@@ -761,6 +786,6 @@ class CSTR_A(Block):
         nodes.InsertRow(1, nodes.Count)
         nodes(nodes.Count - 1).Value = "EGR"
 
-        s = Stream(f"{self.name}OUT")
+        s = Stream(f"{self.name}OUT", sim=self.simulation)
         self.StreamConnect(self.name, s.name, "P(OUT)")
         return s
@@ -340,7 +340,7 @@ class Flowsheet:
         for i in range(len(self.inlet_specs)):
             T, P, compounds = self.inlet_specs[i]
             Fco2 = compounds["CO2"]
-            sin[i] = Stream(f"IN{i+1}", self.inlet_specs[i])
+            sin[i] = Stream(f"IN{i+1}", self.inlet_specs[i], sim=self.sim)
 
             self.state[i] = np.array([T, P, Fco2])
 
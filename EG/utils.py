@@ -1,4 +1,8 @@
 import re
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 
 class_dict = {
     "Feed": ("F", "S"),
@@ -36,6 +40,7 @@ class_dict = {
 equipment_dict = {i: name for i, (name, _) in enumerate(class_dict.items())}
 string_integer_dict = {i: code for i, (code, _) in enumerate(class_dict.values())}
 equipment_characteristics = {i: char for i, (_, char) in enumerate(class_dict.values())}
+equipment_ids = {name: i for i, name in enumerate(class_dict)}
 
 Trial_strings = {
     "CstrD": "F1cMHCstrCstrCDcrP1sPump1eEnd",
@@ -48,6 +53,149 @@ Trial_strings = {
 }
 
 
+SCO2_classes = ["G", "T", "A", "C", "H", "a", "b", "1", "2", "-1", "-2", "E"]
+
+
+class TokenCodec:
+    """
+    Encodes and decodes batches of flowsheet strings as token ids of a vocabulary.
+    style="tokens": a token is a capital letter or digit followed by lowercase letters (EG strings),
+    style="letters": a token is one character, or a "-" and the next one (SCO2 layouts).
+    Tokens not in the vocabulary are encoded as -1. A batch is kept ragged as the flat ids and the
+    offsets of each string in them (offsets[i]:offsets[i + 1]).
+    """
+
+    def __init__(self, vocabulary, style="tokens"):
+        if len(vocabulary) > 127:
+            raise ValueError("The vocabulary must fit in int8 ids.")
+        self.vocabulary = list(vocabulary)
+        self.index = {token: i for i, token in enumerate(self.vocabulary)}
+        self.style = style
+        self.width = max(len(token) for token in self.vocabulary)
+        if self.width > 7:
+            raise ValueError("Tokens must be at most 7 characters long.")
+        self.weights = 256 ** np.arange(self.width - 1, -1, -1, dtype=np.int64)
+
+        # Tokens as bytes padded to width, their integer keys sorted for the lookups
+        table = np.zeros((len(self.vocabulary), self.width), dtype=np.uint8)
+        for i, token in enumerate(self.vocabulary):
+            table[i, : len(token)] = np.frombuffer(token.encode("ascii"), dtype=np.uint8)
+        self.table = table
+        self.lengths = np.array([len(token) for token in self.vocabulary])
+        keys = table.astype(np.int64) @ self.weights
+        order = np.argsort(keys)
+        self.keys = keys[order]
+        self.ids = order.astype(np.int8)
+
+    def tokenize(self, string):
+        if self.style == "tokens":
+            return re.findall(r"[A-Z0-9][a-z]*", string)
+        return re.findall(r"-?.", string)
+
+    def encode_one(self, string):
+        return [self.index.get(token, -1) for token in self.tokenize(string)]
+
+    def decode_one(self, ids):
+        return "".join(self.vocabulary[i] for i in ids)
+
+    def encode(self, strings):
+        """
+        Token ids (int8) and offsets of a batch of strings, tokenized together over their bytes.
+        """
+        strings = list(strings)
+        lengths = np.fromiter(map(len, strings), dtype=np.int64, count=len(strings))
+        buffer = np.frombuffer("".join(strings).encode("ascii"), dtype=np.uint8)
+        size = len(buffer)
+        bounds = np.concatenate([[0], np.cumsum(lengths)])
+        row_start = np.zeros(size + 1, dtype=bool)
+        row_start[bounds] = True
+        row_start = row_start[:size]
+
+        if self.style == "tokens":
+            lead = ((buffer >= ord("A")) & (buffer <= ord("Z"))) | ((buffer >= ord("0")) & (buffer <= ord("9")))
+            starts = lead | row_start
+        else:
+            dash = buffer == ord("-")
+            starts = np.ones(size, dtype=bool)
+            starts[1:] = ~dash[:-1]
+            starts |= row_start
+        positions = np.flatnonzero(starts)
+        token_lengths = np.diff(np.append(positions, size))
+
+        # Integer key of each token from its first width bytes
+        columns = np.arange(self.width)
+        index = np.minimum(positions[:, None] + columns, max(size - 1, 0))
+        chars = np.where(columns < token_lengths[:, None], buffer[index] if size else 0, 0)
+        keys = chars.astype(np.int64) @ self.weights
+        slot = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        ids = np.where((self.keys[slot] == keys) & (token_lengths <= self.width), self.ids[slot], -1).astype(np.int8)
+
+        if self.style == "tokens":
+            # Lowercase letters at the start of a string are not part of any token
+            keep = lead[positions]
+            ids, positions = ids[keep], positions[keep]
+        rows = np.searchsorted(bounds, positions, side="right") - 1
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=len(strings)))])
+        return ids, offsets
+
+    def decode(self, ids, offsets):
+        ids = np.asarray(ids)
+        if len(ids) and ids.min() < 0:
+            raise ValueError("Unknown tokens (-1) can not be decoded.")
+        lengths = self.lengths[ids]
+        chars = self.table[ids][np.arange(self.width) < lengths[:, None]]
+        text = chars.tobytes().decode("ascii")
+        bounds = np.concatenate([[0], np.cumsum(lengths)])[np.asarray(offsets)]
+        return [text[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def pad(self, ids, offsets, length=None, fill=-1):
+        """
+        Padded (strings, length) int8 array of a batch, longer strings are truncated.
+        """
+        offsets = np.asarray(offsets)
+        counts = np.diff(offsets)
+        if length is None:
+            length = int(counts.max()) if len(counts) else 0
+        padded = np.full((len(counts), length), fill, dtype=np.int8)
+        rows = np.repeat(np.arange(len(counts)), counts)
+        columns = np.arange(len(ids)) - np.repeat(offsets[:-1], counts)
+        keep = columns < length
+        padded[rows[keep], columns[keep]] = np.asarray(ids)[keep]
+        return padded
+
+    def unpad(self, padded, fill=-1):
+        padded = np.asarray(padded)
+        keep = padded != fill
+        offsets = np.concatenate([[0], np.cumsum(keep.sum(axis=1))])
+        return padded[keep].astype(np.int8), offsets
+
+    def one_hot(self, ids, offsets, length=None, dtype=np.uint8):
+        """
+        (strings, length, vocabulary) one-hot tensor of a batch, padding and unknown tokens are zero rows.
+        """
+        padded = self.pad(ids, offsets, length)
+        return (padded[..., None] == np.arange(len(self.vocabulary))).astype(dtype)
+
+    def save(self, path, strings):
+        """
+        Packed dataset: the ids and offsets of the strings with the vocabulary they refer to.
+        """
+        self.pack(path, *self.encode(strings))
+
+    def pack(self, path, ids, offsets):
+        np.savez(path, ids=np.asarray(ids, dtype=np.int8), offsets=offsets, vocabulary=np.array(self.vocabulary))
+
+    def load(self, path):
+        with np.load(path) as data:
+            if data["vocabulary"].tolist() != self.vocabulary:
+                raise ValueError(f"{path} was packed with another vocabulary.")
+            return data["ids"], data["offsets"]
+
+
+EG_codec = TokenCodec(list(string_integer_dict.values()))
+SCO2_codec = TokenCodec(SCO2_classes, style="letters")
+
+
 def equipment_to_string(equipment):
     equipment_string = []
     for eq in equipment:
@@ -56,14 +204,7 @@ def equipment_to_string(equipment):
 
 
 def string_to_equipment(equipment_string):
-    tokens = re.findall(r"[A-Z0-9][a-z]*", equipment_string)
-    equipment = []
-    for token in tokens:
-        for key, value in string_integer_dict.items():
-            if value == token:
-                equipment.append(key)
-                break
-    return equipment
+    return [i for i in EG_codec.encode_one(equipment_string) if i >= 0]
 
 
 def string_to_simplestring(equipment_string):
@@ -93,3 +234,725 @@ def string_to_simplestring(equipment_string):
             simplified += base
 
     return simplified[:-1]
+
+
+connectivity_errors = {
+    1: "Unknown equipment token.",
+    2: "There must be exactly one feed in the equipment list.",
+    3: "There must be exactly one end in the equipment list.",
+    4: "The first equipment must be a feed.",
+    5: "The last equipment must be an end.",
+    6: "There must be exactly one product equipment in the equipment list.",
+    7: "The product equipment must not be the second equipment in the list.",
+    8: "The product equipment must be followed by a subbranch 1 starter or end token.",
+    9: "The last equipment before the end token must be a product or subbranch end.",
+    10: "Subbranch starters must come after the product equipment.",
+    11: "The number of subbranch starter tokens must match the number of multiple input/output equipment tokens.",
+    12: "Subbranch starter tokens must come after the corresponding multiple input/output equipment tokens.",
+    13: "The number of subbranch starters must match the number of subbranch ends.",
+    14: "The number of subbranch starters must match the number of subbranch connectors.",
+    15: "Subbranch starter tokens must be unique.",
+    16: "Subbranch end tokens must be unique.",
+    17: "Subbranch connector tokens must be unique.",
+    18: "If there is only one subbranch starter, it must be Subbranch 1 starter.",
+    19: "If there is only one subbranch starter, the corresponding end must be Subbranch 1 end point.",
+    20: "If there is only one subbranch starter, the corresponding connector must be Subbranch 1 connection point.",
+    21: "If there are two subbranch starters, they must be Subbranch 1 starter and Subbranch 2 starter.",
+    22: "If there are two subbranch starters, first end must be Subbranch 1 end point and second end must be Subbranch 2 end point.",
+    23: "Subbranch 1 end must come before Subbranch 2 starter.",
+    24: "Subbranch end must come after the corresponding subbranch starter.",
+    25: "Subbranch connectors must be followed by a mixer or subbranch end.",
+    26: "Mixer must be preceded by a subbranch connector.",
+    27: "There must be exactly two HeatExchanger A tokens (Hxa) or none.",
+    28: "HeatExchanger A tokens (Hxa) must not be consecutive.",
+    29: "There must be exactly two HeatExchanger B tokens (Hxb) or none.",
+    30: "HeatExchanger B tokens (Hxb) must not be consecutive.",
+    31: "SCO2 process must have at least one heater, one cooler, one compressor, and one turbine.",
+    32: "The same equipment cannot be used twice consecutively.",
+}
+
+
+class ConnectivityValidator:
+    """
+    The connectivity rules of Flowsheet_generator compiled into a single-pass automaton over token ids.
+    A batch is read one position at a time for all sequences together, keeping per sequence the token
+    counts, the last two tokens and the order of the subbranch tokens; the rules on neighbouring tokens
+    are a lookup in a table of token pairs. Each sequence gets an error code, 0 when it is valid and
+    otherwise the first rule it breaks in the order of connectivity_errors.
+    """
+
+    def __init__(self, process="generic", chunk=65536):
+        names = list(class_dict)
+        self.process = process
+        self.chunk = chunk
+        self.size = size = len(names)
+        self.feed, self.mixer = names.index("Feed"), names.index("Mixer")
+        self.product, self.end = names.index("Product"), names.index("End")
+        self.hxa, self.hxb = names.index("HeatExchanger A"), names.index("HeatExchanger B")
+        self.starters = [names.index(f"Subbranch {k} starter") for k in (1, 2, 3)]
+        self.ends = [names.index(f"Subbranch {k} end point") for k in (1, 2, 3)]
+        self.connectors = [names.index(f"Subbranch {k} connection point") for k in (1, 2, 3)]
+        self.multi_io = [i for i, char in equipment_characteristics.items() if char == "M"]
+        self.required = []
+        if process == "SCO2":
+            self.required = [names.index(name) for name in ("Heater", "Cooler", "Compressor", "Turbine")]
+
+        # Token classes, the extra entry (size) marks padding and the start of a sequence
+        self.is_starter = np.isin(np.arange(size + 1), self.starters)
+        self.is_end = np.isin(np.arange(size + 1), self.ends)
+        self.is_multi = np.isin(np.arange(size + 1), self.multi_io)
+
+        # Error code of each (previous, current) token pair
+        self.pairs = np.zeros((size + 1, size + 1), dtype=np.int8)
+        tokens = list(range(size))
+        other = lambda allowed: [i for i in tokens if i not in allowed]
+        self.forbid(8, [self.product], other([self.starters[0], self.end]))
+        self.forbid(25, self.connectors, other([self.mixer] + self.ends))
+        self.forbid(26, other(self.connectors) + [size], [self.mixer])
+        self.forbid(28, [self.hxa], [self.hxa])
+        self.forbid(30, [self.hxb], [self.hxb])
+        if process == "SCO2":
+            for i in tokens:
+                self.forbid(32, [i], [i])
+
+    def forbid(self, code, previous, current):
+        block = np.ix_(previous, current)
+        self.pairs[block] = np.where(self.pairs[block] == 0, code, np.minimum(self.pairs[block], code))
+
+    def check(self, equipment):
+        return int(self.validate_lists([equipment])[0])
+
+    def validate_lists(self, sequences):
+        sequences = list(sequences)
+        lengths = np.fromiter(map(len, sequences), dtype=np.int64, count=len(sequences))
+        ids = np.fromiter((i for sequence in sequences for i in sequence), dtype=np.int64, count=lengths.sum())
+        return self.validate(ids, np.concatenate([[0], np.cumsum(lengths)]))
+
+    def validate(self, ids, offsets):
+        """
+        Error codes (int8) of a batch of token sequences given as ids and offsets (TokenCodec.encode).
+        """
+        ids, offsets = np.asarray(ids, dtype=np.int64), np.asarray(offsets, dtype=np.int64)
+        codes = []
+        for start in range(0, len(offsets) - 1, self.chunk):
+            bounds = offsets[start : start + self.chunk + 1]
+            codes.append(self.run(ids[bounds[0] : bounds[-1]], bounds - bounds[0]))
+        return np.concatenate(codes) if codes else np.zeros(0, dtype=np.int8)
+
+    def run(self, ids, offsets):
+        size = self.size
+        lengths = np.diff(offsets)
+        n, width = len(lengths), int(lengths.max())
+        rows = np.arange(n)
+        known = (ids >= 0) & (ids < size)
+        padded = np.full((n, width), size, dtype=np.int64)
+        owner = np.repeat(rows, lengths)
+        padded[owner, np.arange(len(ids)) - offsets[owner]] = np.where(known, ids, size)
+
+        error = np.full(n, 127, dtype=np.int8)
+
+        def flag(code, mask):
+            error[mask & (error > code)] = code
+
+        flag(1, np.isin(rows, owner[~known]))
+
+        counts = np.zeros((n, size + 1), dtype=np.int16)
+        previous = np.full(n, size)
+        before = np.full(n, size)
+        starters_seen = np.zeros(n, dtype=np.int16)
+        ends_seen = np.zeros(n, dtype=np.int16)
+        multi_seen = np.zeros(n, dtype=np.int16)
+        first_starter, second_starter = np.full(n, -1), np.full(n, -1)
+        first_end, second_end = np.full(n, -1), np.full(n, -1)
+        early_second = np.zeros(n, dtype=bool)
+        for t in range(width):
+            token = padded[:, t]
+            live = t < lengths
+            pair = self.pairs[previous, token]
+            np.minimum(error, np.where(pair > 0, pair, 127).astype(np.int8), out=error)
+            counts[rows, token] += 1
+
+            multi_seen += self.is_multi[token]
+            starter = self.is_starter[token]
+            starters_seen += starter
+            flag(10, starter & (counts[:, self.product] == 0))
+            flag(12, starter & (starters_seen > multi_seen))
+            early_second |= starter & (starters_seen == 2) & (ends_seen == 0)
+            second_starter = np.where(starter & (first_starter >= 0) & (second_starter < 0), token, second_starter)
+            first_starter = np.where(starter & (first_starter < 0), token, first_starter)
+
+            end = self.is_end[token]
+            ends_seen += end
+            flag(24, end & (ends_seen > starters_seen))
+            second_end = np.where(end & (first_end >= 0) & (second_end < 0), token, second_end)
+            first_end = np.where(end & (first_end < 0), token, first_end)
+
+            if t == 1:
+                flag(7, token == self.product)
+            before = np.where(live, previous, before)
+            previous = np.where(live, token, previous)
+
+        first = padded[:, 0] if width else np.full(n, size)
+        flag(2, counts[:, self.feed] != 1)
+        flag(3, counts[:, self.end] != 1)
+        flag(4, first != self.feed)
+        flag(5, previous != self.end)
+        flag(6, counts[:, self.product] != 1)
+        flag(9, ~np.isin(before, [self.product] + self.ends))
+        flag(11, starters_seen != multi_seen)
+        flag(13, starters_seen != ends_seen)
+        flag(14, starters_seen != counts[:, self.connectors].sum(axis=1))
+        flag(15, (counts[:, self.starters] > 1).any(axis=1))
+        flag(16, (counts[:, self.ends] > 1).any(axis=1))
+        flag(17, (counts[:, self.connectors] > 1).any(axis=1))
+        one = starters_seen == 1
+        flag(18, one & (counts[:, self.starters[0]] != 1))
+        flag(19, one & (counts[:, self.ends[0]] != 1))
+        flag(20, one & (counts[:, self.connectors[0]] != 1))
+        two = starters_seen == 2
+        flag(21, two & ((first_starter != self.starters[0]) | (second_starter != self.starters[1])))
+        flag(22, two & ((first_end != self.ends[0]) | (second_end != self.ends[1])))
+        flag(23, two & early_second)
+        flag(27, ~np.isin(counts[:, self.hxa], (0, 2)))
+        flag(29, ~np.isin(counts[:, self.hxb], (0, 2)))
+        if self.required:
+            flag(31, (counts[:, self.required] == 0).any(axis=1))
+        return np.where(error == 127, 0, error).astype(np.int8)
+
+
+def arrange(rng, items, constrained):
+    """
+    Random order of items in which no constrained item follows an equal one, None if there is none.
+    Items are drawn one at a time in proportion to their counts, among those that leave an arrangeable rest.
+    """
+    counts = Counter(items)
+    remaining = len(items)
+    if any(counts[item] > (remaining + 1) // 2 for item in counts if item in constrained):
+        return None
+    order, previous = [], None
+    while remaining:
+        remaining -= 1
+        # An item that would be over half of the rest has to be placed now
+        critical = [item for item, count in counts.items() if item in constrained and count > (remaining + 1) // 2]
+        options, weights = [], []
+        for item, count in counts.items():
+            if count == 0 or (item == previous and item in constrained) or (critical and item not in critical):
+                continue
+            if item in constrained and count - 1 > remaining // 2:
+                continue
+            options.append(item)
+            weights.append(count)
+        pick = rng.random() * sum(weights)
+        for item, weight in zip(options, weights):
+            pick -= weight
+            if pick < 0:
+                break
+        counts[item] -= 1
+        order.append(item)
+        previous = item
+    return order
+
+
+def generate_flowsheet(rng, main_tokens, min_length=8, max_length=20, max_subbranches=3, process="SCO2", main_fraction=0.6):
+    """
+    Builds a random equipment list that satisfies the connectivity rules by construction:
+    F [main branch] P [1s subbranch 1e [2s subbranch 2e [3s subbranch 3e]]] End
+    Every subbranch comes with a splitter placed before its starter and a connector-mixer pair, heat
+    exchanger tokens come in pairs and the branches are ordered so that no rule on neighbours is broken.
+    """
+    ids = equipment_ids
+    if any(equipment_characteristics[token] != "B" for token in main_tokens):
+        raise ValueError("Main tokens must be basic equipment.")
+    required = [ids[name] for name in ("Heater", "Cooler", "Compressor", "Turbine")] if process == "SCO2" else []
+    hx_tokens = [ids["HeatExchanger A"], ids["HeatExchanger B"]]
+    if max(min_length, 3 + max(len(required), 1)) > max_length:
+        raise ValueError("No flowsheet fits between min_length and max_length.")
+    while True:
+        subbranches = int(rng.integers(0, max_subbranches + 1))
+        hx_pairs = int(rng.integers(0, 3))
+        fixed = 3 + 5 * subbranches + 2 * hx_pairs
+        low = max(min_length, fixed + max(len(required), 1))
+        if low > max_length:
+            continue
+        length = int(rng.integers(low, max_length + 1))
+        basic = required + rng.choice(main_tokens, size=length - fixed - len(required)).tolist()
+        items = [(token,) for token in basic + [token for token in hx_tokens[:hx_pairs] for _ in range(2)]]
+        items += [(ids[f"Subbranch {k} connection point"], ids["Mixer"]) for k in range(1, subbranches + 1)]
+
+        # The j-th splitter has to come before the starter of subbranch j, so it stays in a branch < j
+        regions = [[] for _ in range(subbranches + 1)]
+        region = 0
+        for j in range(1, subbranches + 1):
+            region = int(rng.integers(region, j))
+            regions[region].append((ids["Splitter"],))
+        for item in items:
+            if subbranches == 0 or rng.random() < main_fraction:
+                regions[0].append(item)
+            else:
+                regions[int(rng.integers(1, subbranches + 1))].append(item)
+
+        constrained = {item for item in items if len(item) == 1 and (process == "SCO2" or item[0] in hx_tokens)}
+        if process == "SCO2":
+            constrained.add((ids["Splitter"],))
+        branches = [arrange(rng, region, constrained) for region in regions]
+        if any(branch is None for branch in branches):
+            continue
+
+        equipment = [ids["Feed"]] + [token for item in branches[0] for token in item] + [ids["Product"]]
+        for k, branch in enumerate(branches[1:], 1):
+            equipment.append(ids[f"Subbranch {k} starter"])
+            equipment += [token for item in branch for token in item]
+            equipment.append(ids[f"Subbranch {k} end point"])
+        equipment.append(ids["End"])
+        return equipment
+
+
+def generate_chunk(task):
+    seed, size, settings = task
+    rng = np.random.default_rng(seed)
+    return [generate_flowsheet(rng, **settings) for _ in range(size)]
+
+
+def generate_flowsheets(n, prefix, main_tokens, workers=4, seed=42, chunk=4096, shard_size=100000, max_stale=16, **settings):
+    """
+    Streams n unique flowsheets to the shards prefix_0000.npz, prefix_0001.npz, ... (TokenCodec.pack).
+    Chunks are built by a process pool, each with its own seed spawned from seed, checked by the
+    ConnectivityValidator and deduplicated with a hash set. The generation stops early when max_stale
+    chunks in a row bring no new flowsheet.
+    """
+    settings = dict(settings, main_tokens=list(main_tokens))
+    chunk = max(1, min(chunk, n))
+    validator = ConnectivityValidator(settings.get("process", "SCO2"))
+    seeds = np.random.SeedSequence(seed)
+    summary = {"sequences": 0, "duplicates": 0, "invalid": 0, "shards": []}
+    seen, shard = set(), []
+
+    def write():
+        path = f"{prefix}_{len(summary['shards']):04d}.npz"
+        lengths = [len(equipment) for equipment in shard]
+        ids = np.fromiter((token for equipment in shard for token in equipment), dtype=np.int8, count=sum(lengths))
+        EG_codec.pack(path, ids, np.concatenate([[0], np.cumsum(lengths)]))
+        summary["shards"].append(path)
+        shard.clear()
+
+    def tasks():
+        while True:
+            yield seeds.spawn(1)[0], chunk, settings
+
+    def chunks():
+        if workers <= 1:
+            for task in tasks():
+                yield generate_chunk(task)
+            return
+        with ProcessPoolExecutor(workers) as pool:
+            pending = deque()
+            try:
+                for task in tasks():
+                    pending.append(pool.submit(generate_chunk, task))
+                    if len(pending) >= 2 * workers:
+                        yield pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    stale = 0
+    for sequences in chunks():
+        codes = validator.validate_lists(sequences)
+        summary["invalid"] += int(np.count_nonzero(codes))
+        new = 0
+        for equipment, code in zip(sequences, codes):
+            key = bytes(equipment)
+            if code or key in seen:
+                summary["duplicates"] += not code
+                continue
+            seen.add(key)
+            shard.append(equipment)
+            new += 1
+            if len(shard) == shard_size:
+                write()
+            if len(seen) == n:
+                break
+        stale = 0 if new else stale + 1
+        if len(seen) == n or stale == max_stale:
+            break
+    if shard:
+        write()
+    summary["sequences"] = len(seen)
+    return summary
+
+
+def random_below(rng, n):
+    """
+    Uniform integer in range(n) for Python integers of any size.
+    """
+    bits = n.bit_length()
+    while True:
+        value = int.from_bytes(rng.bytes((bits + 7) // 8), "little") >> (-bits % 8)
+        if value < n:
+            return value
+
+
+class FlowsheetSpace:
+    """
+    Exact counting, ranking and uniform sampling of the flowsheets generate_flowsheet can build.
+    The grammar is read left to right as a state machine: the branch being written, the last token
+    and the splitters, connectors, heat exchangers and required units used so far. The number of
+    completions of every (state, remaining length) is memoized, which orders all flowsheets of
+    min_length..max_length tokens: unrank(rank(equipment)) == equipment for every index in
+    range(count()), so disjoint index ranges can be enumerated by independent workers.
+    """
+
+    def __init__(self, main_tokens, min_length=8, max_length=20, max_subbranches=3, process="SCO2"):
+        ids = equipment_ids
+        if any(equipment_characteristics[token] != "B" for token in main_tokens):
+            raise ValueError("Main tokens must be basic equipment.")
+        self.main_tokens = list(main_tokens)
+        self.min_length, self.max_length = min_length, max_length
+        self.max_subbranches = max_subbranches
+        self.process = process
+        self.required = [ids[name] for name in ("Heater", "Cooler", "Compressor", "Turbine")] if process == "SCO2" else []
+        if any(token not in self.main_tokens for token in self.required):
+            raise ValueError("Main tokens must include the required SCO2 equipment.")
+        # Bits of the units that have to be present, any basic unit for the generic process
+        self.found_bits = {token: 1 << self.required.index(token) for token in self.required}
+        self.complete = (1 << len(self.required)) - 1 if self.required else 1
+        self.feed, self.product, self.end = ids["Feed"], ids["Product"], ids["End"]
+        self.splitter, self.mixer = ids["Splitter"], ids["Mixer"]
+        self.hxa, self.hxb = ids["HeatExchanger A"], ids["HeatExchanger B"]
+        self.starters = [None] + [ids[f"Subbranch {k} starter"] for k in (1, 2, 3)]
+        self.ends = [None] + [ids[f"Subbranch {k} end point"] for k in (1, 2, 3)]
+        self.connectors = [None] + [ids[f"Subbranch {k} connection point"] for k in (1, 2, 3)]
+        self.transitions = {}
+        self.counts = {}
+
+    def repeated(self, token, last):
+        return token == last and (self.process == "SCO2" or token in (self.hxa, self.hxb))
+
+    def moves(self, state):
+        """
+        The (tokens, next state) steps from a state in their rank order, next state None ends the flowsheet.
+        """
+        if state in self.transitions:
+            return self.transitions[state]
+        region, last, splitters, connectors, hxa, hxb, found = state
+        moves = []
+        for token in self.main_tokens:
+            if not self.repeated(token, last):
+                bit = self.found_bits.get(token, 0) if self.required else 1
+                moves.append(((token,), (region, token, splitters, connectors, hxa, hxb, found | bit)))
+        if splitters < self.max_subbranches and not self.repeated(self.splitter, last):
+            moves.append(((self.splitter,), (region, self.splitter, splitters + 1, connectors, hxa, hxb, found)))
+        if hxa < 2 and last != self.hxa:
+            moves.append(((self.hxa,), (region, self.hxa, splitters, connectors, hxa + 1, hxb, found)))
+        if hxb < 2 and last != self.hxb:
+            moves.append(((self.hxb,), (region, self.hxb, splitters, connectors, hxa, hxb + 1, found)))
+        for k in range(1, self.max_subbranches + 1):
+            if not connectors & 1 << (k - 1):
+                moves.append(((self.connectors[k], self.mixer), (region, self.mixer, splitters, connectors | 1 << (k - 1), hxa, hxb, found)))
+        if region > 0 or last is not None:
+            close = self.product if region == 0 else self.ends[region]
+            if region < self.max_subbranches and splitters > region:
+                moves.append(((close, self.starters[region + 1]), (region + 1, None, splitters, connectors, hxa, hxb, found)))
+            finished = (
+                splitters == region
+                and connectors == (1 << region) - 1
+                and hxa in (0, 2)
+                and hxb in (0, 2)
+                and (hxa or not hxb)
+                and found == self.complete
+            )
+            if finished:
+                moves.append(((close, self.end), None))
+        self.transitions[state] = moves
+        return moves
+
+    def completions(self, state, remaining):
+        key = (state, remaining)
+        if key not in self.counts:
+            total = 0
+            for tokens, following in self.moves(state):
+                left = remaining - len(tokens)
+                if following is None:
+                    total += left == 0
+                elif left >= 2:
+                    total += self.completions(following, left)
+            self.counts[key] = total
+        return self.counts[key]
+
+    def start(self):
+        return (0, None, 0, 0, 0, 0, 0)
+
+    def count(self, length=None):
+        if length is None:
+            return sum(self.count(length) for length in range(self.min_length, self.max_length + 1))
+        return self.completions(self.start(), length - 1) if length >= 3 else 0
+
+    def rank(self, equipment):
+        equipment = list(equipment)
+        length = len(equipment)
+        if not self.min_length <= length <= self.max_length or equipment[0] != self.feed:
+            raise ValueError("The equipment list is not in the design space.")
+        index = sum(self.count(shorter) for shorter in range(self.min_length, length))
+        state, position = self.start(), 1
+        while state is not None:
+            remaining = length - position
+            for tokens, following in self.moves(state):
+                left = remaining - len(tokens)
+                if tuple(equipment[position : position + len(tokens)]) == tokens and (left == 0 if following is None else left >= 2):
+                    state, position = following, position + len(tokens)
+                    break
+                if following is None:
+                    index += left == 0
+                elif left >= 2:
+                    index += self.completions(following, left)
+            else:
+                raise ValueError("The equipment list is not in the design space.")
+        return index
+
+    def unrank(self, index):
+        if not 0 <= index:
+            raise IndexError("Index out of the design space.")
+        for length in range(self.min_length, self.max_length + 1):
+            if index < self.count(length):
+                break
+            index -= self.count(length)
+        else:
+            raise IndexError("Index out of the design space.")
+        equipment, state = [self.feed], self.start()
+        while state is not None:
+            remaining = length - len(equipment)
+            for tokens, following in self.moves(state):
+                left = remaining - len(tokens)
+                if following is None:
+                    size = int(left == 0)
+                else:
+                    size = self.completions(following, left) if left >= 2 else 0
+                if index < size:
+                    equipment += tokens
+                    state = following
+                    break
+                index -= size
+        return equipment
+
+    def enumerate(self, start, stop):
+        for index in range(start, stop):
+            yield self.unrank(index)
+
+    def sample(self, rng, size=None, length=None):
+        """
+        Flowsheets drawn uniformly from the whole space, or from those with the given length.
+        """
+        offset = sum(self.count(shorter) for shorter in range(self.min_length, length)) if length else 0
+        total = self.count(length)
+        if total == 0:
+            raise ValueError("The design space is empty.")
+        if size is None:
+            return self.unrank(offset + random_below(rng, total))
+        return [self.unrank(offset + random_below(rng, total)) for _ in range(size)]
+
+
+# Name prefix, outlet streams (suffix, port) and decision variables of the unit tokens
+unit_specs = {
+    "Mixer": ("M", (("OUT", "P(OUT)"),), ()),
+    "Splitter": ("S", (("S1OUT", "P(OUT)"), ("S2OUT", "P(OUT)")), ("FRAC",)),
+    "Heater": ("H", (("OUT", "P(OUT)"),), ("TEMP",)),
+    "Cooler": ("C", (("OUT", "P(OUT)"),), ("TEMP",)),
+    "Pump": ("PP", (("OUT", "P(OUT)"),), ("PRES",)),
+    "CSTR": ("CSTR", (("OUT", "P(OUT)"),), ("VOL", "PRES")),
+    "PFR": ("PFR", (("OUT", "P(OUT)"),), ("LENGTH", "DIAM")),
+    "DistillationColumn": ("DC", (("DOUT", "LD(OUT)"), ("BOUT", "B(OUT)")), ("NSTAGE", "BASIS_RR", "BASIS_B", "PRES1")),
+    "DistillationColumnwithRecycle": ("DCR", (("DOUT", "LD(OUT)"), ("BOUT", "B(OUT)")), ("NSTAGE", "BASIS_RR", "BASIS_B", "PRES1")),
+    "Compressor": ("COMP", (("OUT", "P(OUT)"),), ("PRES",)),
+    "Turbine": ("T", (("OUT", "P(OUT)"),), ("PRES",)),
+    "HeatExchanger A": ("HX", (("OUT1", "H(OUT)"), ("OUT2", "C(OUT)")), ("VALUE",)),
+    "HeatExchanger B": ("HX", (("OUT1", "H(OUT)"), ("OUT2", "C(OUT)")), ("VALUE",)),
+}
+
+# Bounds of the decision variables of each unit per process, (0, 0) when not given
+unit_bounds = {
+    "SCO2": {
+        "Splitter": ((0.1, 0.9),),
+        "Heater": ((32, 530),),
+        "Cooler": ((32, 530),),
+        "Compressor": ((74e5, 300e5),),
+        "Turbine": ((74e5, 300e5),),
+        "HeatExchanger A": ((4, 20),),
+        "HeatExchanger B": ((4, 20),),
+    },
+}
+
+integer_parameters = {"NSTAGE"}
+
+# Grid step of the decision variables of each process for snapping and memoizing evaluations, 0 to leave continuous
+parameter_resolutions = {
+    "SCO2": {"FRAC": 0.01, "TEMP": 0.1, "PRES": 1e3, "VALUE": 0.1},
+}
+
+
+class FlowsheetGraph:
+    """
+    An equipment list compiled into its units, streams and building steps.
+    Stream i goes from outlet source_port[i] of unit source[i] (-1: feed) to inlet target_port[i] of
+    unit target[i] (-1: product or open outlet). Building follows steps, tuples (action, unit, inlet
+    stream, outlet streams) with action "feed" (mixer of the feeds), "unit", "mixer", "hot" and "cold"
+    (the two sides of a heat exchanger) or "join" (a subbranch end entering its mixer).
+    The decision variables are a flat vector, unit u owning x[offsets[u] : offsets[u] + sizes[u]],
+    with bounds, integer flags and resolution (grid step, 0 when continuous) per variable.
+    """
+
+    def __init__(self, equipment, process="SCO2", feeds=1):
+        self.equipment = list(equipment)
+        self.process = process
+        self.names, self.kinds, self.positions = [], [], []
+        self.stream_names, self.source, self.source_port, self.target, self.target_port = [], [], [], [], []
+        self.steps = []
+        self.outlets = []
+        self.subbranches = {}
+        self.product = None
+        self.compile(feeds)
+        self.schema()
+
+    def add_stream(self, name, source, port):
+        self.stream_names.append(name)
+        self.source.append(source)
+        self.source_port.append(port)
+        self.target.append(-1)
+        self.target_port.append(-1)
+        return len(self.stream_names) - 1
+
+    def connect(self, stream, unit, port):
+        if self.target[stream] != -1:
+            raise ValueError(f"Stream {self.stream_names[stream]} is connected twice.")
+        self.target[stream], self.target_port[stream] = unit, port
+
+    def add_unit(self, kind, name, position):
+        self.names.append(name)
+        self.kinds.append(kind)
+        self.positions.append(position)
+        self.outlets.append([])
+        unit = len(self.names) - 1
+        for port, (suffix, _) in enumerate(unit_specs[kind][1]):
+            self.outlets[unit].append(self.add_stream(f"{name}{suffix}", unit, port))
+        return unit
+
+    def compile(self, feeds):
+        counts = Counter()
+        feed_streams = [self.add_stream(f"IN{i + 1}", -1, i) for i in range(feeds)]
+        current = feed_streams[0]
+        if feeds > 1:
+            counts["M"] += 1
+            unit = self.add_unit("Mixer", f"M{counts['M']}", 0)
+            for port, stream in enumerate(feed_streams):
+                self.connect(stream, unit, port)
+            self.steps.append(("feed", unit, -1, tuple(self.outlets[unit])))
+            current = self.outlets[unit][0]
+
+        multi_io, connector, mixers, ended, exchangers = 0, None, {}, {}, {}
+        for position, token in enumerate(self.equipment):
+            kind = equipment_dict[token]
+            if kind in unit_specs and current is None:
+                raise ValueError(f"{kind} at position {position} has no inlet stream.")
+            if kind.startswith("HeatExchanger "):
+                if kind not in exchangers:
+                    unit = exchangers[kind] = self.add_unit(kind, "HX1" if kind.endswith("A") else "HX2", position)
+                    self.connect(current, unit, 0)
+                    self.steps.append(("hot", unit, current, (self.outlets[unit][0],)))
+                    current = self.outlets[unit][0]
+                else:
+                    unit = exchangers[kind]
+                    self.positions[unit] = position
+                    self.connect(current, unit, 1)
+                    self.steps.append(("cold", unit, current, (self.outlets[unit][1],)))
+                    current = self.outlets[unit][1]
+            elif kind in unit_specs:
+                prefix = unit_specs[kind][0]
+                counts["DC" if prefix == "DCR" else prefix] += 1
+                unit = self.add_unit(kind, f"{prefix}{counts['DC' if prefix == 'DCR' else prefix]}", position)
+                self.connect(current, unit, 0)
+                outlets = self.outlets[unit]
+                if kind == "Mixer":
+                    self.steps.append(("mixer", unit, current, tuple(outlets)))
+                    if connector is not None:
+                        mixers[connector] = unit
+                        if connector in ended:
+                            self.connect(ended[connector], unit, 1)
+                            self.steps.append(("join", unit, ended.pop(connector), ()))
+                        connector = None
+                else:
+                    self.steps.append(("unit", unit, current, tuple(outlets)))
+                current = outlets[0]
+                if equipment_characteristics[token] == "M":
+                    # The second outlet starts the next subbranch, the bottoms of a column with recycle stay in the main branch
+                    multi_io += 1
+                    main, branch = (outlets[1], outlets[0]) if kind == "DistillationColumnwithRecycle" else outlets
+                    self.subbranches[multi_io] = branch
+                    current = main
+            elif kind == "Product":
+                self.product, current = current, None
+            elif kind.startswith("Subbranch "):
+                k = int(kind.split()[1])
+                if kind.endswith("starter"):
+                    if k not in self.subbranches:
+                        raise ValueError(f"Subbranch {k} starts before its splitter.")
+                    current = self.subbranches[k]
+                elif kind.endswith("end point"):
+                    if k in mixers:
+                        self.connect(current, mixers[k], 1)
+                        self.steps.append(("join", mixers[k], current, ()))
+                    else:
+                        ended[k] = current
+                    current = None
+                else:
+                    connector = k
+            if connector is not None and kind != "Mixer" and not kind.endswith("connection point"):
+                raise ValueError(f"Subbranch {connector} connector at position {position - 1} is not followed by a mixer.")
+        if ended:
+            raise ValueError(f"Subbranches {sorted(ended)} end without a connector.")
+
+    def schema(self):
+        self.offsets, self.sizes = [], []
+        self.dv_names, self.dv_units, bounds, integer, resolution = [], [], [], [], []
+        steps = parameter_resolutions.get(self.process, {})
+        for unit, (name, kind) in enumerate(zip(self.names, self.kinds)):
+            parameters = unit_specs[kind][2]
+            given = unit_bounds.get(self.process, {}).get(kind, ((0, 0),) * len(parameters))
+            self.offsets.append(len(self.dv_names))
+            self.sizes.append(len(parameters))
+            for parameter, bound in zip(parameters, given):
+                self.dv_names.append(f"{name}.{parameter}")
+                self.dv_units.append(unit)
+                bounds.append(bound)
+                integer.append(parameter in integer_parameters)
+                resolution.append(1 if parameter in integer_parameters else steps.get(parameter, 0))
+        self.size = len(self.dv_names)
+        self.offsets, self.sizes = np.array(self.offsets, dtype=int), np.array(self.sizes, dtype=int)
+        self.bounds = np.array(bounds, dtype=float).reshape(-1, 2)
+        self.integer = np.array(integer, dtype=bool)
+        self.resolution = np.array(resolution, dtype=float)
+
+    def flatten(self, decision_variables):
+        """
+        Flat vector of decision variables given one entry per equipment position (the former layout),
+        a heat exchanger takes the entry of its second token.
+        """
+        x = np.zeros(self.size)
+        for unit, position in enumerate(self.positions):
+            if self.sizes[unit]:
+                x[self.offsets[unit] : self.offsets[unit] + self.sizes[unit]] = np.ravel(decision_variables[position])
+        return x
+
+    def placements(self, x):
+        """
+        (unit name, value) of every unit with decision variables, a number or a list for several.
+        """
+        x = np.asarray(x, dtype=float)
+        if len(x) != self.size:
+            raise ValueError(f"Expected {self.size} decision variables, got {len(x)}.")
+        values = [int(round(v)) if integer else float(v) for v, integer in zip(x, self.integer)]
+        for name, offset, size in zip(self.names, self.offsets, self.sizes):
+            if size:
+                yield name, values[offset] if size == 1 else values[offset : offset + size]
+
+
+def compile_flowsheet(equipment, process="SCO2", feeds=1):
+    return FlowsheetGraph(equipment, process, feeds)